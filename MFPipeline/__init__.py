@@ -1,3 +1,5 @@
 import sys
 
-sys.path.append('.')
\ No newline at end of file
+sys.path.append('.')
+
+__version__ = "0.1.0"
@@ -1,7 +1,22 @@
+import ast
+import json
 import numpy as np
-from MFPipeline.fitting_support.pyLIMA import fit_pyLIMA
 
 
+def parse_config_string(config):
+    """
+    This function parses an analyst configuration passed as a string. The string is read as JSON first and then
+    as a Python literal, since str() of a python dictionary (e.g. with True or None) is not a valid JSON.
+
+    :param config: str, configuration of the Event Analyst
+    :return: dictionary with the configuration
+    """
+
+    try:
+        return json.loads(config)
+    except json.JSONDecodeError:
+        return ast.literal_eval(config)
+
 def cmd_catalogues_to_bands(catalogue):
     """
     This function provides a list of bands used to create a CMD with the requested catalogue.
@@ -31,6 +46,8 @@ def get_baseline_mag(mag_source, err_source, mag_blend, err_blend, fit_package,
 
     if not np.isnan(mag_source) and not np.isnan(mag_blend):
         if fit_package == "pyLIMA":
+            from MFPipeline.fitting_support.pyLIMA import fit_pyLIMA
+
             baseline_mag, err_baseline_mag = fit_pyLIMA.return_baseline_mag(mag_source, err_source,
                                                                             mag_blend, err_blend,
                                                                             log)
@@ -52,6 +69,8 @@ def get_blend_mag(mag_source, err_source, mag_base, err_base, fit_package, log):
 
     if not np.isnan(mag_source) and not np.isnan(mag_base):
         if fit_package == "pyLIMA":
+            from MFPipeline.fitting_support.pyLIMA import fit_pyLIMA
+
             blend_mag, err_blend_mag = fit_pyLIMA.return_blend_mag(mag_source, err_source,
                                                                    mag_base, err_base,
                                                                    log)
@@ -1,12 +1,31 @@
 import numpy as np
 import pandas as pd
-from astroquery.gaia import Gaia
-
-from plotly import graph_objs as go
 
 import os
+import threading
+from collections import OrderedDict
 
 from MFPipeline.analyst.analyst import Analyst
+from MFPipeline import timings
+
+# Number of catalogues kept in memory by one process, a warm worker analyses events from different fields.
+CATALOGUE_CACHE_SIZE = 8
+
+# key of the catalogue query (see CmdAnalyst.catalogue_key): data frame and band labels, least recently used first
+_catalogue_cache = OrderedDict()
+_catalogue_cache_lock = threading.Lock()
+# key of the catalogue query: lock held while the catalogue is loaded and the number of threads waiting for it,
+# so that only one of the threads missing the cache queries the remote service
+_catalogue_loading = {}
+
+
+def clear_catalogue_cache():
+    '''
+    Forgets all catalogues loaded by this process.
+    '''
+
+    with _catalogue_cache_lock:
+        _catalogue_cache.clear()
 
 class CmdAnalyst(Analyst):
     '''
@@ -37,6 +56,9 @@ class CmdAnalyst(Analyst):
 
     * `parallax_quality` float, parallax over error constrain demanded for a catalogue search in Gaia catalogues,
     * `separator` str, separator used in the file with the catalogue
+
+    The catalogue data do not depend on the solution, so they are kept in an in-process cache shared by all
+    CMD Analysts: the catalogue is queried or read once per event and catalogue, see :func:`load_catalogue_data`.
     '''
     def __init__(self,
                  event_name,
@@ -116,14 +138,76 @@ class CmdAnalyst(Analyst):
 
         return data, labels
 
+    def catalogue_key(self):
+        '''
+        Key of the catalogue in the in-process cache. A catalogue read from a file is identified by the path and
+        the modification time of the file, so an updated file is read again.
+
+        :return: tuple identifying the query
+        '''
+
+        if self.file_path is not None:
+            try:
+                modified = os.stat(self.file_path).st_mtime_ns
+            except OSError:
+                modified = None
+            return (self.catalogue_name, self.file_path, modified, repr(self.optional_kwargs))
+
+        return (self.catalogue_name, self.config["ra"], self.config["dec"], self.radius, repr(self.optional_kwargs))
+
     def load_catalogue_data(self):
         '''
         Loads catalogue data based on the catalogue name, and then selects sources within radius. Either loads
         the catalogue from a file, when `file_path` was specified, or from a selected survey, using astroquery.
+        Catalogues already loaded by this process for the same position and radius are taken from the cache;
+        the returned data frame is shared, so it should not be modified. When several threads miss the cache for
+        the same catalogue at once, only one of them loads it and the others wait for its result.
+
+        :return: a pandas data frame with data to create a cmd, and a list with band labels
+        '''
+
+        key = self.catalogue_key()
+        with _catalogue_cache_lock:
+            if key in _catalogue_cache:
+                _catalogue_cache.move_to_end(key)
+                self.log.debug("CMD Analyst: Catalogue %s taken from the cache." % self.catalogue_name)
+                return _catalogue_cache[key]
+            loading = _catalogue_loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+
+        try:
+            with loading[0]:
+                # another thread may have loaded the catalogue while this one was waiting
+                with _catalogue_cache_lock:
+                    if key in _catalogue_cache:
+                        _catalogue_cache.move_to_end(key)
+                        self.log.debug("CMD Analyst: Catalogue %s loaded by another thread." % self.catalogue_name)
+                        return _catalogue_cache[key]
+
+                with timings.stage_timer("cmd_query"):
+                    data, labels = self.query_catalogue_data()
+
+                if data is not None:
+                    with _catalogue_cache_lock:
+                        _catalogue_cache[key] = (data, labels)
+                        while len(_catalogue_cache) > CATALOGUE_CACHE_SIZE:
+                            _catalogue_cache.popitem(last=False)
+        finally:
+            with _catalogue_cache_lock:
+                loading[1] -= 1
+                if loading[1] == 0:
+                    del _catalogue_loading[key]
+
+        return data, labels
+
+    def query_catalogue_data(self):
+        '''
+        Loads catalogue data from a file or an online catalogue, without looking into the cache.
 
         :return: a pandas data frame with data to create a cmd, and a list with band labels
         '''
 
+        data, labels = None, None
         self.log.debug("CMD Analyst: Preparing to load the catalogue.")
         if self.file_path is not None:
             if (self.optional_kwargs != None and "separator" in self.optional_kwargs):
@@ -157,6 +241,8 @@ class CmdAnalyst(Analyst):
 
         :return: pandas data frame with magnitudes and labels of the bands used; the bands are `Gaia_G`, `Gaia_BP`, and `Gaia_RP` corresponding to `phot_g_mean_mag`, `phot_bp_mean_mag` and `phot_rp_mean_mag`.
         '''
+        from astroquery.gaia import Gaia
+
         table_name = ""
         if "DR3" in self.catalogue_name:
             table_name = "gaiadr3"
@@ -237,6 +323,8 @@ class CmdAnalyst(Analyst):
         :return: status of creating a cmd plot
         '''
 
+        from plotly import graph_objs as go
+
         self.log.debug("CMD Analyst: Plotting CMD started.")
         for i in range(len(cmd_labels)):
             self.log.debug("CMD Analyst: Plotting CMD for labels: %s"%cmd_labels[i])
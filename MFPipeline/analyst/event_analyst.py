@@ -7,11 +7,14 @@ import time
 from MFPipeline.analyst.analyst import Analyst
 
 from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
-from MFPipeline.analyst.fit_analyst import FitAnalyst
-from MFPipeline.analyst.cmd_analyst import CmdAnalyst
 
 from MFPipeline import logs
+from MFPipeline import timings
 from MFPipeline.analyst import analyst_tools
+from MFPipeline.analyst.light_curve_io import load_light_curve
+from MFPipeline.analyst.light_curve_set import LightCurveSet
+from MFPipeline.analyst.stage_graph import StageGraph
+from MFPipeline.time_limit import time_limit, TimeLimitExceeded
 
 
 class EventAnalyst(Analyst):
@@ -29,6 +32,31 @@ class EventAnalyst(Analyst):
     :param config_dict: dictionary, optional, dictionary with Event Analyst configuration
     :param config_path: str, optional, path to the YAML configuration file of the Event Analyst
     :param stream: optional, boolean, should the log be accessible through Kubernetes?
+    :param stage_timeouts: dict, optional, wall-clock limits in seconds for the stages (`lc_analyst`, `fit_analyst`,
+        `cmd_analyst`); limits given in the `stage_timeouts` section of the configuration take precedence
+
+    The stages of the analysis run as a dependency graph, see :class:`MFPipeline.analyst.stage_graph.StageGraph`:
+    the CMD catalogues are loaded in a background thread while the light curves are checked and fitted, the CMD
+    plots are made once the fit and the catalogues are done. The number of background threads is
+    set by the `stage_workers` keyword of the configuration (2 by default, 0 runs the stages one after another).
+    Time limits cannot interrupt a background thread, so the stages with limits (`lc_analyst`, `fit_analyst`,
+    `cmd_analyst`) run in the main thread.
+
+    Light curves given as text files are parsed once and kept as binary `.npy` copies, see
+    :func:`MFPipeline.analyst.light_curve_io.load_light_curve`. The `light_curve_cache` keyword of the configuration
+    sets the folder with the copies (a `.lc_cache` folder next to each file by default), false disables them.
+
+    With `binning` in the `lc_analyst` section the baseline of the light curves is binned after the quality check,
+    see :func:`MFPipeline.analyst.light_curve_analyst.LightCurveAnalyst.bin_light_curves`, and the models are fitted
+    to the binned light curves; with `polish` in the `fit_analyst` section the fits are repeated on the full light
+    curves, in narrow boundaries around the binned solutions.
+
+    The Fit Analyst and the CMD Analyst, with pyLIMA, astroquery and the plotting libraries, are imported only when
+    their stage runs, so an Event Analyst checking only the light curves starts quickly.
+
+    Every stage and fit is recorded as a span (wall-clock time, CPU time) in `timings.json` in the analyst folder,
+    see :func:`MFPipeline.timings.stage_timer`. With the `trace_allocations` keyword set to true the spans also
+    record the memory allocated by Python code, at the cost of a slower run.
     """
 
     def __init__(self,
@@ -38,11 +66,15 @@ class EventAnalyst(Analyst):
                  config_dict=None,
                  config_path=None,
                  stream=False,
+                 stage_timeouts=None,
                  ):
 
         super().__init__(event_name, analyst_path, config_dict=config_dict, config_path=config_path)
         # Analyst.__init__(self, event_name, analyst_path, config_dict=config_dict, config_path=config_path)
-        self.light_curves = []
+        self.light_curves = LightCurveSet.from_entries([])
+        # light curves before binning, None if they were not binned
+        self.full_light_curves = None
+        self.fit_results = {}
 
         # start
         self.log = logs.start_log(self.analyst_path, log_level, event_name=self.event_name, stream=stream)
@@ -59,6 +91,9 @@ class EventAnalyst(Analyst):
             self.log.error("Event Analyst: Error! Event Analyst needs information.")
             quit()
 
+        self.stage_timeouts = dict(stage_timeouts) if stage_timeouts is not None else {}
+        self.stage_timeouts.update(self.config.get("stage_timeouts", None) or {})
+
     def parse_event_config(self, config_path):
         """
         Parse YAML file with configuration, turn it into a dictionary and to
@@ -95,7 +130,12 @@ class EventAnalyst(Analyst):
                 else:
                     self.log.info("Event Analyst: No CMD Analyst config, it will not be launched.")
 
-                self.light_curves = self.parse_light_curves(event_config.get("light_curves"))
+                self.light_curves = self.parse_light_curves(event_config.get("light_curves"),
+                                                            cache_path=event_config.get("light_curve_cache"))
+
+                for key in ["stage_timeouts", "stage_workers", "light_curve_cache", "trace_allocations"]:
+                    if key in event_config:
+                        self.config[key] = event_config.get(key)
 
         except Exception as err:
             self.log.error(f"Event Analyst: %s, %s" % (err, type(err)))
@@ -109,7 +149,8 @@ class EventAnalyst(Analyst):
         """
 
         try:
-            self.light_curves = self.parse_light_curves(conifg_dict.get("light_curves"))
+            self.light_curves = self.parse_light_curves(conifg_dict.get("light_curves"),
+                                                        cache_path=conifg_dict.get("light_curve_cache"))
 
             if "lc_analyst" in conifg_dict:
                 self.config["lc_analyst"] = conifg_dict.get("lc_analyst")
@@ -129,31 +170,47 @@ class EventAnalyst(Analyst):
             else:
                 self.log.info("Event Analyst: No CMD Analyst config, it will not be launched.")
 
+            for key in ["stage_timeouts", "stage_workers", "light_curve_cache", "trace_allocations"]:
+                if key in conifg_dict:
+                    self.config[key] = conifg_dict.get(key)
+
         except Exception as err:
             self.log.error(f"Event Analyst: %s, %s" % (err, type(err)))
 
-    def parse_light_curves(self, lc_config):
+    def parse_light_curves(self, lc_config, cache_path=None):
         """
         This function parses the light curve information.
+        A light curve can be given as a path to a text file (`path`), inline (`lc`) or as a path to a binary
+        numpy file (`npy_path`).
+
         :param lc_config: dictionary with light curves specified for the event
-        :return: a list with event names, light curves, survey names, bands
+        :param cache_path: str, optional, folder with binary copies of the text files, False disables them
+        :return: :class:`MFPipeline.analyst.light_curve_set.LightCurveSet` with the light curves, survey names and bands
         """
         light_curves = []
         for entry in lc_config:
             survey = entry["survey"]
             band = entry["band"]
             if "path" in entry:
-                light_curve = np.genfromtxt(entry["path"], unpack=True)
+                light_curve = load_light_curve(entry["path"], cache_path=cache_path, log=self.log)
                 light_curves.append({
                     "lc": light_curve,
                     "survey": survey,
                     "band": band
                 })
             elif "lc" in entry:
-                if type(entry["lc"]) == type([1,1]):
-                    light_curve = entry["lc"]
-                else:
+                if isinstance(entry["lc"], str):
                     light_curve = json.loads(entry["lc"])
+                else:
+                    light_curve = entry["lc"]
+                light_curves.append({
+                    "lc": light_curve,
+                    "survey": survey,
+                    "band": band
+                })
+            elif "npy_path" in entry:
+                # binary light curve spilled by the Controller, mapped into memory instead of being read
+                light_curve = np.load(entry["npy_path"], mmap_mode="r")
                 light_curves.append({
                     "lc": light_curve,
                     "survey": survey,
@@ -162,7 +219,7 @@ class EventAnalyst(Analyst):
             else:
                 self.log.error("Event Analyst: Problem! No light curve data specified")
 
-        return light_curves
+        return LightCurveSet.from_entries(light_curves)
 
     def run_single_analyst(self):
         """
@@ -170,24 +227,68 @@ class EventAnalyst(Analyst):
         for fitting microlensing models. After fitting is done, output information is passed to a CMD Analyst, that
         creates a CMD plot for specified catalogs and plots the source and blend for each found solution.
 
-        :return: status?
+        :return: boolean, False if any of the stages failed or exceeded its time limit
         """
 
         self.log.info("Event Analyst: Processing started.")
+        timings.reset(trace_allocations=self.config.get("trace_allocations", False))
 
+        graph = StageGraph(self.log, max_workers=self.config.get("stage_workers", 2))
         if "lc_analyst" in self.config:
-            self.run_lc_analyst()
-
+            # in the main thread, so its time limit works; the catalogues are still loaded in the background
+            graph.add_stage("lc_analyst", lambda: self.run_stage("lc_analyst", self.run_lc_analyst),
+                            main_thread=True)
+        if "cmd_analyst" in self.config:
+            # catalogues do not depend on the fit results
+            graph.add_stage("cmd_catalogues", self.load_cmd_catalogues)
         if "fit_analyst" in self.config:
-            self.run_fit_analyst()
-
+            # pyLIMA plots with matplotlib, which is not thread safe
+            graph.add_stage("fit_analyst", lambda: self.run_stage("fit_analyst", self.run_fit_analyst),
+                            after=["lc_analyst"] if "lc_analyst" in self.config else [],
+                            main_thread=True)
         if "cmd_analyst" in self.config:
-            self.run_cmd_analyst()
+            graph.add_stage("cmd_analyst", lambda: self.run_stage("cmd_analyst", self.run_cmd_analyst),
+                            requires=["fit_analyst"] if "fit_analyst" in self.config else [],
+                            after=["cmd_catalogues"],
+                            main_thread=True)
+
+        statuses = graph.run()
+        if "cmd_analyst" in graph.skipped:
+            self.log.error("Event Analyst: No fit results, CMD Analyst will not be launched.")
+        status = all(statuses.values())
+
+        # durations of the stages, gathered by the Controller
+        timings.save(self.analyst_path + "timings.json")
 
         self.log.info("Event Analyst: Processing finished.")
         self.log.info("-------------------------------------------")
         logs.close_log(self.log)
 
+        return status
+
+    def run_stage(self, stage, run_function):
+        """
+        Run one stage of the analysis within its time limit, if one is specified in `stage_timeouts`.
+
+        :param stage: str, name of the stage, e.g. `fit_analyst`
+        :param run_function: function running the stage
+
+        :return: boolean, False if the stage exceeded its time limit
+        """
+
+        try:
+            with time_limit(self.stage_timeouts.get(stage, None), stage), timings.stage_timer(stage):
+                run_function()
+        except TimeLimitExceeded as err:
+            if err.label != stage:
+                # limit of the whole event, handled by the caller
+                raise
+            self.log.error("Event Analyst: Stage %s exceeded its time limit of %s s." %
+                           (stage, self.stage_timeouts[stage]))
+            return False
+
+        return True
+
     def run_lc_analyst(self):
         """
         Launch Light Curve Analyst to check the quality of the light curve.
@@ -204,6 +305,13 @@ class EventAnalyst(Analyst):
         self.log.debug("Event Analyst: Light Curve Analyst Created.")
         self.log.debug("Event Analyst: Starting Light Curve quality check.")
         lc_quality_status = lc_analyst.perform_quality_check()
+        if lc_analyst.binning is not None:
+            with timings.stage_timer("binning"):
+                lc_analyst.bin_light_curves()
+            # the fits can be polished on the full light curves
+            self.full_light_curves = lc_analyst.unbinned_light_curves
+        # the checked light curves are a new set, the fit uses them
+        self.light_curves = lc_analyst.light_curves
         self.log.debug("Event Analyst: Light Curve quality check ended.")
 
         if lc_quality_status:
@@ -216,10 +324,13 @@ class EventAnalyst(Analyst):
         Launch Fit Analyst to find all fitting microlensing events.
         """
 
+        from MFPipeline.analyst.fit_analyst import FitAnalyst
+
         self.log.info("Event Analyst: Starting Fit Analyst.")
         fit_analyst = FitAnalyst(self.event_name, self.analyst_path, self.light_curves,
                                  self.log,
-                                 config_dict=self.config
+                                 config_dict=self.config,
+                                 full_light_curves=self.full_light_curves
                                  )
         self.log.debug("Event Analyst: Fit Analyst created.")
         self.log.debug("Event Analyst: Starting fitting.")
@@ -227,12 +338,31 @@ class EventAnalyst(Analyst):
         self.fit_results = fit_analyst.best_results
         self.log.debug("Event Analyst: Fitting finished.")
 
+    def load_cmd_catalogues(self):
+        """
+        Load the data of all catalogues used by the CMD Analyst into the catalogue cache of
+        :class:`MFPipeline.analyst.cmd_analyst.CmdAnalyst`. The catalogues depend only on the position of
+        the event, so they are loaded once for all solutions, while the fit is still running.
+        """
+        from MFPipeline.analyst.cmd_analyst import CmdAnalyst
+
+        for dictionary in self.config["cmd_analyst"]["catalogues"]:
+            catalogue = dictionary["name"]
+            cmd_analyst = CmdAnalyst(self.config["event_name"], self.analyst_path, catalogue, {},
+                                     self.log,
+                                     config_dict=self.config
+                                     )
+            cmd_analyst.load_catalogue_data()
+            self.log.debug("Event Analyst: Finished loading catalogue data for %s." % catalogue)
+
     def run_cmd_analyst(self):
         """
         Launch CMD Analyst to create a CMD plot for all solutions and specified catalogues.
 
         :return: a list of boolean values corresponding to status of the created cmd plots.
         """
+        from MFPipeline.analyst.cmd_analyst import CmdAnalyst
+
         cmd_plot_status = []
 
         for dictionary in self.config["cmd_analyst"]["catalogues"]:
@@ -302,10 +432,12 @@ class EventAnalyst(Analyst):
                 source_data, source_labels = cmd_analyst.transform_source_data()
                 self.log.debug("Event Analyst: Finished transforming source data.")
 
+                # queried once per catalogue, the other solutions get the cached data
                 cmd_data, cmd_labels = cmd_analyst.load_catalogue_data()
                 self.log.debug("Event Analyst: Finished loading catalogue data.")
 
-                plot_status = cmd_analyst.plot_cmd(source_data, source_labels, cmd_data, cmd_labels)
+                with timings.stage_timer("cmd_plot"):
+                    plot_status = cmd_analyst.plot_cmd(source_data, source_labels, cmd_data, cmd_labels)
                 self.log.debug("Event Analyst: finished creating plot.")
                 if plot_status:
                     self.log.info("Event Analyst: CMD plot created successfully for {:s}.".format(catalogue))
@@ -323,6 +455,16 @@ if __name__ == "__main__":
     error_string = ""
     print("============================= Hello!!")
 
+    if "--batch" in sys.argv:
+        # a chunk of events sent by the Controller, see MFPipeline.controller.controller.run_batch_analyst
+        from MFPipeline.controller.controller import run_batch
+
+        idx = sys.argv.index("--batch")
+        with open(sys.argv[idx + 1], 'r') as file:
+            batch = json.load(file)
+        status = run_batch(batch["tasks"], batch["results_path"])
+        sys.exit(0 if status else 1)
+
     if "--event_name" in sys.argv:
         idx = sys.argv.index("--event_name")
         event += sys.argv[idx + 1]
@@ -344,6 +486,11 @@ if __name__ == "__main__":
         error = True
         error_string += "Event Analyst: Error! Missing log level information!\n"
 
+    stage_timeouts = None
+    if "--stage_timeouts" in sys.argv:
+        idx = sys.argv.index("--stage_timeouts")
+        stage_timeouts = json.loads(sys.argv[idx + 1])
+
     if "--stream" in sys.argv:
         idx = sys.argv.index("--stream")
         if sys.argv[idx + 1] == "True":
@@ -356,13 +503,24 @@ if __name__ == "__main__":
         config_path += sys.argv[idx + 1]
         event_analyst = EventAnalyst(event, analyst_path, log_level,
                                      config_path=config_path,
-                                     stream=stream
+                                     stream=stream,
+                                     stage_timeouts=stage_timeouts
+                                     )
+    elif "--config_spill" in sys.argv:
+        idx = sys.argv.index("--config_spill")
+        with open(sys.argv[idx + 1], 'r') as file:
+            config = json.load(file)
+        event_analyst = EventAnalyst(event, analyst_path, log_level,
+                                     config_dict=config,
+                                     stream=stream,
+                                     stage_timeouts=stage_timeouts
                                      )
     elif "--config_dict" in sys.argv:
         idx = sys.argv.index("--config_dict")
-        config = json.loads(sys.argv[idx + 1])
+        config = analyst_tools.parse_config_string(sys.argv[idx + 1])
         event_analyst = EventAnalyst(event, analyst_path, log_level,
-                                     config_dict=config
+                                     config_dict=config,
+                                     stage_timeouts=stage_timeouts
                                      )
     else:
         error = True
@@ -377,5 +535,7 @@ if __name__ == "__main__":
         else:
             print("Event Analyst: Error encountered while running an Event Analyst.\n")
             print(error_string)
+        sys.exit(1)
     else:
-        event_analyst.run_single_analyst()
+        status = event_analyst.run_single_analyst()
+        sys.exit(0 if status else 1)
@@ -1,9 +1,10 @@
+import os
 import numpy as np
 import json
-import time
 
 from MFPipeline.analyst.analyst import Analyst
-from MFPipeline.fitting_support.pyLIMA import fit_pyLIMA
+from MFPipeline.analyst.light_curve_set import LightCurveSet
+from MFPipeline import timings
 
 
 class FitAnalyst(Analyst):
@@ -16,10 +17,13 @@ class FitAnalyst(Analyst):
 
     :param event_name: str, name of the analyzed event
     :param analyst_path: str, path to the folder where the outputs are saved
-    :param light_curves: dict, dictionary containing light curves, observatory name, and filter
+    :param light_curves: :class:`MFPipeline.analyst.light_curve_set.LightCurveSet` or a list of dictionaries
+        containing light curves, observatory name, and filter
     :param log: logger instance, log started by Event Analyst
     :param config_dict: dictionary, optional, dictionary with Event Analyst configuration
     :param config_path: str, optional, path to the YAML configuration file of the Event Analyst
+    :param full_light_curves: optional, light curves before binning, used to polish the fits made on binned
+        light curves when `polish` is set in the `fit_analyst` section of the configuration, see :func:`polish_fits`
     """
     def __init__(self,
                  event_name,
@@ -27,15 +31,19 @@ class FitAnalyst(Analyst):
                  light_curves,
                  log,
                  config_dict=None,
-                 config_path=None):
+                 config_path=None,
+                 full_light_curves=None):
 
         super().__init__(event_name, analyst_path, config_dict=config_dict, config_path=config_path)
 
         self.log = log
-        self.light_curves = light_curves
+        self.light_curves = LightCurveSet.from_entries(light_curves)
+        self.full_light_curves = full_light_curves
+        self.polish = False
 
         self.best_results = {}
-        self.start_time = time.time()
+        # model label: fit name, parallax and blend flags of the fits, used to repeat them
+        self.fit_settings = {}
 
         if config_dict is not None:
             self.parse_config(config_dict)
@@ -56,6 +64,7 @@ class FitAnalyst(Analyst):
 
         self.log.debug("Fit Analyst: Reading fit config.")
         self.config["fitting_package"] = config["fit_analyst"]["fitting_package"]
+        self.polish = config["fit_analyst"].get("polish", False)
         self.log.debug("Fit Analyst: Finished reading fit config.")
 
     def perform_ongoing_check(self):
@@ -65,8 +74,6 @@ class FitAnalyst(Analyst):
         :return: status of the fitting procedures.
         """
 
-        self.log.debug("Fit Analyst: Time elapsed for setting up the analyst: {:.2f} s".format(
-            time.time() - self.start_time))
         self.log.info("Fit Analyst: Starting ongoing check fit.")
         self.log.info("Find PSPL starting parameters.")
         time_of_peak = self.find_time_of_peak()
@@ -94,19 +101,15 @@ class FitAnalyst(Analyst):
 
         self.log.info("Identify ongoing event.")
         baseline_mag = fit_params_PSPL_nopar["baseline_magnitude"]
-        self.start_time = time.time()
-        ongoing_ampl, t_last = self.check_ongoing_amplitude(aligned_data, residuals, baseline_mag)
-        ongoing_time = self.check_ongoing_time(fit_params_PSPL_nopar, t_last)
-        ongoing_mag = self.check_ongoing_magnification(fit_params_PSPL_nopar, t_last)
+        with timings.stage_timer("ongoing_check"):
+            ongoing_ampl, t_last = self.check_ongoing_amplitude(aligned_data, residuals, baseline_mag)
+            ongoing_time = self.check_ongoing_time(fit_params_PSPL_nopar, t_last)
+            ongoing_mag = self.check_ongoing_magnification(fit_params_PSPL_nopar, t_last)
 
         ongoing = False
         if ongoing_ampl or ongoing_time or ongoing_mag:
             ongoing = True
 
-        self.log.debug("Fit Analyst: Time elapsed for ongoing check: {:.2f} s".format(
-            time.time() - self.start_time
-        ))
-
         return ongoing, t_0
 
     def placeholder(self):
@@ -155,16 +158,18 @@ class FitAnalyst(Analyst):
         :return: list with fitted parameters and if requested, aligned data
         """
 
-        self.start_time = time.time()
         results = {}
+        # fit names are the analyst path followed by the model label
+        label = os.path.basename(fit_name).strip("_")
+        self.fit_settings[label] = (fit_name, parallax, blend)
         if self.config["fitting_package"] == "pyLIMA":
-            fit_pspl = fit_pyLIMA.fitPyLIMA(self.log)
-            results = fit_pspl.fit_PSPL(fit_name, self.light_curves, starting_params, parallax, blend,
-                                        return_norm_lc=return_norm_lc, use_boundaries=use_boundaries)
+            # pyLIMA is imported only when a fit is made
+            from MFPipeline.fitting_support.pyLIMA import fit_pyLIMA
 
-        self.log.debug("Fit Analyst: Time elapsed for fitting: {:.2f} s".format(
-            time.time() - self.start_time
-        ))
+            with timings.stage_timer("fit_" + label):
+                fit_pspl = fit_pyLIMA.fitPyLIMA(self.log)
+                results = fit_pspl.fit_PSPL(fit_name, self.light_curves, starting_params, parallax, blend,
+                                            return_norm_lc=return_norm_lc, use_boundaries=use_boundaries)
 
         return results
     def check_ongoing_time(self, model_params, time_now):
@@ -425,6 +430,58 @@ class FitAnalyst(Analyst):
 
         return fit_ok
 
+    def polish_boundaries(self, model_params, parallax):
+        """
+        Boundaries of a fit narrowed around an earlier solution: five uncertainties, but at least 10% of the value,
+        on each side.
+
+        :param model_params: dict, parameters of the earlier solution
+        :param parallax: boolean, was the fit made with parallax?
+        :return: dictionary with boundaries, see :func:`fit_PSPL`
+        """
+
+        boundaries = {}
+        keys = ["tE", "u0", "piEN", "piEE"] if parallax else ["tE", "u0"]
+        for key in keys:
+            value, error = float(model_params[key]), float(model_params.get(key + "_error", 0.))
+            if not np.isfinite(error):
+                error = 0.
+            width = max(5. * error, 0.1 * np.abs(value), 0.01)
+            boundaries[key + "_lower"] = value - width
+            boundaries[key + "_upper"] = value + width
+        boundaries["tE_lower"] = max(boundaries["tE_lower"], 0.)
+
+        return boundaries
+
+    def polish_fits(self):
+        """
+        Repeats the fits made on binned light curves on the full light curves, with the boundaries narrowed around
+        the binned solutions, so the final parameters and uncertainties come from all data points while the
+        search was done on the cheaper binned data.
+        """
+
+        self.log.info("Fit Analyst: Polishing the fits on the full light curves.")
+        binned_light_curves = self.light_curves
+        self.light_curves = LightCurveSet.from_entries(self.full_light_curves)
+        for model, (fit_name, parallax, blend) in list(self.fit_settings.items()):
+            if model not in self.best_results:
+                continue
+            params = self.best_results[model]
+            starting_params = {"ra": self.config["ra"],
+                               "dec": self.config["dec"],
+                               # the parallax reference time stays the same
+                               "t_0": params["t0_par"] if parallax else params["t0"],
+                               }
+            try:
+                with timings.stage_timer("polish_" + model):
+                    self.best_results[model] = self.fit_PSPL(fit_name, starting_params, parallax, blend,
+                                                             use_boundaries=self.polish_boundaries(params,
+                                                                                                   parallax))
+            except Exception as err:
+                self.log.error(f"Fit Analyst: Polishing %s failed, the binned fit is kept: %s, %s" %
+                               (model, err, type(err)))
+        self.light_curves = binned_light_curves
+
     def perform_fit(self):
         """
         Perform fitting flow.
@@ -452,6 +509,9 @@ class FitAnalyst(Analyst):
             # evaluate models
             # anomaly finder
 
+        if self.polish and self.full_light_curves is not None:
+            self.polish_fits()
+
         self.log.debug("Fit Analyst: Best models:")
         for model in self.best_results:
             params = self.best_results[model]
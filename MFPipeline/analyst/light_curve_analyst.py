@@ -1,7 +1,26 @@
 from time import sleep
+import os
+import json
 import numpy as np
 
 from MFPipeline.analyst.analyst import Analyst
+from MFPipeline.analyst.light_curve_set import LightCurveSet
+
+# Ways of telling duplicated entries apart, see LightCurveAnalyst.flag_duplicate_entries.
+DUPLICATE_MODES = ["exact", "tolerance", "best_error"]
+# Checks of the quality check, in the order they are evaluated.
+QUALITY_CHECKS = ["finite", "duplicates", "magnitude_range", "negative_errors", "errorbars", "outliers"]
+# Checks performed when the configuration does not list them; the robust statistics checks are optional.
+DEFAULT_CHECKS = ["finite", "duplicates", "magnitude_range", "negative_errors"]
+# Checks using statistics of the entries, computed only from the entries that passed the other checks.
+ROBUST_CHECKS = ["errorbars", "outliers"]
+# Scale of the median absolute deviation to the standard deviation of a normal distribution.
+MAD_TO_SIGMA = 1.4826
+# Folder in the analyst folder with the state of the incremental quality check.
+QUALITY_STATE_FOLDER = "quality_state"
+# Share of new valid entries, relative to the entries the error statistics were computed from, after which
+# the incremental quality check is replaced by a full one, which computes the statistics again.
+STATS_REFRESH_FRACTION = 0.1
 
 class LightCurveAnalyst(Analyst):
     """
@@ -13,10 +32,31 @@ class LightCurveAnalyst(Analyst):
 
     :param event_name: str, name of the analyzed event
     :param analyst_path: str, path to the folder where the outputs are saved
-    :param light_curves: list, a list containing light curves, observatory name, and filter
+    :param light_curves: :class:`MFPipeline.analyst.light_curve_set.LightCurveSet` or a list containing light curves,
+        observatory name, and filter
     :param log: logger instance, log started by Event Analyst
     :param config_dict: dictionary, optional, dictionary with Event Analyst configuration
     :param config_path: str, optional, path to the YAML configuration file of the Event Analyst
+
+    Notes on configuration:
+
+    The `lc_analyst` section of the configuration can contain the following keywords:
+
+    * `acceptable_mag_range` dict, optional, `upper_limit` and `lower_limit` of valid magnitudes
+    * `duplicates` dict, optional, how duplicated entries are found: `mode` is `exact` (same time, default),
+      `tolerance` (times closer than `tolerance` days) or `best_error` (entries within `tolerance` days, 0 by default,
+      of which the one with the smallest error is kept)
+    * `checks` list, optional, checks to perform, `finite`, `duplicates`, `magnitude_range` and
+      `negative_errors` by default; `errorbars` and `outliers` have to be listed to be performed
+    * `errorbars` dict, optional, `sigma` (5 by default): entries with errors larger than the median error of their
+      telescope by more than `sigma` scaled median absolute deviations are rejected
+    * `outliers` dict, optional, `window` (11 points by default) and `sigma` (5 by default): entries further from
+      the rolling median of their telescope than `sigma` times the rolling scaled median absolute deviation, added in
+      quadrature to the error of the entry, are rejected
+    * `binning` dict, optional, bins the baseline of dense light curves before fitting, see :func:`bin_light_curves`:
+      `bin_size` (1 day by default), `threshold` (3 by default), `margin` (5 days by default)
+    * `incremental` boolean, optional, keep the state of the quality check in the analyst folder and check only
+      the entries appended since the previous run, see :func:`incremental_quality_mask`
     """
     def __init__(self,
                  event_name,
@@ -30,7 +70,25 @@ class LightCurveAnalyst(Analyst):
         # Analyst.__init__(self, event_name, analyst_path, config_dict=config_dict, config_path=config_path)
 
         self.acceptable_mag_range = None
-        self.light_curves = light_curves
+        self.duplicate_mode = "exact"
+        self.duplicate_tolerance = 0.
+        self.checks = list(DEFAULT_CHECKS)
+        self.errorbars_sigma = 5.
+        self.outliers_window = 11
+        self.outliers_sigma = 5.
+        # binning settings, None when the light curves are not binned
+        self.binning = None
+        self.binning_report = {}
+        # light curves before binning
+        self.unbinned_light_curves = None
+        self.incremental = False
+        # entries checked by the last incremental quality check, new entries and re-evaluated tail entries
+        self.incremental_entries = 0
+        # entries that passed the checks other than the robust statistics checks, filled by the quality check
+        self.basic_mask = None
+        # check: number of entries rejected by the check, filled by the quality check
+        self.rejections = {}
+        self.light_curves = LightCurveSet.from_entries(light_curves)
         self.log = log
 
         if (config_dict != None):
@@ -50,40 +108,333 @@ class LightCurveAnalyst(Analyst):
         """
 
         self.log.debug("LC Analyst: Reading lc config.")
-        self.acceptable_mag_range = config["lc_analyst"].get("acceptable_mag_range", None)
+        settings = read_quality_settings(config["lc_analyst"], self.log)
+        self.acceptable_mag_range = settings["acceptable_mag_range"]
+        self.duplicate_mode = settings["duplicate_mode"]
+        self.duplicate_tolerance = settings["duplicate_tolerance"]
+        self.errorbars_sigma = settings["errorbars_sigma"]
+        self.outliers_window = settings["outliers_window"]
+        self.outliers_sigma = settings["outliers_sigma"]
+        self.checks = settings["checks"]
+        if "binning" in config["lc_analyst"]:
+            binning = config["lc_analyst"].get("binning") or {}
+            self.binning = {"bin_size": float(binning.get("bin_size", 1.)),
+                            "threshold": float(binning.get("threshold", 3.)),
+                            "margin": float(binning.get("margin", 5.)),
+                            }
+        self.incremental = bool(config["lc_analyst"].get("incremental", False))
         self.log.debug("LC Analyst: Finished reading lc config.")
 
     def perform_quality_check(self):
         """
         Performing a quality check of the light curve and applying masks to invalid entries.
-        A cleaned light curve will replace the old entry.
+        The mask is computed for all telescopes at once, see :func:`quality_mask`, and applied once;
+        the cleaned light curve set replaces the old one.
 
-        :return:
+        :return: boolean, True when the check is done
         """
 
-        status = False
-
         self.log.info("LC Analyst: Start quality check.")
-        for entry in self.light_curves:
-            #extract np array with the light curve
-            lc = np.array(entry["lc"])
-
-            self.log.debug("LC Analyst: Masking bad data.")
-            mask_duplicate = self.flag_duplicate_entries(lc)
-            mask_inf_entry = self.flag_infinite_entries(lc)
-            prel_mask = np.logical_and(mask_inf_entry, mask_duplicate)
-            prel_lc = lc[prel_mask]
-            self.log.debug("LC Analyst: Applying non numerical and duplicates mask.")
-
-            mask_inv_mags = self.flag_invalid_mags(prel_lc)
-            self.log.debug("LC Analyst: Applying bad data mask.")
-            cleaned_lc = prel_lc[mask_inv_mags]
-
-            mask_neg_err = self.flag_negative_errorbars(prel_lc)
-            fin_lc = cleaned_lc[mask_neg_err]
-            entry["lc"] = fin_lc
+        mask = None
+        if self.incremental:
+            state = self.load_quality_state()
+            if state is not None:
+                mask = self.incremental_quality_mask(state)
+            if mask is None:
+                self.log.info("LC Analyst: No matching quality check state, checking all entries.")
+        if mask is None:
+            robust_masks = {}
+            mask = self.quality_mask(robust_masks=robust_masks)
+            if self.incremental:
+                self.save_quality_state(mask, robust_masks)
+        for check in self.checks:
+            self.log.info("LC Analyst: %d entries rejected by the %s check." % (self.rejections[check], check))
+
+        self.log.debug("LC Analyst: Applying the mask, %d of %d entries kept." % (np.sum(mask), len(mask)))
+        self.light_curves = self.light_curves.select(mask)
         self.log.info("LC Analyst: Quality check ended.")
 
+        return True
+
+    def quality_mask(self, light_curve=None, telescope=None, robust_masks=None):
+        """
+        Evaluates the enabled checks on the whole light curve set, each check in one vectorized pass over the
+        columns of all telescopes, and joins them into one mask. Every check is evaluated on the original entries,
+        so the number of entries rejected by each check, saved in `rejections`, does not depend on the order
+        of the checks. The exception are the robust statistics checks (`errorbars`, `outliers`), which are
+        evaluated last, on the entries that passed the other checks, so that e.g. a -99 magnitude does not
+        distort the median; they count only the entries they reject on top of the other checks.
+
+        :param light_curve: numpy array, optional, (N, 3) array with JD, magnitude and error of the entries to check,
+            the light curve set of the analyst by default
+        :param telescope: numpy array, optional, telescope (or segment, see :func:`batch_quality_mask`) index of every
+            entry of `light_curve`, entries of a telescope together
+        :param robust_masks: dict, optional, filled with the masks of the robust statistics checks
+        :return: boolean mask with the entries that passed all checks
+        """
+
+        if light_curve is None:
+            # (N, 3) view of the entries of all telescopes
+            light_curve = self.light_curves.data.T
+            telescope = self.light_curves.telescope
+        mask, self.rejections, self.basic_mask = quality_mask(light_curve, telescope, self.check_settings(),
+                                                              robust_masks=robust_masks)
+
+        return mask
+
+    def check_settings(self):
+        """
+        :return: dictionary with the settings of the checks, see :func:`read_quality_settings`
+        """
+
+        return {"checks": list(self.checks),
+                "acceptable_mag_range": self.acceptable_mag_range,
+                "duplicate_mode": self.duplicate_mode,
+                "duplicate_tolerance": self.duplicate_tolerance,
+                "errorbars_sigma": self.errorbars_sigma,
+                "outliers_window": self.outliers_window,
+                "outliers_sigma": self.outliers_sigma,
+                }
+
+    def quality_state_path(self):
+        """
+        :return: str, path to the folder with the state of the incremental quality check
+        """
+
+        return os.path.join(self.analyst_path, QUALITY_STATE_FOLDER)
+
+    def save_quality_state(self, mask, robust_masks):
+        """
+        Saves the state of the quality check after all entries were checked with :func:`quality_mask`.
+        The state is a folder with an append-only mask file for every telescope (one byte per entry) and
+        a small `state.json`. For every telescope `state.json` holds the last checked entry, the error
+        statistics, the tail (the last `2 * outliers_window` entries that passed the basic checks, in time order,
+        with their indices and robust check results) and the times of the entries close to the tail.
+        Its size does not depend on the length of the light curves.
+
+        :param mask: boolean mask with the entries that passed all checks
+        :param robust_masks: dict, masks of the robust statistics checks, see :func:`quality_mask`
+        """
+
+        light_curves = self.light_curves
+        tolerance = self.duplicate_tolerance if self.duplicate_mode != "exact" else 0.
+        state = {"settings": self.check_settings(),
+                 "surveys": list(light_curves.surveys),
+                 "bands": list(light_curves.bands),
+                 "rejections": dict(self.rejections),
+                 "telescopes": [],
+                 }
+        for i in range(light_curves.n_telescopes):
+            start, stop = light_curves.offsets[i], light_curves.offsets[i + 1]
+            light_curve = light_curves.light_curve(i)
+            entries = np.flatnonzero(self.basic_mask[start:stop])
+            entries = entries[np.argsort(light_curve[entries, 0], kind="stable")]
+            tail = entries[max(len(entries) - 2 * self.outliers_window, 0):]
+            errors = light_curve[entries, 2]
+            median = np.median(errors) if len(errors) > 0 else np.nan
+            spread = MAD_TO_SIGMA * np.median(np.abs(errors - median)) if len(errors) > 0 else np.nan
+            errorbars = robust_masks.get("errorbars", np.ones(len(mask), dtype=bool))[start:stop]
+            outliers = robust_masks.get("outliers", np.ones(len(mask), dtype=bool))[start:stop]
+            tail_start = light_curve[tail[0], 0] if len(tail) > 0 else -np.inf
+            times = light_curve[:, 0]
+            state["telescopes"].append({
+                "n_checked": int(stop - start),
+                "last_row": light_curve[-1].tolist() if stop > start else None,
+                "error_stats": [float(median), float(spread)],
+                "n_stats": int(len(entries)),
+                "n_new": 0,
+                "tail": np.column_stack([light_curve[tail], tail, errorbars[tail], outliers[tail]]).tolist(),
+                "recent_times": np.sort(times[np.isfinite(times) & (times >= tail_start - tolerance)]).tolist(),
+                })
+
+        try:
+            os.makedirs(self.quality_state_path(), exist_ok=True)
+            for i in range(light_curves.n_telescopes):
+                mask[light_curves.offsets[i]:light_curves.offsets[i + 1]].astype(np.uint8).tofile(
+                    self.mask_file(i))
+            self.write_quality_state(state)
+        except OSError as err:
+            self.log.error(f"LC Analyst: Could not save the quality check state: %s, %s" % (err, type(err)))
+
+    def mask_file(self, i):
+        """
+        :param i: int, index of the telescope
+        :return: str, path to the mask file of the telescope
+        """
+
+        return os.path.join(self.quality_state_path(), "mask_%d.bin" % i)
+
+    def write_quality_state(self, state):
+        """
+        Writes `state.json` of the quality check state, under a temporary name first, so a crash never leaves
+        half of the file.
+
+        :param state: dictionary with the state, see :func:`save_quality_state`
+        """
+
+        path = os.path.join(self.quality_state_path(), "state.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(path + ".tmp", path)
+
+    def load_quality_state(self):
+        """
+        :return: dictionary with the state saved by :func:`save_quality_state`, None if there is no readable state
+        """
+
+        try:
+            with open(os.path.join(self.quality_state_path(), "state.json"), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def incremental_quality_mask(self, state):
+        """
+        Checks only the entries appended to the light curves since the state was saved, so the work depends on
+        the number of new entries, not on the length of the history. The light curves are expected to grow only
+        at the end: every telescope has to start with the entries checked before, which is verified with its
+        last checked entry.
+
+        * duplicates are searched within the new entries and, with a binary search, against the times close to
+          the tail, which holds all possible duplicates as long as the new entries are not earlier than the tail
+        * the errors are clipped with the statistics of the last full check; after `STATS_REFRESH_FRACTION`
+          of new valid entries a full check computes them again, so their drift is bounded
+        * the outliers are found over the tail and the new entries; the last `outliers_window` tail entries,
+          whose rolling windows now reach the new entries, are evaluated again, which gives the same result as
+          a full check
+
+        A full check is needed (None is returned) when the settings, telescopes or checked entries changed,
+        when new entries are earlier than the tail, or with the `best_error` mode when a new entry duplicates
+        an earlier one. The mask files are appended to and `state.json` is rewritten.
+
+        :param state: dictionary with the state, see :func:`load_quality_state`
+        :return: boolean mask with the entries that passed all checks, None if a full check is needed
+        """
+
+        light_curves = self.light_curves
+        if state["settings"] != json.loads(json.dumps(self.check_settings())) or \
+                state["surveys"] != list(light_curves.surveys) or state["bands"] != list(light_curves.bands):
+            return None
+        counts = np.diff(light_curves.offsets)
+        for i, telescope in enumerate(state["telescopes"]):
+            n_checked = telescope["n_checked"]
+            if counts[i] < n_checked:
+                return None
+            if n_checked > 0 and not np.array_equal(light_curves.light_curve(i)[n_checked - 1],
+                                                    np.array(telescope["last_row"], dtype=float), equal_nan=True):
+                return None
+
+        window = self.outliers_window
+        tolerance = self.duplicate_tolerance if self.duplicate_mode != "exact" else 0.
+        basic_checks = {"finite": self.flag_infinite_entries,
+                        "duplicates": self.flag_duplicate_entries,
+                        "magnitude_range": self.flag_invalid_mags,
+                        "negative_errors": self.flag_negative_errorbars,
+                        }
+        rejections = dict(state["rejections"])
+        # telescope: entries of the tail whose mask changed, mask of the new entries
+        updates = []
+        self.incremental_entries = 0
+        for i, telescope in enumerate(state["telescopes"]):
+            n_checked = telescope["n_checked"]
+            new_entries = light_curves.light_curve(i)[n_checked:]
+            tail = np.array(telescope["tail"], dtype=float).reshape(-1, 6)
+            recent_times = np.array(telescope["recent_times"], dtype=float)
+            new_times = new_entries[np.isfinite(new_entries[:, 0]), 0]
+            if len(tail) > 0 and len(new_times) > 0 and new_times.min() < tail[0, 0]:
+                return None
+
+            mask = np.ones(len(new_entries), dtype=bool)
+            for check in self.checks:
+                if check in ROBUST_CHECKS:
+                    continue
+                check_mask = np.asarray(basic_checks[check](new_entries), dtype=bool)
+                if check == "duplicates" and len(recent_times) > 0:
+                    # distance to the nearest earlier time
+                    idx = np.searchsorted(recent_times, new_entries[:, 0])
+                    before = recent_times[np.clip(idx - 1, 0, len(recent_times) - 1)]
+                    after = recent_times[np.clip(idx, 0, len(recent_times) - 1)]
+                    repeated = np.minimum(np.abs(new_entries[:, 0] - before),
+                                          np.abs(new_entries[:, 0] - after)) <= tolerance
+                    if self.duplicate_mode == "best_error" and np.any(repeated):
+                        return None
+                    check_mask &= ~repeated
+                rejections[check] = rejections.get(check, 0) + int(len(check_mask) - np.count_nonzero(check_mask))
+                mask &= check_mask
+
+            valid = np.flatnonzero(mask)
+            valid = valid[np.argsort(new_entries[valid, 0], kind="stable")]
+            if len(tail) > 0 and len(valid) > 0 and new_entries[valid[0], 0] < tail[-1, 0]:
+                return None
+
+            errorbars = np.ones(len(new_entries), dtype=bool)
+            n_new = telescope["n_new"] + len(valid)
+            if "errorbars" in self.checks:
+                if n_new > STATS_REFRESH_FRACTION * telescope["n_stats"]:
+                    return None
+                median, spread = telescope["error_stats"]
+                errorbars[valid] = new_entries[valid, 2] <= median + self.errorbars_sigma * spread
+                rejections["errorbars"] = rejections.get("errorbars", 0) + \
+                    int(len(valid) - np.count_nonzero(errorbars[valid]))
+
+            rows = np.concatenate([tail[:, :3], new_entries[valid]])
+            outliers = np.concatenate([tail[:, 5], np.ones(len(valid))]).astype(bool)
+            changed = np.zeros(0, dtype=np.int64)
+            if "outliers" in self.checks:
+                first = max(len(tail) - window, 0)
+                new_outliers = flag_outliers(rows, window=window, sigma=self.outliers_sigma)
+                changed = first + np.flatnonzero(new_outliers[first:len(tail)] != outliers[first:len(tail)])
+                outliers[first:] = new_outliers[first:]
+                rejections["outliers"] = rejections.get("outliers", 0) + \
+                    int(np.count_nonzero(~outliers[first:])) - int(np.count_nonzero(~tail[first:, 5].astype(bool)))
+                self.incremental_entries += len(tail) - first
+
+            mask[valid] &= errorbars[valid] & outliers[len(tail):]
+            tail_flags = np.concatenate([tail[:, 4], errorbars[valid]]).astype(bool) & outliers
+            updates.append(({int(tail[j, 3]): bool(tail_flags[j]) for j in changed}, mask))
+
+            indices = np.concatenate([tail[:, 3], n_checked + valid])
+            new_tail = np.column_stack([rows, indices, np.concatenate([tail[:, 4], errorbars[valid]]),
+                                        outliers])[max(len(rows) - 2 * window, 0):]
+            tail_start = new_tail[0, 0] if len(new_tail) > 0 else -np.inf
+            recent_times = np.sort(np.concatenate([recent_times, new_times]))
+            telescope.update({"n_checked": int(counts[i]),
+                              "last_row": new_entries[-1].tolist() if len(new_entries) > 0 else telescope["last_row"],
+                              "n_new": int(n_new),
+                              "tail": new_tail.tolist(),
+                              "recent_times": recent_times[recent_times >= tail_start - tolerance].tolist(),
+                              })
+            self.incremental_entries += len(new_entries)
+
+        # the earlier masks are read only to apply them to the light curves
+        masks = []
+        for i, (changed, mask) in enumerate(updates):
+            n_checked = light_curves.offsets[i + 1] - light_curves.offsets[i] - len(mask)
+            old_mask = np.fromfile(self.mask_file(i), dtype=np.uint8, count=n_checked).astype(bool)
+            if len(old_mask) < n_checked:
+                return None
+            for index, value in changed.items():
+                old_mask[index] = value
+            masks.append(np.concatenate([old_mask, mask]))
+
+        try:
+            for i, (changed, mask) in enumerate(updates):
+                with open(self.mask_file(i), "r+b") as file:
+                    for index, value in changed.items():
+                        file.seek(index)
+                        file.write(bytes([value]))
+                    file.seek(state["telescopes"][i]["n_checked"] - len(mask))
+                    file.write(mask.astype(np.uint8).tobytes())
+                    file.truncate()
+            state["rejections"] = rejections
+            self.write_quality_state(state)
+        except OSError as err:
+            self.log.error(f"LC Analyst: Could not save the quality check state: %s, %s" % (err, type(err)))
+
+        self.rejections = rejections
+        self.log.debug("LC Analyst: Incremental quality check of %d entries." % self.incremental_entries)
+
+        return np.concatenate(masks) if len(masks) > 0 else np.ones(0, dtype=bool)
 
     def flag_infinite_entries(self, light_curve):
         '''
@@ -91,20 +442,119 @@ class LightCurveAnalyst(Analyst):
         :param light_curve: numpy array, an array containing JD, magnitude and error
         :return: mask with entries that don't have invalid magnitudes
         '''
-        mask_finite_mag = np.isfinite(light_curve[:,1])
-        mask_finite_err = np.isfinite(light_curve[:, 2])
-        final_mask = np.logical_and(mask_finite_mag, mask_finite_err)
 
-        return final_mask
+        return flag_infinite_entries(light_curve)
 
-    def flag_huge_errorbars(self, light_curve):
+    def flag_active_entries(self):
         """
-        Flag entries with huge errorbars.
+        Flags the entries that have to be kept at full cadence: entries deviating from the baseline of their telescope
+        (the median magnitude) by more than `threshold` times the scaled median absolute deviation, added in
+        quadrature to their error, i.e. the peak and any anomalies, and all entries closer than `margin` days
+        to them. A deviating entry counts only if the entry before or after it deviates too, so noise in a dense
+        baseline does not keep it at full cadence.
+        :return: boolean mask with the entries kept at full cadence
+        """
+        times, mags, errors = self.light_curves.time, self.light_curves.mag, self.light_curves.err
+        offsets = self.light_curves.offsets
+        active = np.zeros(len(times), dtype=bool)
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            if stop == start:
+                continue
+            baseline = np.median(mags[start:stop])
+            spread = MAD_TO_SIGMA * np.median(np.abs(mags[start:stop] - baseline))
+            order = np.argsort(times[start:stop], kind="stable")
+            deviating = np.abs(mags[start:stop][order] - baseline) > \
+                self.binning["threshold"] * np.sqrt(spread ** 2 + errors[start:stop][order] ** 2)
+            confirmed = np.zeros(len(deviating), dtype=bool)
+            confirmed[1:] |= deviating[1:] & deviating[:-1]
+            confirmed[:-1] |= deviating[:-1] & deviating[1:]
+            deviating_times = times[start:stop][order][confirmed]
+            if len(deviating_times) == 0:
+                continue
+            # distance to the nearest deviating entry
+            idx = np.searchsorted(deviating_times, times[start:stop])
+            before = deviating_times[np.clip(idx - 1, 0, len(deviating_times) - 1)]
+            after = deviating_times[np.clip(idx, 0, len(deviating_times) - 1)]
+            distance = np.minimum(np.abs(times[start:stop] - before), np.abs(times[start:stop] - after))
+            active[start:stop] = distance <= self.binning["margin"]
+
+        return active
+
+    def bin_light_curves(self):
+        """
+        Bins the baseline of the light curves, to make the model evaluations of the fit cheaper. The peak and the
+        anomalies, see :func:`flag_active_entries`, keep their full cadence. The other entries of every telescope are
+        grouped in bins of `bin_size` days, which never extend over an entry kept at full cadence, and every bin is
+        replaced by the weighted mean of its fluxes, with the error of the weighted mean, converted back to magnitudes;
+        the time of a bin is the mean time of its entries. The light curves before binning are kept in
+        `unbinned_light_curves` and the number of entries before and after binning in `binning_report`.
+        Binning needs finite magnitudes and errors, so it is done after the quality check.
+        """
+        self.unbinned_light_curves = self.light_curves
+        times, mags, errors = self.light_curves.time, self.light_curves.mag, self.light_curves.err
+        telescope = self.light_curves.telescope
+        active = self.flag_active_entries()
+
+        order = np.lexsort((times, telescope))
+        sorted_times, sorted_telescope, sorted_active = times[order], telescope[order], active[order]
+        bins = np.floor(sorted_times / self.binning["bin_size"])
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (sorted_active[1:] | sorted_active[:-1] | (np.diff(bins) != 0) |
+                         (np.diff(sorted_telescope) != 0))
+        group = np.cumsum(new_group) - 1
+
+        flux = 10. ** (-0.4 * mags[order])
+        flux_error = flux * errors[order] * np.log(10.) / 2.5
+        weights = 1. / flux_error ** 2
+        n_groups = group[-1] + 1 if len(group) > 0 else 0
+        weight_sums = np.bincount(group, weights=weights, minlength=n_groups)
+        binned_flux = np.bincount(group, weights=weights * flux, minlength=n_groups) / weight_sums
+        binned_flux_error = 1. / np.sqrt(weight_sums)
+        binned_times = np.bincount(group, weights=sorted_times, minlength=n_groups) / \
+            np.bincount(group, minlength=n_groups)
+
+        data = np.array([binned_times,
+                         -2.5 * np.log10(binned_flux),
+                         2.5 / np.log(10.) * binned_flux_error / binned_flux])
+        counts = np.bincount(sorted_telescope[new_group], minlength=self.light_curves.n_telescopes)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.light_curves = LightCurveSet(data, offsets, self.light_curves.surveys, self.light_curves.bands)
+
+        before = np.diff(self.unbinned_light_curves.offsets)
+        self.binning_report = {"n_points": int(len(times)),
+                               "n_binned": int(n_groups),
+                               "telescopes": [{"survey": survey, "band": band,
+                                               "n_points": int(n_before), "n_binned": int(n_after)}
+                                              for survey, band, n_before, n_after in
+                                              zip(self.light_curves.surveys, self.light_curves.bands, before, counts)],
+                               }
+        for entry in self.binning_report["telescopes"]:
+            self.log.info("LC Analyst: Binned %s %s from %d to %d entries." %
+                          (entry["survey"], entry["band"], entry["n_points"], entry["n_binned"]))
+        self.log.info("LC Analyst: Binning kept %d of %d entries." % (n_groups, len(times)))
+
+    def flag_huge_errorbars(self, light_curve, telescope=None, valid=None):
+        """
+        Flag entries with huge errorbars, see :func:`flag_huge_errorbars`.
         :param light_curve: numpy array, an array containing JD, magnitude and error
-        :return: mask containing entries that have huge uncertianity values
+        :param telescope: numpy array, optional, telescope index of every entry, entries of a telescope together
+        :param valid: numpy array, optional, boolean mask of the entries used for the statistics
+        :return: mask with entries that don't have huge uncertianity values, entries not used are kept
         """
 
-        return 0.
+        return flag_huge_errorbars(light_curve, segments=telescope, valid=valid, sigma=self.errorbars_sigma)
+
+    def flag_outliers(self, light_curve, telescope=None, valid=None):
+        """
+        Flag outliers with a rolling median filter, see :func:`flag_outliers`.
+        :param light_curve: numpy array, an array containing JD, magnitude and error
+        :param telescope: numpy array, optional, telescope index of every entry, entries of a telescope together
+        :param valid: numpy array, optional, boolean mask of the entries used for the statistics
+        :return: mask with entries that are not outliers, entries not used are kept
+        """
+
+        return flag_outliers(light_curve, segments=telescope, valid=valid, window=self.outliers_window,
+                             sigma=self.outliers_sigma)
 
     def flag_negative_errorbars(self, light_curve):
         """
@@ -112,37 +562,362 @@ class LightCurveAnalyst(Analyst):
         :param light_curve: numpy array, an array containing JD, magnitude and error
         :return: mask with entries that don't have negative uncertianities
         """
-        mask_neg_err = np.where(light_curve[:, 2] > 0)
 
-        return mask_neg_err
+        return flag_negative_errorbars(light_curve)
 
     def flag_invalid_mags(self, light_curve):
         """
-        Flags entries with magnitudes smaller than -10. Many surveys indicate an invalid entry
-        by applying -99 or 99 to the light curves.
+        Flags entries with magnitudes outside of the acceptable range, see :func:`flag_invalid_mags`.
         :param light_curve: numpy array, an array containing JD, magnitude and error
         :return: mask with entries that don't have invalid magnitudes
         """
-        custom_range = self.acceptable_mag_range
-        if custom_range is not None:
-            mask_inv_mag = np.where((light_curve[:, 1] > custom_range["upper_limit"]) & (light_curve[:, 1] < custom_range["lower_limit"]))
-        else:
-            mask_inv_mag = np.where((light_curve[:, 1] > -10) & (light_curve[:, 1] < 40))
 
-        return mask_inv_mag
+        return flag_invalid_mags(light_curve, self.acceptable_mag_range)
 
-    def flag_duplicate_entries(self, light_curve):
+    def flag_duplicate_entries(self, light_curve, telescope=None):
         """
-        Flags duplicate entries in the light curve.
+        Flags duplicate entries in the light curve, see :func:`flag_duplicate_entries`.
         :param light_curve: numpy array, an array containing JD, magnitude and error
-        :return: mask with entries that are not duplicated
+        :param telescope: numpy array, optional, telescope index of every entry, when the light curve holds
+            several telescopes; entries of different telescopes are never duplicates
+        :return: boolean mask with entries that are not duplicated
         """
-        unique_entries, unique_index = np.unique(light_curve[:,0], return_index = True)
-        mask_unique = []
-        for i in range(len(light_curve[:,0])):
-            if i in unique_index:
-                mask_unique.append(True)
-            else:
-                mask_unique.append(False)
 
+        return flag_duplicate_entries(light_curve, segments=telescope, mode=self.duplicate_mode,
+                                      tolerance=self.duplicate_tolerance)
+
+
+def read_quality_settings(lc_config, log):
+    """
+    Reads the settings of the quality check from the `lc_analyst` section of the configuration,
+    see :class:`LightCurveAnalyst`.
+
+    :param lc_config: dict, the `lc_analyst` section of the configuration
+    :param log: logger instance
+    :return: dictionary with the checks to perform, in the order of `QUALITY_CHECKS`, and their parameters
+    """
+
+    duplicates = lc_config.get("duplicates", {})
+    settings = {"acceptable_mag_range": lc_config.get("acceptable_mag_range", None),
+                "duplicate_mode": duplicates.get("mode", "exact"),
+                "duplicate_tolerance": float(duplicates.get("tolerance", 0.)),
+                "errorbars_sigma": float(lc_config.get("errorbars", {}).get("sigma", 5.)),
+                "outliers_window": int(lc_config.get("outliers", {}).get("window", 11)),
+                "outliers_sigma": float(lc_config.get("outliers", {}).get("sigma", 5.)),
+                }
+    if settings["duplicate_mode"] not in DUPLICATE_MODES:
+        log.error("LC Analyst: Unknown duplicates mode %s, exact times are compared." % settings["duplicate_mode"])
+        settings["duplicate_mode"] = "exact"
+    checks = lc_config.get("checks", DEFAULT_CHECKS)
+    settings["checks"] = [check for check in QUALITY_CHECKS if check in checks]
+    for check in checks:
+        if check not in QUALITY_CHECKS:
+            log.error("LC Analyst: Unknown quality check %s, it will be ignored." % check)
+
+    return settings
+
+def quality_mask(light_curve, segments, settings, robust_masks=None):
+    """
+    Evaluates the checks on the entries of many telescopes (or of many events, see :func:`batch_quality_mask`),
+    each check in one vectorized pass over all of them. Every check is evaluated on the original entries,
+    so the number of entries rejected by each check does not depend on the order of the checks. The exception are
+    the robust statistics checks (`errorbars`, `outliers`), which are evaluated last, on the entries that passed
+    the other checks, so that e.g. a -99 magnitude does not distort the median; they count only the entries they
+    reject on top of the other checks.
+
+    :param light_curve: numpy array, (N, 3) array with JD, magnitude and error
+    :param segments: numpy array or None, segment (telescope) of every entry, entries of a segment together
+    :param settings: dict, settings of the checks, see :func:`read_quality_settings`
+    :param robust_masks: dict, optional, filled with the masks of the robust statistics checks
+    :return: boolean mask with the entries that passed all checks, dictionary with the number of entries
+        rejected by every check and boolean mask with the entries that passed the checks other than the robust ones
+    """
+
+    checks = {"finite": flag_infinite_entries,
+              "duplicates": lambda lc: flag_duplicate_entries(lc, segments=segments,
+                                                              mode=settings["duplicate_mode"],
+                                                              tolerance=settings["duplicate_tolerance"]),
+              "magnitude_range": lambda lc: flag_invalid_mags(lc, settings["acceptable_mag_range"]),
+              "negative_errors": flag_negative_errorbars,
+              }
+    robust_checks = {"errorbars": lambda lc, valid: flag_huge_errorbars(lc, segments=segments, valid=valid,
+                                                                        sigma=settings["errorbars_sigma"]),
+                     "outliers": lambda lc, valid: flag_outliers(lc, segments=segments, valid=valid,
+                                                                 window=settings["outliers_window"],
+                                                                 sigma=settings["outliers_sigma"]),
+                     }
+
+    mask = np.ones(len(light_curve), dtype=bool)
+    rejections = {}
+    for check in settings["checks"]:
+        if check in ROBUST_CHECKS:
+            continue
+        check_mask = np.asarray(checks[check](light_curve), dtype=bool)
+        rejections[check] = int(len(check_mask) - np.count_nonzero(check_mask))
+        mask &= check_mask
+
+    valid = mask.copy()
+    for check in settings["checks"]:
+        if check not in ROBUST_CHECKS:
+            continue
+        check_mask = robust_checks[check](light_curve, valid)
+        rejections[check] = int(np.count_nonzero(valid & ~check_mask))
+        mask &= check_mask
+        if robust_masks is not None:
+            robust_masks[check] = check_mask
+
+    return mask, rejections, valid
+
+def segment_offsets(segments, n_entries):
+    """
+    :param segments: numpy array or None, segment of every entry, entries of a segment together
+    :param n_entries: int, number of entries
+    :return: numpy array of ints, the entries of the `i`-th segment are `offsets[i]:offsets[i + 1]`
+    """
+
+    if segments is None or n_entries == 0:
+        return np.array([0, n_entries], dtype=np.int64)
+
+    return np.concatenate([[0], np.flatnonzero(np.diff(segments)) + 1, [n_entries]]).astype(np.int64)
+
+def grouped_median(values, offsets):
+    """
+    Medians of many segments with one sort of all values.
+
+    :param values: numpy array of floats, values of all segments, the values of a segment together
+    :param offsets: numpy array of ints, bounds of the segments, see :func:`segment_offsets`
+    :return: numpy array with the median of every segment, NaN for empty segments
+    """
+
+    counts = np.diff(offsets)
+    group = np.repeat(np.arange(len(counts)), counts)
+    sorted_values = values[np.lexsort((values, group))]
+    medians = np.full(len(counts), np.nan)
+    filled = counts > 0
+    medians[filled] = 0.5 * (sorted_values[offsets[:-1][filled] + (counts[filled] - 1) // 2] +
+                             sorted_values[offsets[:-1][filled] + counts[filled] // 2])
+
+    return medians
+
+def rolling_median(values, offsets, window):
+    """
+    Centered rolling medians of many segments at once, in O(n log w) time. The window of the `i`-th value of
+    a segment covers values `i - window // 2` to `i - window // 2 + window - 1` and is cut at the ends of the
+    segment, like a centered pandas rolling window with `min_periods=1`. The segments are separated by
+    `window - 1` NaN values, which the rolling median skips, so one pandas rolling scan serves all of them.
+
+    :param values: numpy array of finite floats, values of all segments, the values of a segment together
+    :param offsets: numpy array of ints, bounds of the segments, see :func:`segment_offsets`
+    :param window: int, number of values in a window
+    :return: numpy array with the rolling median of every value
+    """
+
+    # pandas is slow to import and only the outlier check needs it
+    import pandas as pd
+
+    counts = np.diff(offsets)
+    group = np.repeat(np.arange(len(counts)), counts)
+    # position of every value in the padded series
+    padded_index = np.arange(len(values)) + group * (window - 1)
+    padded = np.full(len(values) + max(len(counts) - 1, 0) * (window - 1), np.nan)
+    padded[padded_index] = values
+
+    medians = pd.Series(padded).rolling(window, center=True, min_periods=1).median().to_numpy()
+
+    return medians[padded_index]
+
+def flag_infinite_entries(light_curve):
+    """
+    Flags entries with non-finite values. Similar like in pyLIMA.
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :return: mask with entries that don't have invalid magnitudes
+    """
+    mask_finite_mag = np.isfinite(light_curve[:,1])
+    mask_finite_err = np.isfinite(light_curve[:, 2])
+    final_mask = np.logical_and(mask_finite_mag, mask_finite_err)
+
+    return final_mask
+
+def flag_negative_errorbars(light_curve):
+    """
+    Flags entries with negative errorbars.
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :return: mask with entries that don't have negative uncertianities
+    """
+    mask_neg_err = light_curve[:, 2] > 0
+
+    return mask_neg_err
+
+def flag_invalid_mags(light_curve, acceptable_mag_range=None):
+    """
+    Flags entries with magnitudes smaller than -10. Many surveys indicate an invalid entry
+    by applying -99 or 99 to the light curves.
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :param acceptable_mag_range: dict, optional, `upper_limit` and `lower_limit` of valid magnitudes
+    :return: mask with entries that don't have invalid magnitudes
+    """
+    if acceptable_mag_range is not None:
+        mask_inv_mag = (light_curve[:, 1] > acceptable_mag_range["upper_limit"]) & \
+                       (light_curve[:, 1] < acceptable_mag_range["lower_limit"])
+    else:
+        mask_inv_mag = (light_curve[:, 1] > -10) & (light_curve[:, 1] < 40)
+
+    return mask_inv_mag
+
+def flag_duplicate_entries(light_curve, segments=None, mode="exact", tolerance=0.):
+    """
+    Flags duplicate entries in the light curve. The entries are sorted by time and split into groups of entries
+    with the same time or, with a tolerance, entries following each other by no more than the tolerance.
+    One entry of each group is kept: the first one in the light curve, or with the `best_error` mode the one
+    with the smallest error.
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :param segments: numpy array, optional, segment (telescope) of every entry, when the light curve holds
+        several telescopes; entries of different segments are never duplicates
+    :param mode: str, optional, one of `DUPLICATE_MODES`
+    :param tolerance: float, optional, largest difference of times of duplicates in days, not used by `exact`
+    :return: boolean mask with entries that are not duplicated
+    """
+    times = light_curve[:, 0]
+    mask_unique = np.zeros(len(times), dtype=bool)
+    if len(times) == 0:
         return mask_unique
+
+    tolerance = tolerance if mode != "exact" else 0.
+    # stable sort, so the first entry of equal times stays first
+    if segments is None:
+        order = np.argsort(times, kind="stable")
+    else:
+        order = np.lexsort((times, segments))
+    # written as a negation, so a NaN time starts its own group
+    new_group = np.ones(len(times), dtype=bool)
+    new_group[1:] = ~(np.diff(times[order]) <= tolerance)
+    if segments is not None:
+        new_group[1:] |= np.diff(segments[order]) != 0
+
+    if mode == "best_error":
+        group = np.cumsum(new_group)
+        errors = light_curve[order, 2]
+        # invalid errors are removed by the other checks, so they lose against any valid one
+        errors = np.where(errors > 0, errors, np.inf)
+        # by group, then error, then position in the sorted light curve
+        best = np.lexsort((np.arange(len(times)), errors, group))
+        first = np.ones(len(times), dtype=bool)
+        first[1:] = group[best][1:] != group[best][:-1]
+        mask_unique[order[best[first]]] = True
+    else:
+        mask_unique[order[new_group]] = True
+
+    return mask_unique
+
+def valid_entries(light_curve, segments, valid):
+    """
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :param segments: numpy array or None, segment of every entry, entries of a segment together
+    :param valid: numpy array or None, boolean mask of the entries to use
+    :return: indices of the valid entries and their segments
+    """
+    entries = np.arange(len(light_curve)) if valid is None else np.flatnonzero(valid)
+    entry_segments = np.zeros(len(entries), dtype=np.int64) if segments is None else np.asarray(segments)[entries]
+
+    return entries, entry_segments
+
+def flag_huge_errorbars(light_curve, segments=None, valid=None, sigma=5.):
+    """
+    Flag entries with huge errorbars, sigma clipping the errors of every segment: an error larger than the
+    median error by more than `sigma` scaled median absolute deviations is rejected. The medians of all segments
+    are found with one sort.
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :param segments: numpy array, optional, segment (telescope) of every entry, entries of a segment together
+    :param valid: numpy array, optional, boolean mask of the entries used for the statistics
+    :param sigma: float, optional, clipping limit in scaled median absolute deviations
+    :return: mask with entries that don't have huge uncertianity values, entries not used are kept
+    """
+    mask = np.ones(len(light_curve), dtype=bool)
+    entries, entry_segments = valid_entries(light_curve, segments, valid)
+    offsets = segment_offsets(entry_segments, len(entries))
+    counts = np.diff(offsets)
+    errors = light_curve[entries, 2]
+    median = np.repeat(grouped_median(errors, offsets), counts)
+    spread = MAD_TO_SIGMA * np.repeat(grouped_median(np.abs(errors - median), offsets), counts)
+    mask[entries] = errors <= median + sigma * spread
+
+    return mask
+
+def flag_outliers(light_curve, segments=None, valid=None, window=11, sigma=5.):
+    """
+    Flag outliers with a rolling median filter. The entries of every segment are sorted by time, and
+    compared to the median of the `window` entries around them; an entry is rejected if it is further
+    from the median than `sigma` times the rolling scaled median absolute deviation, added in quadrature
+    to its error. The rolling medians of all segments are computed together, see :func:`rolling_median`.
+    Segments with less than three entries are kept.
+    :param light_curve: numpy array, an array containing JD, magnitude and error
+    :param segments: numpy array, optional, segment (telescope) of every entry, entries of a segment together
+    :param valid: numpy array, optional, boolean mask of the entries used for the statistics
+    :param window: int, optional, number of entries of the rolling window
+    :param sigma: float, optional, rejection limit
+    :return: mask with entries that are not outliers, entries not used are kept
+    """
+    mask = np.ones(len(light_curve), dtype=bool)
+    entries, entry_segments = valid_entries(light_curve, segments, valid)
+    order = np.lexsort((light_curve[entries, 0], entry_segments))
+    entries, entry_segments = entries[order], entry_segments[order]
+    offsets = segment_offsets(entry_segments, len(entries))
+    mags = light_curve[entries, 1]
+    deviations = np.abs(mags - rolling_median(mags, offsets, window))
+    spread = MAD_TO_SIGMA * rolling_median(deviations, offsets, window)
+    limit = sigma * np.sqrt(spread ** 2 + light_curve[entries, 2] ** 2)
+    short = np.repeat(np.diff(offsets) < 3, np.diff(offsets))
+    mask[entries] = (deviations <= limit) | short
+
+    return mask
+
+def batch_quality_mask(data, segments, log, lc_config=None):
+    """
+    Quality check of the light curves of many events at once. The entries of all events are given as one
+    concatenated array, with the segment (e.g. one telescope of one event) of every entry, and every check is one
+    vectorized pass over the whole array; duplicates, the medians of the errors and the rolling medians
+    are found within segments, but for all segments together.
+
+    :param data: numpy array, (N, 3) array with JD, magnitude and error of all entries
+    :param segments: numpy array of ints, segment of every entry, entries of a segment together
+    :param log: logger instance
+    :param lc_config: dict, optional, the `lc_analyst` section of the configuration applied to all segments,
+        see :class:`LightCurveAnalyst`
+    :return: boolean mask with the entries that passed all checks and a dictionary with the number of entries
+        rejected by every check
+    """
+
+    settings = read_quality_settings(lc_config or {}, log)
+    mask, rejections, _ = quality_mask(np.asarray(data, dtype=float).reshape(-1, 3), np.asarray(segments), settings)
+
+    return mask, rejections
+
+def batch_quality_check(light_curve_sets, log, lc_config=None):
+    """
+    Cleans the light curves of many events with one :func:`batch_quality_mask`; every telescope of every event
+    is a segment.
+
+    :param light_curve_sets: list of :class:`MFPipeline.analyst.light_curve_set.LightCurveSet` or lists of
+        light curves, one for every event
+    :param log: logger instance
+    :param lc_config: dict, optional, the `lc_analyst` section of the configuration applied to all events
+    :return: list with the cleaned :class:`MFPipeline.analyst.light_curve_set.LightCurveSet` of every event and
+        a dictionary with the number of entries rejected by every check
+    """
+
+    light_curve_sets = [LightCurveSet.from_entries(light_curves) for light_curves in light_curve_sets]
+    if len(light_curve_sets) == 0:
+        return [], {}
+    data = np.concatenate([light_curves.data for light_curves in light_curve_sets], axis=1)
+    first_segment = np.cumsum([0] + [light_curves.n_telescopes for light_curves in light_curve_sets])
+    segments = np.concatenate([light_curves.telescope + first for light_curves, first in
+                               zip(light_curve_sets, first_segment)])
+
+    mask, rejections = batch_quality_mask(data.T, segments, log, lc_config=lc_config)
+    bounds = np.cumsum([0] + [light_curves.data.shape[1] for light_curves in light_curve_sets])
+    cleaned = [light_curves.select(mask[start:stop]) for light_curves, start, stop in
+               zip(light_curve_sets, bounds[:-1], bounds[1:])]
+    log.info("LC Analyst: Batch quality check kept %d of %d entries of %d events." %
+             (np.count_nonzero(mask), len(mask), len(light_curve_sets)))
+
+    return cleaned, rejections
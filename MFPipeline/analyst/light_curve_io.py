@@ -0,0 +1,93 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+# Folder, next to the light curve file, with the binary copies of parsed light curves.
+CACHE_FOLDER = ".lc_cache"
+
+
+def read_light_curve_text(path):
+    """
+    This function parses a text file with a light curve, with the C parser of pandas. Only the first three
+    columns (time, magnitude, error) are read; lines starting with `#` are skipped.
+
+    :param path: str, path to the file with columns separated by white space
+    :return: numpy array of floats with shape (n, 3)
+    """
+    # pandas is slow to import and cached light curves do not need it
+    import pandas as pd
+
+    data = pd.read_csv(path, sep=r"\s+", header=None, usecols=[0, 1, 2], comment="#", dtype=float,
+                       engine="c")
+
+    return data.to_numpy(dtype=float)
+
+def cache_file_prefix(path, cache_path):
+    """
+    :param path: str, path to the light curve file
+    :param cache_path: str, folder with the cached light curves
+    :return: str, beginning of the names of all cached copies of the file
+    """
+
+    path_hash = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:12]
+
+    return os.path.join(cache_path, "%s_%s" % (os.path.basename(path), path_hash))
+
+def cache_file_name(path, cache_path):
+    """
+    This function gives the name of the cached copy of a light curve file. The name contains the modification
+    time and size of the file, so a file that was changed gets a new copy.
+
+    :param path: str, path to the light curve file
+    :param cache_path: str, folder with the cached light curves
+    :return: str, path to the `.npy` file
+    """
+
+    stat = os.stat(path)
+
+    return "%s.%d_%d.npy" % (cache_file_prefix(path, cache_path), stat.st_mtime_ns, stat.st_size)
+
+def load_light_curve(path, cache_path=None, log=None):
+    """
+    This function loads a light curve from a text file. The parsed light curve is saved as a binary `.npy` file,
+    and later runs map this file into memory instead of parsing the text again. Copies made for older versions
+    of the file are removed.
+
+    :param path: str, path to the light curve file
+    :param cache_path: str, optional, folder with the cached light curves; by default a `.lc_cache` folder
+        next to the file, False disables the cache
+    :param log: logger instance, optional
+    :return: numpy array of floats with shape (n, 3), read-only if it comes from the cache
+    """
+
+    if cache_path is False:
+        return read_light_curve_text(path)
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(path), CACHE_FOLDER)
+
+    cached_file = cache_file_name(path, cache_path)
+    if os.path.isfile(cached_file):
+        try:
+            return np.load(cached_file, mmap_mode="r")
+        except (OSError, ValueError) as err:
+            if log is not None:
+                log.debug("Light Curve IO: Cannot read cached light curve %s: %s" % (cached_file, err))
+
+    light_curve = read_light_curve_text(path)
+
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        for old_file in glob.glob(glob.escape(cache_file_prefix(path, cache_path)) + ".*.npy"):
+            os.remove(old_file)
+        # written under a temporary name, so other processes never map half of the file
+        temporary_file = "%s.%d.tmp" % (cached_file, os.getpid())
+        with open(temporary_file, "wb") as file:
+            np.save(file, light_curve)
+        os.replace(temporary_file, cached_file)
+    except OSError as err:
+        # e.g. a read-only data folder, the light curve is parsed again next time
+        if log is not None:
+            log.debug("Light Curve IO: Cannot cache light curve %s: %s" % (path, err))
+
+    return light_curve
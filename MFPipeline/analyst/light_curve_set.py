@@ -0,0 +1,156 @@
+import numpy as np
+
+
+class LightCurveSet:
+    """
+    Light curves of one event, from all telescopes, kept in one columnar block. Time, magnitude and error of all
+    data points are stored in contiguous rows of a (3, N) array, with the points of each telescope one after
+    another; `offsets` gives the start of every telescope. The light curve of a telescope is a view of the block,
+    so the stages of the analysis do not copy the data.
+
+    Iterating over the set gives dictionaries with `lc`, `survey` and `band`, like the list of light curves
+    parsed by the Event Analyst, where `lc` is an (n, 3) view.
+
+    :param data: numpy array of floats with shape (3, N), time, magnitude and error of all points, not copied if
+        it already has this type, so it can be a (read-only) view of a memory-mapped file
+    :param offsets: numpy array of ints with n_telescopes + 1 elements, the points of telescope `i` are
+        `data[:, offsets[i]:offsets[i + 1]]`
+    :param surveys: list, survey names of the telescopes
+    :param bands: list, band names of the telescopes
+    """
+    def __init__(self, data, offsets, surveys, bands):
+        self.data = np.asarray(data, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.surveys = list(surveys)
+        self.bands = list(bands)
+
+    @classmethod
+    def from_entries(cls, light_curves):
+        """
+        Builds a set from a list of light curves. A single light curve, e.g. a memory-mapped `.npy` file spilled
+        by the Controller, is kept as a transposed view and is not copied. Light curves of several telescopes are
+        copied into the block once.
+
+        :param light_curves: list of dictionaries with `lc` (list or array with shape (n, 3)), `survey` and `band`,
+            or a :class:`LightCurveSet`, which is returned as it is
+        :return: :class:`LightCurveSet`
+        """
+
+        if isinstance(light_curves, LightCurveSet):
+            return light_curves
+
+        arrays = [cls.entry_array(entry) for entry in light_curves]
+        if len(arrays) == 1:
+            return cls(arrays[0].T, [0, len(arrays[0])], [light_curves[0]["survey"]], [light_curves[0]["band"]])
+
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(array) for array in arrays])
+        data = np.empty((3, offsets[-1]), dtype=float)
+        for array, start, stop in zip(arrays, offsets[:-1], offsets[1:]):
+            data[:, start:stop] = array.T
+
+        return cls(data, offsets,
+                   [entry["survey"] for entry in light_curves],
+                   [entry["band"] for entry in light_curves])
+
+    @staticmethod
+    def entry_array(entry):
+        """
+        :param entry: dictionary with `lc`, `survey` and `band`
+        :return: numpy array of floats with shape (n, 3), the light curve of the entry
+        :raises ValueError: if the light curve is not empty and does not have 3 columns, e.g. it is transposed
+        """
+
+        light_curve = np.asarray(entry["lc"], dtype=float)
+        if light_curve.size == 0:
+            return light_curve.reshape(0, 3)
+        if light_curve.ndim != 2 or light_curve.shape[1] != 3:
+            raise ValueError("Light curve of %s %s has shape %s, expected (n, 3) with time, magnitude and error." %
+                             (entry.get("survey"), entry.get("band"), light_curve.shape))
+
+        return light_curve
+
+    @property
+    def time(self):
+        return self.data[0]
+
+    @property
+    def mag(self):
+        return self.data[1]
+
+    @property
+    def err(self):
+        return self.data[2]
+
+    @property
+    def n_telescopes(self):
+        return len(self.surveys)
+
+    @property
+    def telescope(self):
+        """
+        :return: numpy array of ints with the index of the telescope of every point
+        """
+
+        return np.repeat(np.arange(self.n_telescopes), np.diff(self.offsets))
+
+    def light_curve(self, i):
+        """
+        :param i: int, index of the telescope
+        :return: numpy array with shape (n, 3), a view of the points of the telescope
+        """
+
+        return self.data[:, self.offsets[i]:self.offsets[i + 1]].T
+
+    def select(self, mask):
+        """
+        Keeps the points selected by a mask, e.g. the points that passed the quality check. Boolean selection
+        always copies, so all telescopes are compacted in one pass into a new block.
+
+        :param mask: numpy array of booleans with N elements
+        :return: :class:`LightCurveSet` with the selected points
+        """
+
+        mask = np.asarray(mask, dtype=bool)
+        counts = np.bincount(self.telescope[mask], minlength=self.n_telescopes)
+        offsets = np.zeros(self.n_telescopes + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+
+        return LightCurveSet(self.data[:, mask], offsets, self.surveys, self.bands)
+
+    def to_entries(self):
+        """
+        :return: list of dictionaries with `lc` (view with shape (n, 3)), `survey` and `band`
+        """
+
+        return [{"lc": self.light_curve(i), "survey": self.surveys[i], "band": self.bands[i]}
+                for i in range(self.n_telescopes)]
+
+    def save(self, path):
+        """
+        Saves the set to a binary `.npz` file.
+
+        :param path: str, path to the file
+        """
+
+        np.savez(path, data=self.data, offsets=self.offsets,
+                 surveys=np.array(self.surveys, dtype=str), bands=np.array(self.bands, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: str, path to the file saved by :func:`save`
+        :return: :class:`LightCurveSet`
+        """
+
+        with np.load(path, allow_pickle=False) as file:
+            return cls(file["data"], file["offsets"], file["surveys"].tolist(), file["bands"].tolist())
+
+    def __len__(self):
+        return self.n_telescopes
+
+    def __getitem__(self, i):
+        return {"lc": self.light_curve(i), "survey": self.surveys[i], "band": self.bands[i]}
+
+    def __iter__(self):
+        return iter(self.to_entries())
@@ -0,0 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage:
+    '''
+    One stage of the analysis of an event.
+
+    :param name: str, name of the stage
+    :param function: function running the stage, returns False if the stage failed
+    :param requires: list, stages that have to succeed before this stage starts, the stage is skipped otherwise
+    :param after: list, stages that have to end, successfully or not, before this stage starts
+    :param main_thread: boolean, should the stage run in the thread that runs the graph? Stages using time limits
+        (see :func:`MFPipeline.time_limit.time_limit`) or plotting libraries that are not thread safe should.
+    '''
+    def __init__(self, name, function, requires=(), after=(), main_thread=False):
+        self.name = name
+        self.function = function
+        self.requires = list(requires)
+        self.after = list(after)
+        self.main_thread = main_thread
+
+
+class StageGraph:
+    '''
+    Runs the stages of the analysis of an event as a dependency graph. A stage starts as soon as the stages it
+    depends on are done, so independent stages, e.g. a catalogue query and a fit, run at the same time.
+    Stages marked with `main_thread` run in the calling thread one by one, the other ones in a thread pool.
+
+    :param log: logger instance, log started by Event Analyst
+    :param max_workers: int, optional, number of threads running the stages outside of the main thread;
+        with 0 all stages run in the calling thread, in the order in which they were added
+    '''
+    def __init__(self, log, max_workers=2):
+        self.log = log
+        self.max_workers = max_workers
+        self.stages = []
+        self.statuses = {}
+        self.skipped = []
+
+    def add_stage(self, name, function, requires=(), after=(), main_thread=False):
+        '''
+        Adds a stage to the graph. The dependencies have to be added before the stage.
+
+        :param name: str, name of the stage
+        :param function: function running the stage, returns False if the stage failed
+        :param requires: list, optional, stages that have to succeed before this stage starts
+        :param after: list, optional, stages that have to end before this stage starts
+        :param main_thread: boolean, optional, should the stage run in the thread that runs the graph?
+        '''
+
+        self.stages.append(Stage(name, function, requires=requires, after=after,
+                                 main_thread=main_thread or self.max_workers == 0))
+
+    def call(self, stage):
+        '''
+        Runs one stage.
+
+        :param stage: :class:`Stage` to run
+        :return: boolean, False if the stage failed or raised an exception
+        '''
+
+        try:
+            return stage.function() is not False
+        except Exception as err:
+            self.log.error(f"Stage Graph: Stage %s failed: %s, %s" % (stage.name, err, type(err)))
+            return False
+
+    def run(self):
+        '''
+        Runs all stages of the graph.
+
+        :return: dictionary with the status of every stage, False for failed and skipped stages
+        '''
+
+        pending = list(self.stages)
+        main_ready = []
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        interrupted = True
+        try:
+            while len(pending) > 0 or len(main_ready) > 0 or len(running) > 0:
+                # a skipped stage may make the stages that come after it ready, so repeat until nothing changes
+                progress = True
+                while progress:
+                    progress = False
+                    for stage in list(pending):
+                        if not all([name in self.statuses for name in stage.requires + stage.after]):
+                            continue
+                        pending.remove(stage)
+                        progress = True
+                        if not all([self.statuses[name] for name in stage.requires]):
+                            self.log.info("Stage Graph: Skipping stage %s, the stages it requires failed." %
+                                          stage.name)
+                            self.statuses[stage.name] = False
+                            self.skipped.append(stage.name)
+                        elif stage.main_thread:
+                            main_ready.append(stage)
+                        else:
+                            self.log.debug("Stage Graph: Starting stage %s in the background." % stage.name)
+                            running[executor.submit(self.call, stage)] = stage.name
+
+                if len(main_ready) > 0:
+                    stage = main_ready.pop(0)
+                    self.log.debug("Stage Graph: Starting stage %s." % stage.name)
+                    self.statuses[stage.name] = self.call(stage)
+                elif len(running) > 0:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.statuses[running.pop(future)] = future.result()
+                elif len(pending) > 0:
+                    self.log.error("Stage Graph: Stages %s depend on stages that are not in the graph." %
+                                   [stage.name for stage in pending])
+                    for stage in pending:
+                        self.statuses[stage.name] = False
+                    pending = []
+            interrupted = False
+        finally:
+            # on a time limit of the whole event do not wait for the background stages
+            executor.shutdown(wait=not interrupted, cancel_futures=True)
+
+        return self.statuses
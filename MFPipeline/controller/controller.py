@@ -2,19 +2,235 @@ import yaml
 import logging
 import sys
 import os
+import json
+import numpy as np
 
+import time
 import subprocess
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from MFPipeline import logs
+from MFPipeline.time_limit import time_limit, TimeLimitExceeded
+from MFPipeline.controller import controller_tools
+from MFPipeline.controller import scheduler
+from MFPipeline.controller import transport
+from MFPipeline.controller import manifest
+from MFPipeline.controller import work_queue
+from MFPipeline.controller import watcher
+from MFPipeline.controller import memory
+from MFPipeline.controller import journal
+from MFPipeline.controller import metrics
 
-# from MFPipeline import logs
 logger = logging.getLogger(__name__)
 formatter = logging.Formatter('%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s',
                                   datefmt='%Y-%m-%d %H:%M:%S')
 
-def run_parallel_analyst(command):
-    logger.info("About to start subprocess for event: ")
+def run_parallel_analyst(task):
+    '''
+    Runs an Event Analyst for one event in a new interpreter.
+
+    :param task: dict, contains event_name, analyst_path and the command to run
+
+    :return: dictionary with the record of the run, see :func:`controller_tools.create_record`
+    '''
+    command = task["command"]
+    logger.info("About to start subprocess for event: %s" % task["event_name"])
     logger.info("Command: "+str(command[:-2]))
-    subprocess.run(command, shell=False)
+
+    start_time = time.time()
+    process = subprocess.Popen(command, shell=False,
+                               env=controller_tools.thread_environment(task["threads"]))
+    exit_code, usage, timed_out = wait_for_process(process, start_time, task.get("event_timeout", None),
+                                                   task["event_name"])
+    wall_time = time.time() - start_time
+
+    return controller_tools.create_record(task["event_name"], task["analyst_path"], exit_code,
+                                          start_time, wall_time,
+                                          controller_tools.usage_cpu_time(usage),
+                                          controller_tools.usage_peak_rss(usage),
+                                          status="timeout" if timed_out else None)
+
+def wait_for_process(process, start_time, timeout, label):
+    '''
+    Waits for an analyst subprocess and kills it if it runs longer than its time limit.
+
+    :param process: subprocess.Popen, running analyst
+    :param start_time: float, time when the process was started, in seconds since epoch
+    :param timeout: float, time limit in seconds, None for no limit
+    :param label: str, name of the event or chunk, used in the log
+
+    :return: exit code, resource usage of the process and boolean, True if the process was killed
+    '''
+
+    timed_out = False
+    if timeout is None:
+        # wait4 gives the resource usage of this child only, not of all children of the worker
+        _, wait_status, usage = os.wait4(process.pid, 0)
+    else:
+        while True:
+            pid, wait_status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            if time.time() - start_time > timeout:
+                logger.error("Controller: %s exceeded its time limit of %s s, killing it." % (label, timeout))
+                process.kill()
+                _, wait_status, usage = os.wait4(process.pid, 0)
+                timed_out = True
+                break
+            time.sleep(0.1)
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+
+    return process.returncode, usage, timed_out
+
+def run_batch_analyst(task):
+    '''
+    Runs Event Analysts for a chunk of events, one after another, in one new interpreter.
+    The heavy imports are paid once per chunk, while a crash still only takes down this chunk.
+    The interpreter writes the record of every event as soon as the event is done, so the events
+    that did not finish before a crash or a kill are the only ones reported as failed.
+
+    :param task: dict, contains the events, the command to run and the paths of the batch and results files
+
+    :return: list of dictionaries with the records of the events, see :func:`controller_tools.create_record`
+    '''
+    logger.info("About to start subprocess for events: %s" % task["events"])
+
+    start_time = time.time()
+    process = subprocess.Popen(task["command"], shell=False,
+                               env=controller_tools.thread_environment(task["threads"]))
+    timeout = None
+    if task.get("event_timeout", None) is not None:
+        timeout = task["event_timeout"] * len(task["events"])
+    exit_code, _, timed_out = wait_for_process(process, start_time, timeout, "Chunk %s" % task["events"])
+
+    records = {}
+    if os.path.isfile(task["results_path"]):
+        with open(task["results_path"], "r") as file:
+            for line in file:
+                if len(line.strip()) > 0:
+                    record = json.loads(line)
+                    records[record["event_name"]] = record
+
+    for event in task["events"]:
+        if event not in records:
+            records[event] = controller_tools.failed_record(
+                event, "Chunk subprocess exited with code %s before the event finished." % exit_code)
+            if timed_out:
+                records[event]["status"] = "timeout"
+
+    return [records[event] for event in task["events"]]
+
+def run_batch(tasks, results_path):
+    '''
+    Runs the in-process tasks of a chunk of events one after another in the current interpreter and appends
+    the record of every event to the results file as a JSON line. Called by `event_analyst.py --batch`.
+
+    :param tasks: list of dictionaries with tasks, see :func:`run_in_process_analyst`
+    :param results_path: str, path to the file with the records
+
+    :return: boolean, True if all events finished
+    '''
+
+    status = True
+    for task in tasks:
+        record = run_in_process_analyst(task)
+        status = status and record["status"] == "finished"
+        with open(results_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+    return status
+
+def limit_worker_threads(threads):
+    '''
+    Initializer of the workers. Pins the number of BLAS/OpenMP threads of the worker, both for libraries that
+    are already loaded (with threadpoolctl) and for the ones that will be loaded later (environment variables).
+
+    :param threads: int, number of threads per worker
+    '''
+    global worker_thread_limits
+    from threadpoolctl import threadpool_limits
+
+    for variable in controller_tools.THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    # keep the reference, the limits stay applied for the lifetime of the worker
+    worker_thread_limits = threadpool_limits(limits=threads)
+
+def warm_up_worker(threads):
+    '''
+    Initializer of the in-process workers. Imports the Event Analyst with all of its heavy dependencies
+    (pyLIMA, astropy, astroquery, plotting), so that the cost is paid once per worker and not once per event.
+
+    :param threads: int, number of BLAS/OpenMP threads per worker
+    '''
+    limit_worker_threads(threads)
+    # the Event Analyst imports its analysts lazily, so load them here
+    from MFPipeline.analyst import event_analyst, fit_analyst, cmd_analyst
+    from MFPipeline.fitting_support.pyLIMA import fit_pyLIMA
+    from astroquery.gaia import Gaia
+    from plotly import graph_objs
+    # pin again the thread pools of the libraries loaded by the import
+    limit_worker_threads(threads)
+
+def run_in_process_analyst(task):
+    '''
+    Builds and runs an :class:`MFPipeline.analyst.event_analyst.EventAnalyst` inside a warm worker process.
+
+    :param task: dict, contains event_name, analyst_path, log_level, stream and either config_path, config_dict
+        or config_spill
+
+    :return: dictionary with the record of the run, see :func:`controller_tools.create_record`;
+        the peak memory is the high-water mark of the worker, `event_memory` the memory added by the event
+    '''
+    from MFPipeline.analyst.event_analyst import EventAnalyst
+
+    logger.info("About to start in-process analyst for event: %s" % task["event_name"])
+    exit_code, status = 0, None
+    start_time = time.time()
+    start_usage = controller_tools.self_usage()
+    sampler = memory.RssSampler()
+    try:
+        with sampler, time_limit(task.get("event_timeout", None), "event"):
+            if task.get("config_spill") is not None:
+                with open(task["config_spill"], "r") as file:
+                    task["config_dict"] = json.load(file)
+            if task.get("config_path") is not None:
+                event_analyst = EventAnalyst(task["event_name"], task["analyst_path"], task["log_level"],
+                                             config_path=task["config_path"],
+                                             stream=task["stream"],
+                                             stage_timeouts=task.get("stage_timeouts", None)
+                                             )
+            else:
+                event_analyst = EventAnalyst(task["event_name"], task["analyst_path"], task["log_level"],
+                                             config_dict=task["config_dict"],
+                                             stream=task["stream"],
+                                             stage_timeouts=task.get("stage_timeouts", None)
+                                             )
+            if not event_analyst.run_single_analyst():
+                exit_code = 1
+    except TimeLimitExceeded:
+        logger.error("Controller: Event %s exceeded its time limit of %s s." %
+                     (task["event_name"], task["event_timeout"]))
+        exit_code, status = 1, "timeout"
+    except (Exception, SystemExit) as err:
+        # Analysts call quit() on missing configuration, it cannot be allowed to take down the worker.
+        logger.error("Controller: Analyst for %s failed: %s, %s" % (task["event_name"], err, type(err)))
+        exit_code = 1
+
+    # an interrupted analyst did not close its log, the next event of this worker would write to it
+    analyst_log = logging.getLogger("analyst_log")
+    if len(analyst_log.handlers) > 0:
+        logs.close_log(analyst_log)
+
+    usage = controller_tools.self_usage()
+    cpu_time = controller_tools.usage_cpu_time(usage) - controller_tools.usage_cpu_time(start_usage)
+
+    record = controller_tools.create_record(task["event_name"], task["analyst_path"], exit_code,
+                                            start_time, time.time() - start_time, cpu_time,
+                                            controller_tools.usage_peak_rss(usage),
+                                            status=status)
+    record["event_memory"] = round(sampler.memory, 1) if sampler.memory is not None else None
+
+    return record
 
 class Controller:
     '''
@@ -26,6 +242,80 @@ class Controller:
     :param config_dict: dictionary, optional, a dictionary containing configuration of the controller
     :param analyst_dicts: dictionary, optional, dictionary containing jsons with information for analysts
     :param stream: optional, boolean, should the log be accessible through Kubernetes?
+
+    Notes on configuration:
+
+    The configuration can contain the following keywords:
+
+    * `events_path` str, path to the folder with event folders
+    * `software_dir` str, path to the folder with `event_analyst.py`
+    * `python_compiler` str, python interpreter used to launch analysts in subprocesses
+    * `group_processing_limit` int, maximum number of events processed at the same time
+    * `config_type` str, format of the analyst config files, `yaml` or `json`
+    * `log_location` str, path to the folder with the controller log
+    * `log_level` str, level of logging
+    * `log_stream` boolean, optional, should the log be accessible through Kubernetes?
+    * `worker_mode` str, optional, `subprocess` (default) starts a new interpreter for every event,
+      `in_process` runs the Event Analysts directly inside warm worker processes that handle many events
+    * `batch_size` int, optional, in the `subprocess` worker mode, number of events analysed one after another
+      by one interpreter, 1 by default; the imports are paid once per chunk and a crash only affects one chunk
+    * `memory_limit` float, optional, memory ceiling in MB for the controller with its workers; new events are
+      started only while the memory in use plus the expected peak of the event stays under it. No limit if not
+      specified
+    * `memory_estimates_path` str, optional, path to the file with peak memory of the events measured in the
+      previous runs, `log_location` + `memory_estimates.json` if not specified
+    * `default_event_memory` float, optional, expected peak memory in MB of an event when nothing was measured yet,
+      1024 MB by default
+    * `journal_path` str, optional, path to the run journal with starts and finishes of events,
+      `log_location` + `run_journal.jsonl` if not specified
+    * `resume` boolean, optional, continue the run recorded in the journal: events completed in that run are not
+      processed again, events that were still running or failed are. A new journal is started otherwise.
+      Shards do not keep a journal, the work queue already keeps track of their events
+    * `metrics_path` str, optional, path to a file where live metrics of the run (queue depth, events per minute,
+      event and stage latencies, failures) are written in the Prometheus text format, e.g. for the node exporter
+      textfile collector
+    * `metrics_port` int, optional, port of a local HTTP endpoint serving the same metrics at `/metrics`
+    * `summary_path` str, optional, path to the JSON file with the summary of the run,
+      `log_location` + `run_summary.json` if not specified
+    * `spill_path` str, optional, folder where analyst dicts and their light curves are written for the
+      subprocess workers, `log_location` + `spill/` if not specified
+    * `core_budget` int, optional, number of cores the controller can use, all available cores if not specified
+    * `threads_per_worker` int, optional, number of BLAS/OpenMP threads of every worker; if not specified,
+      the core budget is split evenly between `group_processing_limit` workers. The number of workers is
+      reduced if the budget cannot give every worker its threads
+    * `incremental` boolean, optional, skip events whose inputs did not change since their last successful run
+      and reuse their outputs
+    * `manifest_path` str, optional, path to the manifest with input hashes of processed events,
+      `events_path` + `manifest.json` if not specified
+    * `queue_path` str, optional, path to a spool folder with a work queue shared by several controllers,
+      see :class:`MFPipeline.controller.work_queue.SpoolQueue`; when specified, the controller works as a shard
+    * `lease_time` float, optional, time in seconds after which an event of a dead shard is retried, 300 s by default
+    * `max_attempts` int, optional, how many times an event of a dead shard is retried, 3 by default
+    * `worker_id` str, optional, name of the shard, host name and process id if not specified
+    * `poll_interval` float, optional, how often in seconds the controller checks its workers and renews leases,
+      5 s by default
+    * `event_timeout` float, optional, wall-clock limit in seconds for one event; a subprocess analyst is killed,
+      an in-process analyst is interrupted when it gets back to Python code. No limit if not specified
+    * `stage_timeouts` dict, optional, wall-clock limits in seconds for the stages of the Event Analyst,
+      e.g. `{"fit": 600}`, see :class:`MFPipeline.analyst.event_analyst.EventAnalyst`
+    * `max_retries` int, optional, how many times a failed or timed out event is run again, 0 by default
+    * `retry_backoff` float, optional, delay in seconds before the first retry, doubled with every next retry,
+      30 s by default
+    * `poison_path` str, optional, path to the poison list with consecutive failures of the events,
+      `log_location` + `poison_list.json` if not specified
+    * `poison_threshold` int, optional, number of consecutive failed runs after which an event is not started
+      anymore, until it is removed from the poison list, 3 by default
+    * `watch_debounce` float, optional, in the watch mode, time in seconds without changes to the inputs of an event
+      after which it is refitted, 2 s by default
+    * `watch_new_events` boolean, optional, in the watch mode, should new event folders in `events_path` be watched?
+    * `scheduling` str, optional, `fifo` (default) dispatches events in the order of the event list,
+      `longest_first` dispatches first the events with the highest estimated cost
+    * `ongoing_first` boolean, optional, with `longest_first` scheduling dispatch events expected to be ongoing
+      before the finished ones, so that alerts come out sooner
+    * `pre_clean` dict, optional, the light curves of all events given in analyst dicts are cleaned together
+      before dispatching, with one batch quality check, see
+      :func:`MFPipeline.analyst.light_curve_analyst.batch_quality_check`; the dictionary holds the `lc_analyst`
+      keywords of the check (an empty dictionary runs the default checks). Not used by shards of a work queue
     '''
     def __init__(self,
                  event_list,
@@ -35,6 +325,10 @@ class Controller:
 
         self.event_list = event_list
         self.analyst_dicts = analyst_dicts
+        self.core_split = None
+        self.memory_estimates = {}
+        self.journal = None
+        self.metrics = metrics.ControllerMetrics()
 
         if config_dict is not None:
             # READ config_dict
@@ -74,16 +368,18 @@ class Controller:
             print("Error! Controller needs information!!!")
             quit()
 
-    def parse_config(self):
+    def parse_config(self, config_path):
         '''
         Function that parses the YAML file with configuration.
 
+        :param config_path: str, path to the YAML file with the configuration of the controller
+
         :return: configuration in form of a dictionary.
         '''
 
         config = {}
         try:
-            with open(self.config_path, 'r') as file:
+            with open(config_path, 'r') as file:
                 controller_config = yaml.safe_load(file)
 
             config["events_path"]  = controller_config.get("events_path")
@@ -95,6 +391,23 @@ class Controller:
             config["log_level"] = controller_config.get("log_level")
             if "log_stream" in controller_config:
                 config["log_stream"] = controller_config.get("log_stream")
+            config["worker_mode"] = controller_config.get("worker_mode", "subprocess")
+            if "summary_path" in controller_config:
+                config["summary_path"] = controller_config.get("summary_path")
+            config["scheduling"] = controller_config.get("scheduling", "fifo")
+            config["ongoing_first"] = controller_config.get("ongoing_first", False)
+            config["incremental"] = controller_config.get("incremental", False)
+            if "manifest_path" in controller_config:
+                config["manifest_path"] = controller_config.get("manifest_path")
+            for key in ["core_budget", "threads_per_worker", "queue_path", "lease_time", "max_attempts", "worker_id", "poll_interval",
+                        "event_timeout", "stage_timeouts", "max_retries", "retry_backoff", "poison_path",
+                        "poison_threshold", "watch_debounce", "watch_new_events", "batch_size",
+                        "memory_limit", "memory_estimates_path", "default_event_memory", "journal_path", "resume",
+                        "metrics_path", "metrics_port", "pre_clean"]:
+                if key in controller_config:
+                    config[key] = controller_config.get(key)
+            if "spill_path" in controller_config:
+                config["spill_path"] = controller_config.get("spill_path")
 
         except Exception as err:
             logger.exception(f"Controller: %s, %s" % (err, type(err)))
@@ -102,58 +415,747 @@ class Controller:
 
         return config
 
-    def launch_analysts(self):
+    def schedule_events(self):
         '''
-        This function starts and parallelizes the :class:`MFPipeline.analyst.event_analyst.EventAnalyst`.
+        Orders the events for dispatching. With `longest_first` scheduling the cost of every event is estimated
+        from its light curve point counts, number of telescopes and expected fitting path, and the most expensive
+        events are dispatched first, so they do not stretch the end of the batch.
 
-        :return: Status of work???
+        :return: list with event names in the order of dispatching
         '''
 
-        logger.info(f"Controller: Start processing.")
-        # First create all the commands to run the analysts
-        commands = []
-        logger.debug(f"Controller: Creating the commands to launch analysts.")
+        if self.config.get("scheduling", "fifo") != "longest_first":
+            return list(self.event_list)
+
+        event_costs, unknown_events = {}, []
         for event in self.event_list:
-            command = [self.config["python_compiler"],
-                       self.config["software_dir"]+"event_analyst.py",
-                       "--event_name", event,
-                       "--analyst_path",  self.config["events_path"]+str(event)+"/",
-                       "--log_level", self.config["log_level"],
-                       ]
+            event_config = scheduler.read_event_config(event, self.config["events_path"],
+                                                       self.config.get("config_type", "yaml"),
+                                                       analyst_dicts=self.analyst_dicts)
+            if len(event_config) == 0:
+                unknown_events.append(event)
+            event_costs[event] = scheduler.estimate_event_cost(event_config,
+                                                               self.config["events_path"]+str(event)+"/")
+        scheduler.fill_unknown_costs(event_costs, unknown_events)
+        for event in self.event_list:
+            logger.debug(f"Controller: Estimated cost of %s: %d, expected %s event." %
+                         (event, event_costs[event][0], event_costs[event][1]))
+
+        ordered_events = scheduler.order_events(event_costs, ongoing_first=self.config.get("ongoing_first", False))
+        logger.info(f"Controller: Events scheduled longest first: %s" % ordered_events)
+
+        return ordered_events
+
+    def find_changed_events(self, events):
+        '''
+        Compares the content hash of the inputs of every event with the manifest of the previous runs.
+        The hash covers the light curve files named in `light_curves[*].path`, the configuration sections
+        and the pipeline version.
+
+        :param events: list, names of the events to check
+
+        :return: list with events that have to be processed, dictionary with records of skipped events and
+            dictionary with input hashes of the events to process
+        '''
+
+        manifest_path = self.config.get("manifest_path", self.config["events_path"] + "manifest.json")
+        previous_manifest = manifest.load_manifest(manifest_path)
+
+        changed_events, skipped_records, input_hashes = [], {}, {}
+        for event in events:
+            analyst_path = self.config["events_path"]+str(event)+"/"
+            event_config = scheduler.read_event_config(event, self.config["events_path"],
+                                                       self.config.get("config_type", "yaml"),
+                                                       analyst_dicts=self.analyst_dicts)
+            config_path = None
+            if self.analyst_dicts is None:
+                config_path = analyst_path + "config." + self.config["config_type"]
+
+            try:
+                input_hash = manifest.event_input_hash(event_config, config_path=config_path)
+            except Exception as err:
+                logger.error(f"Controller: Could not hash inputs of %s: %s, %s" % (event, err, type(err)))
+                changed_events.append(event)
+                continue
+
+            if manifest.is_unchanged(previous_manifest, event, input_hash, analyst_path,
+                                     "fit_analyst" in event_config):
+                logger.info(f"Controller: Inputs of %s did not change, reusing previous results." % event)
+                skipped_records[event] = controller_tools.skipped_record(event, analyst_path)
+            else:
+                changed_events.append(event)
+                input_hashes[event] = input_hash
+
+        return changed_events, skipped_records, input_hashes
+
+    def update_manifest(self, records, input_hashes):
+        '''
+        Saves the input hashes of the successfully processed events to the manifest.
+
+        :param records: dict, per-event records of the run
+        :param input_hashes: dict, input hashes of the processed events
+        '''
+
+        manifest_path = self.config.get("manifest_path", self.config["events_path"] + "manifest.json")
+        # shards of one run share the manifest
+        with controller_tools.file_lock(manifest_path + ".lock"):
+            current_manifest = manifest.load_manifest(manifest_path)
+            for event in input_hashes:
+                if records[event]["status"] == "finished":
+                    current_manifest["events"][event] = {"input_hash": input_hashes[event],
+                                                         "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}
+                else:
+                    current_manifest["events"].pop(event, None)
+            manifest.save_manifest(manifest_path, current_manifest)
+
+    def create_command(self, event, config_spill=None):
+        '''
+        Creates the command that launches an Event Analyst for one event in a new interpreter.
+
+        :param event: str, name of the event
+        :param config_spill: str, optional, path to the spilled analyst configuration, required when
+            the analyst dicts are specified, see :func:`transport.spill_analyst_dict`
+
+        :return: list, command to be run by a subprocess
+        '''
+
+        command = [self.config["python_compiler"],
+                   self.config["software_dir"]+"event_analyst.py",
+                   "--event_name", event,
+                   "--analyst_path",  self.config["events_path"]+str(event)+"/",
+                   "--log_level", self.config["log_level"],
+                   ]
+
+        if "log_stream" in self.config:
+            command.append("--stream")
+            command.append(str(self.config["log_stream"]))
+
+        if self.analyst_dicts is not None:
+            logger.debug(f"Controller: Analyst dicts specified, passing them through a spill file.")
+            command.append("--config_spill")
+            command.append(config_spill)
+        else:
+            logger.debug(
+                f"Controller: Analyst dicts not specified, will look for information in their config files."
+            )
+            command.append("--config_path")
+            command.append(self.config["events_path"] + str(event) + "/config." + self.config["config_type"])
+
+        if self.config.get("stage_timeouts", None) is not None:
+            command.append("--stage_timeouts")
+            command.append(json.dumps(self.config["stage_timeouts"]))
+
+        return command
+
+    def create_task(self, event):
+        '''
+        Creates the task description that lets a warm worker build an Event Analyst for one event.
+
+        :param event: str, name of the event
+
+        :return: dict, task handed to :func:`run_in_process_analyst`
+        '''
+
+        task = {"event_name": event,
+                "analyst_path": self.config["events_path"]+str(event)+"/",
+                "log_level": self.config["log_level"],
+                "stream": self.config.get("log_stream", False),
+                }
+
+        if self.analyst_dicts is not None:
+            logger.debug(f"Controller: Analyst dicts specified.")
+            task["config_dict"] = transport.pack_analyst_dict(self.analyst_dicts[event])
+        else:
+            logger.debug(
+                f"Controller: Analyst dicts not specified, will look for information in their config files."
+            )
+            task["config_path"] = self.config["events_path"] + str(event) + "/config." + self.config["config_type"]
+
+        return task
+
+    def split_cores(self):
+        '''
+        Splits the core budget between the number of workers and the BLAS/OpenMP threads of every worker.
+        The number of workers never exceeds `group_processing_limit`.
+
+        :return: dictionary with the core budget, number of workers and threads per worker
+        '''
+
+        core_budget = self.config.get("core_budget", None)
+        if core_budget is None:
+            core_budget = controller_tools.available_cores()
+
+        return controller_tools.split_core_budget(core_budget, self.config["group_processing_limit"],
+                                                  threads_per_worker=self.config.get("threads_per_worker", None))
+
+    def prepare_task(self, event):
+        '''
+        Prepares the task of one event for the worker mode of the controller.
+
+        :param event: str, name of the event
+
+        :return: dict, task handed to :func:`run_in_process_analyst` or :func:`run_parallel_analyst`
+        '''
+
+        if self.config.get("worker_mode", "subprocess") == "in_process":
+            task = self.create_task(event)
+        else:
+            config_spill, spilled_files = None, []
+            if self.analyst_dicts is not None:
+                spill_path = self.config.get("spill_path", self.config["log_location"] + "spill/")
+                config_spill, spilled_files = transport.spill_analyst_dict(event, self.analyst_dicts[event],
+                                                                           spill_path)
+            task = {"event_name": event,
+                    "analyst_path": self.config["events_path"]+str(event)+"/",
+                    "command": self.create_command(event, config_spill=config_spill),
+                    "spilled_files": spilled_files,
+                    }
+        task["event_timeout"] = self.config.get("event_timeout", None)
+        task["stage_timeouts"] = self.config.get("stage_timeouts", None)
+
+        return task
+
+    def prepare_batch_task(self, events):
+        '''
+        Prepares the task of a chunk of events for the `subprocess` worker mode. The in-process tasks of the events
+        are written to a batch file in the spill folder, which `event_analyst.py --batch` runs one after another.
+
+        :param events: list, names of the events
 
-            if "log_stream" in self.config:
-                command.append("--stream")
-                command.append(str(self.config["log_stream"]))
+        :return: dict, task handed to :func:`run_batch_analyst`
+        '''
+
+        spill_path = self.config.get("spill_path", self.config["log_location"] + "spill/")
+        if not os.path.isdir(spill_path):
+            os.makedirs(spill_path)
 
+        tasks, spilled_files = [], []
+        for event in events:
+            task = {"event_name": event,
+                    "analyst_path": self.config["events_path"]+str(event)+"/",
+                    "log_level": self.config["log_level"],
+                    "stream": self.config.get("log_stream", False),
+                    "event_timeout": self.config.get("event_timeout", None),
+                    "stage_timeouts": self.config.get("stage_timeouts", None),
+                    }
             if self.analyst_dicts is not None:
-                logger.debug(f"Controller: Analyst dicts specified.")
-                command.append("--config_dict")
-                command.append(str(self.analyst_dicts[event]))
+                task["config_spill"], files = transport.spill_analyst_dict(event, self.analyst_dicts[event],
+                                                                           spill_path)
+                spilled_files += files
+            else:
+                task["config_path"] = self.config["events_path"] + str(event) + "/config." + \
+                                      self.config["config_type"]
+            tasks.append(task)
+
+        batch_path = os.path.join(spill_path, "batch_%s.json" % events[0])
+        results_path = os.path.join(spill_path, "batch_%s_results.jsonl" % events[0])
+        if os.path.isfile(results_path):
+            os.remove(results_path)
+        with open(batch_path, "w", encoding="utf-8") as file:
+            json.dump({"results_path": results_path, "tasks": tasks}, file, ensure_ascii=False)
+        spilled_files += [batch_path, results_path]
+
+        task = {"events": list(events),
+                "command": [self.config["python_compiler"],
+                            self.config["software_dir"]+"event_analyst.py",
+                            "--batch", batch_path],
+                "results_path": results_path,
+                "spilled_files": spilled_files,
+                "event_timeout": self.config.get("event_timeout", None),
+                }
+
+        return task
+
+    def memory_estimates_path(self):
+        '''
+        :return: str, path to the file with the memory estimates of the events
+        '''
+
+        return self.config.get("memory_estimates_path", self.config["log_location"] + "memory_estimates.json")
+
+    def admit_event(self, event, task_memory, running_memory):
+        '''
+        Checks if an event fits under the `memory_limit`, given the memory in use and the expected peaks of
+        the running tasks. With no limit every event is admitted.
+
+        :param event: str, name of the event
+        :param task_memory: list, expected peak memory in MB of the events already in the task being built
+        :param running_memory: list, expected peak memory in MB of the running tasks
+
+        :return: boolean, True if the event can be started
+        '''
+
+        memory_limit = self.config.get("memory_limit", None)
+        if memory_limit is None:
+            return True
+
+        event_memory = memory.estimate_event_memory(self.memory_estimates, event,
+                                                    self.config.get("default_event_memory", 1024.))
+        if len(running_memory) == 0 and len(task_memory) == 0:
+            # the controller would wait forever for an event larger than the whole ceiling
+            return True
+        # events of one task run one after another, so the task needs the memory of its largest event
+        if event_memory <= max(task_memory, default=0.):
+            return True
+
+        pid = os.getpid()
+        return memory.admits(memory_limit, memory.tree_rss(pid), memory.process_rss(pid),
+                             running_memory, event_memory)
+
+    def open_journal(self, events):
+        '''
+        Opens the run journal. A resumed run continues the journal of the interrupted run,
+        otherwise a new journal is started.
+
+        :param events: list, names of the events of the run
+
+        :return: dictionary with the records of the events completed in the interrupted run, empty if the run
+            is not resumed
+        '''
+
+        self.journal = journal.RunJournal(self.config.get("journal_path",
+                                                          self.config["log_location"] + "run_journal.jsonl"))
+        completed_records = {}
+        if self.config.get("resume", False):
+            completed_records = self.journal.completed_records()
+            logger.info(f"Controller: Resuming the run, %d events were already completed." %
+                        len([event for event in events if event in completed_records]))
+        else:
+            self.journal.start_run(events)
+
+        return completed_records
+
+    def poison_path(self):
+        '''
+        :return: str, path to the poison list
+        '''
+
+        return self.config.get("poison_path", self.config["log_location"] + "poison_list.json")
+
+    def filter_poisoned(self, events):
+        '''
+        Removes from the events the ones that failed in `poison_threshold` consecutive runs, so that a broken
+        event does not take a worker and a retry budget in every run.
+
+        :param events: list, names of the events
+
+        :return: list with events that can be started and dictionary with records of the poisoned events
+        '''
+
+        poison_list = controller_tools.load_poison_list(self.poison_path())
+        threshold = self.config.get("poison_threshold", 3)
+
+        allowed_events, poisoned_records = [], {}
+        for event in events:
+            failures = poison_list.get(event, 0)
+            if failures >= threshold:
+                logger.warning(f"Controller: Event %s failed in %d consecutive runs, not starting it." %
+                               (event, failures))
+                poisoned_records[event] = controller_tools.poisoned_record(event, failures)
             else:
-                logger.debug(
-                    f"Controller: Analyst dicts not specified, will look for information in their config files."
-                )
-                command.append("--config_path")
-                command.append(self.config["events_path"] + str(event) + "/config." + self.config["config_type"])
+                allowed_events.append(event)
 
-            commands.append(command)
+        return allowed_events, poisoned_records
 
-        #Running analysts in batches
-        logger.info(f"Controller: Commands created. Spawning processes.")
-        logger.debug(f"Controller: Max workers set as: %d."%self.config["group_processing_limit"])
+    def pre_clean_light_curves(self, events):
+        '''
+        Cleans the light curves of the events with one batch quality check, so the workers get clean data.
+        The light curves of the analyst dicts, inline or read from `path`, are replaced by the cleaned arrays;
+        the analyst dicts given to the controller are not modified.
+
+        :param events: list, names of the events
+        '''
+
+        if self.analyst_dicts is None:
+            logger.info(f"Controller: Light curves are pre-cleaned only for events given in analyst dicts.")
+            return
+
+        from MFPipeline.analyst.light_curve_analyst import batch_quality_check
+        from MFPipeline.analyst.light_curve_io import load_light_curve
+
+        start_time = time.time()
+        configs, light_curve_sets = {}, []
+        for event in events:
+            config = dict(transport.parse_analyst_dict(self.analyst_dicts[event]))
+            light_curves = []
+            for entry in config.get("light_curves") or []:
+                try:
+                    if "lc" in entry:
+                        light_curve = transport.light_curve_array(entry["lc"])
+                    elif "path" in entry:
+                        light_curve = load_light_curve(entry["path"], log=logger)
+                    else:
+                        light_curve = np.load(entry["npy_path"], mmap_mode="r")
+                except Exception as err:
+                    logger.error(f"Controller: Could not read a light curve of %s, the event is not pre-cleaned: "
+                                 f"%s, %s" % (event, err, type(err)))
+                    break
+                light_curves.append({"lc": light_curve, "survey": entry["survey"], "band": entry["band"]})
+            else:
+                configs[event] = config
+                light_curve_sets.append(light_curves)
 
-        with ProcessPoolExecutor(max_workers=self.config["group_processing_limit"] ) as executor:
+        if len(configs) == 0:
+            return
+        cleaned, rejections = batch_quality_check(light_curve_sets, logger, lc_config=self.config["pre_clean"])
+
+        self.analyst_dicts = dict(self.analyst_dicts)
+        for (event, config), light_curves in zip(configs.items(), cleaned):
+            entries = []
+            for i, entry in enumerate(config["light_curves"]):
+                entry = {key: value for key, value in entry.items() if key not in ["lc", "path", "npy_path"]}
+                entry["lc"] = light_curves.light_curve(i)
+                entries.append(entry)
+            config["light_curves"] = entries
+            self.analyst_dicts[event] = config
+        for check in rejections:
+            logger.info(f"Controller: Pre-cleaning, %d entries rejected by the %s check." % (rejections[check], check))
+        logger.info(f"Controller: Light curves of %d events pre-cleaned in %.2f s." % (len(configs),
+                                                                                     time.time() - start_time))
+
+    def dispatch(self, source, poll_interval=None):
+        '''
+        Runs events through the pool of workers. A new event is taken from the source whenever a worker is free,
+        so that the order of the source is also the order of dispatching.
+
+        With a `memory_limit`, an event is started only when its expected peak memory fits under the ceiling,
+        otherwise it waits until running events finish.
+        Failed and timed out events are run again up to `max_retries` times, after an exponentially growing delay.
+        Only the record of the last attempt is passed to the source and counted in the poison list.
+
+        :param source: object with methods `next_event()` returning the name of the next event (None if there is no
+            event available at the moment), `exhausted()`, `finished(event, record)`, `heartbeat(events)`,
+            called periodically with the names of the running events and of the events waiting for a retry,
+            and `depth()` returning the number of events waiting in the source
+        :param poll_interval: float, optional, how often in seconds the source is polled, `poll_interval` from
+            the configuration if not specified
+
+        :return: dictionary with per-event records
+        '''
+
+        self.core_split = self.split_cores()
+        max_workers = self.core_split["workers"]
+        threads = self.core_split["threads_per_worker"]
+        batch_size = 1
+        if self.config.get("worker_mode", "subprocess") == "in_process":
+            run_analyst, initializer = run_in_process_analyst, warm_up_worker
+        else:
+            batch_size = max(1, self.config.get("batch_size", 1))
+            # the pool workers only wait for the subprocesses, which get the thread limits in their environment
+            run_analyst, initializer = run_parallel_analyst, None
+        if poll_interval is None:
+            poll_interval = self.config.get("poll_interval", 5.)
+        max_retries = self.config.get("max_retries", 0)
+        retry_backoff = self.config.get("retry_backoff", 30.)
+
+        logger.info(f"Controller: Spawning processes.")
+        logger.debug(f"Controller: Max workers set as: %d, with %d BLAS/OpenMP threads each, core budget %d." %
+                     (max_workers, threads, self.core_split["core_budget"]))
+
+        records = {}
+        running = {}
+        attempts = {}
+        # [time when the event can be run again, event name]
+        retries = []
+        # events taken from the source that wait for memory
+        waiting = []
+        self.memory_estimates = {}
+        if self.config.get("memory_limit", None) is not None:
+            self.memory_estimates = memory.load_estimates(self.memory_estimates_path())
+
+        metrics_server = None
+        if self.config.get("metrics_port", None) is not None:
+            metrics_server = metrics.MetricsServer(self.metrics, self.config["metrics_port"])
+            metrics_server.start()
+            logger.info(f"Controller: Serving metrics on port %d." % metrics_server.port)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer,
+                                 initargs=(threads,) if initializer is not None else ()) as executor:
             logger.debug(f"Controller: New process spawned.")
-            executor.map(run_parallel_analyst, commands)
-            # for result in executor.map(run_parallel_analyst, commands):
-            #     print(result)
-            # print(futures.result())
+            while True:
+                while len(running) < max_workers:
+                    events, task_memory = [], []
+                    running_memory = [task["memory"] for task in running.values()]
+                    while len(events) < batch_size:
+                        ready_retries = [retry for retry in retries if retry[0] <= time.time()]
+                        if len(waiting) > 0:
+                            event = waiting.pop(0)
+                        elif len(ready_retries) > 0:
+                            retries.remove(ready_retries[0])
+                            event = ready_retries[0][1]
+                        else:
+                            event = source.next_event()
+                        if event is None:
+                            break
+                        if not self.admit_event(event, task_memory, running_memory):
+                            logger.debug(f"Controller: Not enough memory for %s, waiting." % event)
+                            waiting.insert(0, event)
+                            break
+                        task_memory.append(memory.estimate_event_memory(self.memory_estimates, event,
+                                                                        self.config.get("default_event_memory",
+                                                                                        1024.)))
+                        attempts[event] = attempts.get(event, 0) + 1
+                        events.append(event)
+                    if len(events) == 0:
+                        break
+
+                    if batch_size > 1:
+                        task = self.prepare_batch_task(events)
+                        run_task = run_batch_analyst
+                    else:
+                        task = self.prepare_task(events[0])
+                        task["events"] = events
+                        run_task = run_analyst
+                    task["threads"] = threads
+                    task["memory"] = max(task_memory)
+                    running[executor.submit(run_task, task)] = task
+                    self.metrics.event_started(len(events))
+                    if self.journal is not None:
+                        self.journal.started(events)
+                    if len(waiting) > 0:
+                        break
+
+                self.update_metrics(source, running, retries, waiting)
+                if len(running) == 0:
+                    if len(retries) == 0 and len(waiting) == 0 and source.exhausted():
+                        break
+                    # events may still become available, e.g. retries or leases of dead workers expiring
+                    source.heartbeat([retry[1] for retry in retries])
+                    sleep_time = poll_interval
+                    if len(retries) > 0:
+                        sleep_time = min(poll_interval, max(0., min(retries)[0] - time.time()))
+                    time.sleep(sleep_time)
+                    continue
+
+                done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        results = future.result()
+                        if not isinstance(results, list):
+                            results = [results]
+                    except Exception as err:
+                        logger.error(f"Controller: Worker for %s crashed: %s, %s" % (task["events"], err, type(err)))
+                        results = [controller_tools.failed_record(event, str(err)) for event in task["events"]]
+                    transport.remove_spilled_files(task.get("spilled_files", []))
+
+                    for record in results:
+                        event = record["event_name"]
+                        record["attempts"] = attempts[event]
+                        logger.info(f"Controller: Event %s %s in %s s." % (event, record["status"],
+                                                                          record["wall_time"]))
+
+                        if record["status"] in ["failed", "timeout"] and attempts[event] <= max_retries:
+                            delay = controller_tools.retry_delay(attempts[event], retry_backoff)
+                            logger.info(f"Controller: Retrying event %s in %s s." % (event, delay))
+                            retries.append([time.time() + delay, event])
+                            self.metrics.event_retried()
+                            continue
+
+                        records[event] = record
+                        self.metrics.event_completed(record)
+                        if self.journal is not None:
+                            self.journal.finished(record)
+                        controller_tools.update_poison_list(self.poison_path(), [record])
+                        if self.config.get("memory_limit", None) is not None:
+                            self.memory_estimates = memory.update_estimates(self.memory_estimates_path(),
+                                                                            [record])
+                        source.finished(event, record)
+
+                source.heartbeat([event for task in running.values() for event in task["events"]] +
+                                 [retry[1] for retry in retries] + waiting)
+
+            self.update_metrics(source, running, retries, waiting)
+
+        if metrics_server is not None:
+            metrics_server.stop()
+
+        return records
+
+    def update_metrics(self, source, running, retries, waiting):
+        '''
+        Updates the gauges of the live metrics and writes them to `metrics_path`, if specified.
+
+        :param source: source of events of :func:`dispatch`
+        :param running: dict, running tasks
+        :param retries: list, events waiting for a retry
+        :param waiting: list, events waiting for memory
+        '''
+
+        self.metrics.set_state(source.depth() + len(retries) + len(waiting),
+                               sum([len(task["events"]) for task in running.values()]))
+        if self.config.get("metrics_path", None) is not None:
+            try:
+                self.metrics.write(self.config["metrics_path"])
+            except Exception as err:
+                logger.error(f"Controller: Could not write metrics: %s, %s" % (err, type(err)))
+
+    def enqueue_events(self):
+        '''
+        Puts the events from the event list into the shared work queue at `queue_path`, in the order given by
+        the scheduling. Controllers started with the same `queue_path` will then take them from the queue.
+        With `incremental` processing, unchanged events are not put into the queue.
+
+        :return: list, names of the events that were put into the queue
+        '''
+
+        ordered_events = self.schedule_events()
+        ordered_events, _ = self.filter_poisoned(ordered_events)
+        input_hashes = None
+        if self.config.get("incremental", False):
+            ordered_events, _, input_hashes = self.find_changed_events(ordered_events)
+
+        queue = self.create_queue()
+        queue.put(ordered_events, input_hashes=input_hashes)
+        logger.info(f"Controller: %d events put into the work queue %s." % (len(ordered_events),
+                                                                          self.config["queue_path"]))
+
+        return ordered_events
+
+    def create_queue(self):
+        '''
+        :return: :class:`MFPipeline.controller.work_queue.SpoolQueue` at `queue_path`
+        '''
+
+        return work_queue.SpoolQueue(self.config["queue_path"],
+                                     lease_time=self.config.get("lease_time", 300.),
+                                     max_attempts=self.config.get("max_attempts", 3),
+                                     worker_id=self.config.get("worker_id", None))
+
+    def launch_analysts(self):
+        '''
+        This function starts and parallelizes the :class:`MFPipeline.analyst.event_analyst.EventAnalyst`.
+        In the `subprocess` worker mode every event is analysed by a new interpreter, in the `in_process` mode
+        the workers of the pool are reused and run the analysts directly.
+        With `resume`, the events completed before the controller was interrupted are taken from the run journal.
+        If `queue_path` is specified, the controller works as one shard: it takes events from the shared work queue
+        (filled with :func:`enqueue_events`) until the queue is drained, instead of processing its event list.
+        The per-event records are also saved to the run summary file.
+
+        :return: list of dictionaries with per-event records: event name, status, exit code, wall time,
+            CPU time, peak memory in MB and output paths, in the order of the event list
+            (in the order of processing for a shard)
+        '''
+
+        logger.info(f"Controller: Start processing.")
+        start_time = time.time()
+        logger.debug(f"Controller: Launching analysts in %s mode." % self.config.get("worker_mode", "subprocess"))
+
+        if "queue_path" in self.config:
+            queue = self.create_queue()
+            logger.info(f"Controller: Working as shard %s of the work queue %s." % (queue.worker_id,
+                                                                                  self.config["queue_path"]))
+            source = work_queue.QueueEventSource(queue)
+            records = self.dispatch(source)
+            events = list(records)
+            summary_path = self.config.get("summary_path",
+                                           self.config["log_location"] + "run_summary_%s.json" % queue.worker_id)
+            input_hashes = source.input_hashes
+        else:
+            ordered_events = self.schedule_events()
+            completed_records = self.open_journal(ordered_events)
+            resumed_records = {event: dict(completed_records[event], resumed=True) for event in ordered_events
+                               if event in completed_records}
+            ordered_events = [event for event in ordered_events if event not in resumed_records]
+            ordered_events, poisoned_records = self.filter_poisoned(ordered_events)
+            skipped_records, input_hashes = {}, {}
+            if self.config.get("incremental", False):
+                ordered_events, skipped_records, input_hashes = self.find_changed_events(ordered_events)
+            if "pre_clean" in self.config:
+                self.pre_clean_light_curves(ordered_events)
+
+            records = self.dispatch(EventListSource(ordered_events))
+            records.update(skipped_records)
+            records.update(poisoned_records)
+            records.update(resumed_records)
+            events = self.event_list
+            summary_path = self.config.get("summary_path", self.config["log_location"] + "run_summary.json")
+
+        if self.config.get("incremental", False):
+            self.update_manifest(records, input_hashes)
+
+        records = [records[event] for event in events]
+        summary = controller_tools.summarize_run(records, start_time, self.config,
+                                                 core_split=self.core_split)
+        controller_tools.save_json(summary_path, summary)
+        logger.info(f"Controller: %d events finished, %d skipped, %d timed out, %d poisoned, %d failed. "
+                    f"Summary saved to %s." % (summary["n_finished"], summary["n_skipped"], summary["n_timeout"],
+                                               summary["n_poisoned"], summary["n_failed"], summary_path))
 
         logger.info(f"Controller: Processing finished.")
-        for handler in logger.handlers:
-            logger.info('Processing complete.\n')
+        logger.info('Processing complete.\n')
+        for handler in list(logger.handlers):
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+            logger.removeHandler(handler)
+
+        return records
+
+    def watch(self, duration=None, process_existing=False):
+        '''
+        Runs the controller in the watch mode: the input files of the events (configuration files and light curve
+        files named in `light_curves[*].path`) are polled and an event is refitted as soon as its inputs stop
+        changing for `watch_debounce` seconds. The pool of workers stays up for the whole time, so with
+        the `in_process` worker mode a refit does not pay for starting an interpreter and importing the pipeline.
+        With `incremental` processing, events whose files were touched but whose content did not change are
+        not refitted.
+
+        :param duration: float, optional, how long to watch in seconds, forever if not specified
+        :param process_existing: boolean, optional, should all events be processed once at the start?
+
+        :return: list of dictionaries with per-event records, in the order of processing
+        '''
+
+        logger.info(f"Controller: Start watching %s." % self.config["events_path"])
+        start_time = time.time()
+        input_watcher = watcher.InputWatcher(self.event_list, self.config["events_path"],
+                                             self.config.get("config_type", "yaml"),
+                                             analyst_dicts=self.analyst_dicts,
+                                             debounce=self.config.get("watch_debounce", 2.),
+                                             watch_new_events=self.config.get("watch_new_events", False))
+        input_watcher.snapshot()
+
+        stop_time = start_time + duration if duration is not None else None
+        # new data should be picked up within seconds, not within the default poll interval
+        poll_interval = self.config.get("poll_interval", 1.)
+        source = watcher.WatchEventSource(self, input_watcher, stop_time=stop_time, poll_interval=poll_interval)
+        if process_existing:
+            source.queue(input_watcher.events)
+        self.dispatch(source, poll_interval=poll_interval)
+
+        summary = controller_tools.summarize_run(source.records, start_time, self.config,
+                                                 core_split=self.core_split)
+        summary_path = self.config.get("summary_path", self.config["log_location"] + "run_summary.json")
+        controller_tools.save_json(summary_path, summary)
+        logger.info(f"Controller: Watching finished, %d events processed. Summary saved to %s." %
+                    (len(source.records), summary_path))
+        for handler in list(logger.handlers):
             if isinstance(handler, logging.FileHandler):
                 handler.close()
-            logger.removeFilter(handler)
+            logger.removeHandler(handler)
+
+        return source.records
+
+
+class EventListSource:
+    '''
+    Source of events for :func:`Controller.dispatch` that hands out events from a list.
+
+    :param events: list, names of the events in the order of dispatching
+    '''
+    def __init__(self, events):
+        self.events = list(events)
+
+    def next_event(self):
+        return self.events.pop(0) if len(self.events) > 0 else None
+
+    def exhausted(self):
+        return len(self.events) == 0
+
+    def finished(self, event, record):
+        pass
 
+    def heartbeat(self, events):
+        pass
 
+    def depth(self):
+        return len(self.events)
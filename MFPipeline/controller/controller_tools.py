@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import fcntl
+import resource
+from contextlib import contextmanager
+
+from MFPipeline import timings
+
+
+def output_dir(analyst_path):
+    """
+    This function returns the folder the Event Analyst actually writes to. Analysts swap minuses and spaces in
+    their paths to underscores, see :func:`MFPipeline.analyst.analyst.Analyst.update_names_paths`.
+
+    :param analyst_path: str, analyst path passed to the Event Analyst
+    :return: str, path to the folder with the outputs
+    """
+
+    return analyst_path.replace(" ", "_").replace("-", "_")
+
+def collect_outputs(analyst_path, start_time):
+    """
+    This function lists the files written by an Event Analyst since the start of its run.
+
+    :param analyst_path: str, analyst path passed to the Event Analyst
+    :param start_time: float, time when the analyst was started, in seconds since epoch
+    :return: list of paths to the output files
+    """
+
+    outputs = []
+    path = output_dir(analyst_path)
+    if os.path.isdir(path):
+        for file_name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, file_name)
+            if os.path.isfile(file_path) and os.path.getmtime(file_path) >= start_time:
+                outputs.append(file_path)
+
+    return outputs
+
+def create_record(event_name, analyst_path, exit_code, start_time, wall_time, cpu_time, peak_rss, status=None):
+    """
+    This function creates a record with the results of processing a single event.
+
+    :param event_name: str, name of the event
+    :param analyst_path: str, analyst path passed to the Event Analyst
+    :param exit_code: int, exit code of the analyst, 0 if it finished successfully
+    :param start_time: float, time when the analyst was started, in seconds since epoch
+    :param wall_time: float, wall-clock time of the run in seconds
+    :param cpu_time: float, user and system CPU time of the run in seconds
+    :param peak_rss: float, peak resident memory in MB
+    :param status: str, optional, status of the run, e.g. `timeout`, derived from the exit code if not specified
+    :return: dictionary with the record, including the durations of the analysis stages written by the analyst
+    """
+
+    if status is None:
+        status = "finished" if exit_code == 0 else "failed"
+
+    outputs = collect_outputs(analyst_path, start_time)
+    timings_path = os.path.join(output_dir(analyst_path), "timings.json")
+    record = {"event_name": event_name,
+              "status": status,
+              "exit_code": exit_code,
+              "wall_time": round(wall_time, 3),
+              "cpu_time": round(cpu_time, 3),
+              "peak_rss": round(peak_rss, 1),
+              "outputs": outputs,
+              "timings": timings.load(timings_path) if timings_path in outputs else [],
+              }
+
+    return record
+
+def skipped_record(event_name, analyst_path):
+    """
+    This function creates a record for an event that was not processed again, because its inputs did not change.
+    The outputs of the previous run are reused.
+
+    :param event_name: str, name of the event
+    :param analyst_path: str, analyst path passed to the Event Analyst
+    :return: dictionary with the record
+    """
+
+    record = {"event_name": event_name,
+              "status": "skipped",
+              "exit_code": 0,
+              "wall_time": 0.,
+              "cpu_time": 0.,
+              "peak_rss": 0.,
+              "outputs": collect_outputs(analyst_path, 0.),
+              }
+
+    return record
+
+def failed_record(event_name, error):
+    """
+    This function creates a record for an event whose worker did not return any results.
+
+    :param event_name: str, name of the event
+    :param error: str, description of the problem
+    :return: dictionary with the record
+    """
+
+    record = {"event_name": event_name,
+              "status": "failed",
+              "exit_code": None,
+              "wall_time": None,
+              "cpu_time": None,
+              "peak_rss": None,
+              "outputs": [],
+              "error": error,
+              }
+
+    return record
+
+def poisoned_record(event_name, failures):
+    """
+    This function creates a record for an event that was not started, because it is on the poison list.
+
+    :param event_name: str, name of the event
+    :param failures: int, number of consecutive failed runs of the event
+    :return: dictionary with the record
+    """
+
+    record = {"event_name": event_name,
+              "status": "poisoned",
+              "exit_code": None,
+              "wall_time": 0.,
+              "cpu_time": 0.,
+              "peak_rss": 0.,
+              "outputs": [],
+              "error": "Event failed in %d consecutive runs." % failures,
+              }
+
+    return record
+
+def retry_delay(attempt, retry_backoff):
+    """
+    This function returns how long to wait before running a failed event again. The delay doubles with
+    every attempt, so that a problem shared by many events (e.g. a full disk) is not hammered by retries.
+
+    :param attempt: int, number of the attempt that failed, starting from 1
+    :param retry_backoff: float, delay after the first attempt in seconds
+    :return: float, delay in seconds
+    """
+
+    return retry_backoff * 2 ** (attempt - 1)
+
+def load_poison_list(poison_path):
+    """
+    This function reads the poison list, i.e. the numbers of consecutive failed runs of the events.
+
+    :param poison_path: str, path to the poison list
+    :return: dictionary with the numbers of failures, empty if there is no poison list yet
+    """
+
+    poison_list = {}
+    if os.path.isfile(poison_path):
+        with open(poison_path, "r") as file:
+            poison_list = json.load(file)
+
+    return poison_list
+
+def update_poison_list(poison_path, records):
+    """
+    This function counts the consecutive failures of the events in the poison list. A failed run or a timeout
+    adds one failure, a finished run removes the event from the list. Several controllers may share the list,
+    so it is updated under a lock.
+
+    :param poison_path: str, path to the poison list
+    :param records: list of dictionaries with per-event records
+    :return: dictionary with the updated poison list
+    """
+
+    with file_lock(poison_path + ".lock"):
+        poison_list = load_poison_list(poison_path)
+        for record in records:
+            if record["status"] in ["failed", "timeout"]:
+                poison_list[record["event_name"]] = poison_list.get(record["event_name"], 0) + 1
+            elif record["status"] == "finished":
+                poison_list.pop(record["event_name"], None)
+        save_json(poison_path, poison_list)
+
+    return poison_list
+
+def usage_cpu_time(usage):
+    """
+    :param usage: resource usage structure returned by :func:`resource.getrusage` or :func:`os.wait4`
+    :return: float, user and system CPU time in seconds
+    """
+
+    return usage.ru_utime + usage.ru_stime
+
+def usage_peak_rss(usage):
+    """
+    :param usage: resource usage structure returned by :func:`resource.getrusage` or :func:`os.wait4`
+    :return: float, peak resident memory in MB (Linux reports it in kB)
+    """
+
+    return usage.ru_maxrss / 1024.
+
+def self_usage():
+    """
+    :return: resource usage of the current process
+    """
+
+    return resource.getrusage(resource.RUSAGE_SELF)
+
+# Environment variables read by BLAS and OpenMP runtimes when they start their thread pools.
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                    "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+def available_cores():
+    """
+    :return: int, number of cores this process is allowed to run on
+    """
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+def split_core_budget(core_budget, group_processing_limit, threads_per_worker=None):
+    """
+    This function splits a budget of cores between event-level parallelism (number of workers processing
+    events at the same time) and fit-level parallelism (BLAS/OpenMP threads inside each worker), so that
+    the machine does not run more threads than cores.
+
+    :param core_budget: int, number of cores to use
+    :param group_processing_limit: int, maximum number of events processed at the same time
+    :param threads_per_worker: int, optional, number of threads per worker, the cores left after starting
+        `group_processing_limit` workers are split between them if not specified
+    :return: dictionary with the core budget, number of workers and threads per worker
+    """
+
+    core_budget = max(1, int(core_budget))
+    if threads_per_worker is None:
+        workers = min(group_processing_limit, core_budget)
+        threads_per_worker = max(1, core_budget // workers)
+    else:
+        threads_per_worker = max(1, min(int(threads_per_worker), core_budget))
+        workers = max(1, min(group_processing_limit, core_budget // threads_per_worker))
+
+    split = {"core_budget": core_budget,
+             "workers": workers,
+             "threads_per_worker": threads_per_worker,
+             }
+
+    return split
+
+def thread_environment(threads):
+    """
+    :param threads: int, number of BLAS/OpenMP threads
+    :return: copy of the environment of this process with the thread variables set
+    """
+
+    environment = dict(os.environ)
+    for variable in THREAD_VARIABLES:
+        environment[variable] = str(threads)
+
+    return environment
+
+@contextmanager
+def file_lock(lock_path):
+    """
+    Context manager holding an exclusive lock on a file, used when several controllers or workers update
+    the same file.
+
+    :param lock_path: str, path to the lock file
+    """
+
+    directory = os.path.dirname(lock_path)
+    if len(directory) > 0 and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def save_json(path, data):
+    """
+    This function saves a dictionary to a JSON file, like the run summary or the manifest.
+    The file is written next to the target and swapped, so that a reader never sees a half written file.
+
+    :param path: str, path to the file
+    :param data: dict, data to save
+    """
+
+    directory = os.path.dirname(path)
+    if len(directory) > 0 and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+    os.replace(temporary_path, path)
+
+def summarize_run(records, start_time, config, core_split=None):
+    """
+    This function gathers the per-event records of a run into a summary.
+
+    :param records: list of dictionaries with per-event records
+    :param start_time: float, time when the run was started, in seconds since epoch
+    :param config: dict, configuration of the controller
+    :param core_split: dict, optional, split of the core budget, see :func:`split_core_budget`
+    :return: dictionary with the summary
+    """
+
+    wall_time = time.time() - start_time
+    n_finished = len([record for record in records if record["status"] == "finished"])
+    n_skipped = len([record for record in records if record["status"] == "skipped"])
+    n_timeout = len([record for record in records if record["status"] == "timeout"])
+    n_poisoned = len([record for record in records if record["status"] == "poisoned"])
+
+    summary = {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time)),
+               "wall_time": round(wall_time, 3),
+               "worker_mode": config.get("worker_mode", "subprocess"),
+               "group_processing_limit": config["group_processing_limit"],
+               "core_split": core_split,
+               "n_events": len(records),
+               "n_finished": n_finished,
+               "n_skipped": n_skipped,
+               "n_timeout": n_timeout,
+               "n_poisoned": n_poisoned,
+               "n_failed": len(records) - n_finished - n_skipped - n_timeout - n_poisoned,
+               # where the time of the batch went, summed over the events
+               "stages": timings.aggregate([record.get("timings", []) for record in records]),
+               "events": records,
+               }
+
+    return summary
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+
+from MFPipeline.controller import controller_tools
+
+# Statuses of events that do not have to be processed again when a run is resumed.
+COMPLETED_STATUSES = ["finished", "skipped"]
+
+
+class RunJournal:
+    '''
+    Journal of a controller run, kept as a JSON-lines file with one entry per event start and finish.
+    If the controller is restarted partway through a batch, the journal tells which events were completed
+    and which ones were still running or failed.
+
+    Every entry is written with a single `write` call on a file opened for appending, under an exclusive lock,
+    and flushed to disk, so workers and controllers sharing the journal never interleave or lose entries.
+    A line cut short by a crash is ignored when the journal is read.
+
+    :param journal_path: str, path to the journal file
+    '''
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+
+    def append(self, entries):
+        '''
+        :param entries: list of dictionaries to add to the journal
+        '''
+
+        lines = "".join([json.dumps(entry) + "\n" for entry in entries])
+        with controller_tools.file_lock(self.journal_path + ".lock"):
+            with open(self.journal_path, "a", encoding="utf-8") as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+
+    def start_run(self, events):
+        '''
+        Starts a new journal, the entries of the previous run are moved to a `.prev` file.
+
+        :param events: list, names of the events of the run
+        '''
+
+        with controller_tools.file_lock(self.journal_path + ".lock"):
+            if os.path.isfile(self.journal_path):
+                os.replace(self.journal_path, self.journal_path + ".prev")
+        self.append([{"entry": "run", "time": time.time(), "events": list(events)}])
+
+    def started(self, events):
+        '''
+        :param events: list, names of the events that were sent to a worker
+        '''
+
+        now = time.time()
+        self.append([{"entry": "started", "event_name": event, "time": now} for event in events])
+
+    def finished(self, record):
+        '''
+        :param record: dict, final record of an event
+        '''
+
+        self.append([{"entry": "finished", "event_name": record["event_name"], "time": time.time(),
+                      "record": record}])
+
+    def read(self):
+        '''
+        :return: dictionary with the last entry of every event in the journal
+        '''
+
+        last_entries = {}
+        if not os.path.isfile(self.journal_path):
+            return last_entries
+
+        with open(self.journal_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the controller died while writing this line
+                    continue
+                if "event_name" in entry:
+                    last_entries[entry["event_name"]] = entry
+
+        return last_entries
+
+    def completed_records(self):
+        '''
+        :return: dictionary with the records of the events that were completed, events that were started but
+            did not finish, or that failed, are not included
+        '''
+
+        completed = {}
+        for event, entry in self.read().items():
+            if entry["entry"] == "finished" and entry["record"]["status"] in COMPLETED_STATUSES:
+                completed[event] = entry["record"]
+
+        return completed
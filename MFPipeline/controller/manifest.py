@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import functools
+import numpy as np
+
+import MFPipeline
+from MFPipeline.controller import transport
+from MFPipeline.controller import controller_tools
+
+
+def hash_file(hasher, path, block_size=1 << 20):
+    """
+    This function adds the content of a file to a hash.
+
+    :param hasher: hashlib hash object
+    :param path: str, path to the file
+    :param block_size: int, optional, size of the blocks in which the file is read
+    """
+
+    with open(path, "rb") as file:
+        block = file.read(block_size)
+        while len(block) > 0:
+            hasher.update(block)
+            block = file.read(block_size)
+
+# folders of the package with the code that produces the outputs of an event
+CODE_FOLDERS = ["analyst", "fitting_support"]
+
+@functools.lru_cache(maxsize=None)
+def code_hash():
+    """
+    This function computes a hash of the source files that produce the outputs of an event, so that a change
+    in the code makes events be processed again, even if `__version__` was not bumped.
+    The hash is computed once per process.
+
+    :return: str, hexadecimal SHA-256 digest
+    """
+
+    hasher = hashlib.sha256()
+    package_path = os.path.dirname(os.path.abspath(MFPipeline.__file__))
+    for folder in CODE_FOLDERS:
+        for root, dirs, files in os.walk(os.path.join(package_path, folder)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    path = os.path.join(root, name)
+                    hasher.update(os.path.relpath(path, package_path).encode())
+                    hash_file(hasher, path)
+
+    return hasher.hexdigest()
+
+def event_input_hash(event_config, config_path=None):
+    """
+    This function computes a content hash of all inputs of an event: the pipeline version, the hash of the
+    source code (see :func:`code_hash`), the configuration sections and the light curves, both inline and read from files named in `light_curves[*].path`.
+
+    :param event_config: dict, configuration of the Event Analyst
+    :param config_path: str, optional, path to the configuration file, hashed instead of the parsed configuration
+    :return: str, hexadecimal SHA-256 digest
+    """
+
+    hasher = hashlib.sha256()
+    hasher.update(MFPipeline.__version__.encode())
+    hasher.update(code_hash().encode())
+
+    if config_path is not None:
+        hash_file(hasher, config_path)
+    else:
+        sections = {key: event_config[key] for key in event_config if key != "light_curves"}
+        hasher.update(json.dumps(sections, sort_keys=True, default=str).encode())
+
+    for entry in event_config.get("light_curves", []) or []:
+        hasher.update(("%s_%s" % (entry.get("survey"), entry.get("band"))).encode())
+        if "path" in entry:
+            hash_file(hasher, entry["path"])
+        elif "npy_path" in entry:
+            hash_file(hasher, entry["npy_path"])
+        elif "lc" in entry:
+            hasher.update(np.ascontiguousarray(transport.light_curve_array(entry["lc"])).tobytes())
+
+    return hasher.hexdigest()
+
+def load_manifest(manifest_path):
+    """
+    This function reads the manifest with input hashes of events processed in the previous runs.
+
+    :param manifest_path: str, path to the manifest file
+    :return: dictionary with the manifest, empty if there is no manifest yet
+    """
+
+    manifest = {"events": {}}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+
+    return manifest
+
+def save_manifest(manifest_path, manifest):
+    """
+    This function saves the manifest.
+
+    :param manifest_path: str, path to the manifest file
+    :param manifest: dict, manifest to save
+    """
+
+    manifest["pipeline_version"] = MFPipeline.__version__
+    manifest["code_hash"] = code_hash()
+    controller_tools.save_json(manifest_path, manifest)
+
+def is_unchanged(manifest, event, input_hash, analyst_path, needs_fit_results):
+    """
+    This function checks if an event can be skipped, because its inputs did not change since its last
+    successful run and its outputs are still there.
+
+    :param manifest: dict, manifest of the previous runs
+    :param event: str, name of the event
+    :param input_hash: str, current hash of the inputs of the event
+    :param analyst_path: str, analyst path of the event
+    :param needs_fit_results: boolean, should the fit results of the previous run exist?
+    :return: boolean, True if the event does not need to be processed again
+    """
+
+    entry = manifest["events"].get(event)
+    if entry is None or entry.get("input_hash") != input_hash:
+        return False
+
+    if needs_fit_results and not os.path.isfile(controller_tools.output_dir(analyst_path) + "fit_results.json"):
+        return False
+
+    return True
@@ -0,0 +1,180 @@
+import os
+import json
+import threading
+import statistics
+
+from MFPipeline.controller import controller_tools
+
+
+def process_rss(pid):
+    """
+    This function reads the current resident memory of a process from `/proc`.
+
+    :param pid: int, process id
+    :return: float, resident memory in MB, 0 if it cannot be read (e.g. the process ended or there is no `/proc`)
+    """
+
+    try:
+        with open("/proc/%d/status" % pid, "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return 0.
+
+def child_pids(pid):
+    """
+    :param pid: int, process id
+    :return: list of ids of the direct children of the process, empty if they cannot be read
+    """
+
+    children = []
+    try:
+        for task in os.listdir("/proc/%d/task" % pid):
+            with open("/proc/%d/task/%s/children" % (pid, task), "r") as file:
+                children += [int(child) for child in file.read().split()]
+    except (OSError, ValueError):
+        pass
+
+    return children
+
+def tree_rss(pid):
+    """
+    This function sums the resident memory of a process and all of its descendants, i.e. for the controller
+    its pool workers and the analyst subprocesses started by them.
+
+    :param pid: int, process id of the root of the tree
+    :return: float, resident memory in MB
+    """
+
+    total, pids = 0., [pid]
+    while len(pids) > 0:
+        current = pids.pop()
+        total += process_rss(current)
+        pids += child_pids(current)
+
+    return total
+
+class RssSampler:
+    """
+    Context manager sampling the resident memory of the current process in a background thread, e.g. while
+    a warm worker runs one event. The high-water mark of a warm worker (`ru_maxrss`) includes the imports and all
+    earlier events, so the memory of the event is the sampled peak above the memory at the start.
+
+    :param interval: float, optional, time between the samples in seconds
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.baseline = 0.
+        self.peak = 0.
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        self.peak = max(self.peak, process_rss(os.getpid()))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.baseline = process_rss(os.getpid())
+        self.peak = self.baseline
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    @property
+    def memory(self):
+        """
+        :return: float, peak resident memory above the memory at the start in MB, None if it cannot be read
+        """
+
+        if self.baseline == 0.:
+            return None
+
+        return max(self.peak - self.baseline, 0.)
+
+def load_estimates(estimates_path):
+    """
+    This function reads the peak memory of events measured in the previous runs.
+
+    :param estimates_path: str, path to the file with the estimates
+    :return: dictionary with the peak memory of events in MB, empty if there are no estimates yet
+    """
+
+    estimates = {}
+    if os.path.isfile(estimates_path):
+        with open(estimates_path, "r") as file:
+            estimates = json.load(file)
+
+    return estimates
+
+def update_estimates(estimates_path, records):
+    """
+    This function saves the peak memory of the events that finished. The latest measurement is kept,
+    because light curves of ongoing events only grow. Several controllers may share the file,
+    so it is updated under a lock. Events run in warm workers are measured by the memory they added to
+    the worker (`event_memory`), not by the high-water mark of the worker; events without a measurement
+    are not learned from.
+
+    :param estimates_path: str, path to the file with the estimates
+    :param records: list of dictionaries with per-event records
+    :return: dictionary with the updated estimates
+    """
+
+    with controller_tools.file_lock(estimates_path + ".lock"):
+        estimates = load_estimates(estimates_path)
+        for record in records:
+            if record["status"] != "finished":
+                continue
+            if "event_memory" in record:
+                if record["event_memory"] is not None:
+                    estimates[record["event_name"]] = record["event_memory"]
+            elif record.get("peak_rss"):
+                estimates[record["event_name"]] = record["peak_rss"]
+        controller_tools.save_json(estimates_path, estimates)
+
+    return estimates
+
+def estimate_event_memory(estimates, event, default_memory):
+    """
+    :param estimates: dict, peak memory of events in MB measured in the previous runs
+    :param event: str, name of the event
+    :param default_memory: float, estimate in MB used when there are no measurements at all
+    :return: float, expected peak memory of the event in MB; events that were not run yet get the median
+        of the known events
+    """
+
+    if event in estimates:
+        return estimates[event]
+    if len(estimates) > 0:
+        return statistics.median(estimates.values())
+
+    return default_memory
+
+def admits(memory_limit, used_memory, base_memory, running_estimates, event_estimate):
+    """
+    This function checks if a new event can be started without exceeding the memory limit. The projection
+    takes the larger of the memory used now and the memory the running events are expected to reach,
+    since a running event may not have hit its peak yet.
+
+    :param memory_limit: float, memory ceiling in MB
+    :param used_memory: float, memory used now by the controller and its workers in MB
+    :param base_memory: float, memory used by the controller itself in MB
+    :param running_estimates: list, expected peak memory of the running events in MB
+    :param event_estimate: float, expected peak memory of the new event in MB
+    :return: boolean, True if the new event fits under the ceiling
+    """
+
+    projected = max(used_memory, base_memory + sum(running_estimates)) + event_estimate
+
+    return projected <= memory_limit
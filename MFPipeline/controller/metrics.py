@@ -0,0 +1,218 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the histogram buckets in seconds, from a quick light curve check to a long grid of fits.
+LATENCY_BUCKETS = [0.1, 0.5, 1., 2.5, 5., 10., 30., 60., 120., 300., 600., 1800., 3600.]
+
+
+class Histogram:
+    '''
+    Cumulative histogram in the Prometheus sense: every bucket counts the observations smaller or equal
+    to its upper bound.
+
+    :param buckets: list, optional, upper bounds of the buckets
+    '''
+    def __init__(self, buckets=None):
+        self.buckets = list(buckets) if buckets is not None else list(LATENCY_BUCKETS)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class ControllerMetrics:
+    '''
+    Live counters, gauges and histograms of a controller run, rendered in the Prometheus text format.
+    The controller updates them from its dispatch loop; they can be written to a file picked up by the
+    node exporter textfile collector, or served over HTTP by :class:`MetricsServer`.
+
+    :param rate_window: float, optional, window in seconds over which the event rate is computed
+    '''
+    def __init__(self, rate_window=60.):
+        self.rate_window = rate_window
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.events_started = 0
+        self.events_retried = 0
+        # status: number of events
+        self.events_completed = {}
+        self.queue_depth = 0
+        self.running = 0
+        self.completion_times = []
+        self.event_latency = Histogram()
+        # stage: histogram
+        self.stage_latency = {}
+
+    def set_state(self, queue_depth, running):
+        '''
+        :param queue_depth: int, number of events waiting to be started
+        :param running: int, number of events being processed
+        '''
+
+        with self.lock:
+            self.queue_depth = queue_depth
+            self.running = running
+
+    def event_started(self, n_events=1):
+        with self.lock:
+            self.events_started += n_events
+
+    def event_retried(self):
+        with self.lock:
+            self.events_retried += 1
+
+    def event_completed(self, record):
+        '''
+        Counts the final record of an event and adds its wall time and the durations of its stages
+        to the histograms.
+
+        :param record: dict, per-event record, see :func:`MFPipeline.controller.controller_tools.create_record`
+        '''
+
+        with self.lock:
+            self.events_completed[record["status"]] = self.events_completed.get(record["status"], 0) + 1
+            self.completion_times.append(time.time())
+            if record.get("wall_time") is not None:
+                self.event_latency.observe(record["wall_time"])
+            for timing in record.get("timings", []):
+                if timing["stage"] not in self.stage_latency:
+                    self.stage_latency[timing["stage"]] = Histogram()
+                self.stage_latency[timing["stage"]].observe(timing["seconds"])
+
+    def events_per_minute(self):
+        '''
+        :return: float, number of events completed per minute over the last `rate_window` seconds
+        '''
+
+        now = time.time()
+        self.completion_times = [completed for completed in self.completion_times
+                                 if completed >= now - self.rate_window]
+        window = min(self.rate_window, max(now - self.started, 1.))
+
+        return len(self.completion_times) * 60. / window
+
+    def render(self):
+        '''
+        :return: str, metrics in the Prometheus text exposition format
+        '''
+
+        with self.lock:
+            lines = []
+            lines += ["# HELP mfpipeline_queue_depth Events waiting to be started.",
+                      "# TYPE mfpipeline_queue_depth gauge",
+                      "mfpipeline_queue_depth %d" % self.queue_depth,
+                      "# HELP mfpipeline_events_running Events being processed.",
+                      "# TYPE mfpipeline_events_running gauge",
+                      "mfpipeline_events_running %d" % self.running,
+                      "# HELP mfpipeline_events_per_minute Events completed per minute.",
+                      "# TYPE mfpipeline_events_per_minute gauge",
+                      "mfpipeline_events_per_minute %.3f" % self.events_per_minute(),
+                      "# HELP mfpipeline_events_started_total Events sent to the workers, retries included.",
+                      "# TYPE mfpipeline_events_started_total counter",
+                      "mfpipeline_events_started_total %d" % self.events_started,
+                      "# HELP mfpipeline_events_retried_total Failed attempts that were retried.",
+                      "# TYPE mfpipeline_events_retried_total counter",
+                      "mfpipeline_events_retried_total %d" % self.events_retried,
+                      "# HELP mfpipeline_events_completed_total Events completed, by final status.",
+                      "# TYPE mfpipeline_events_completed_total counter",
+                      ]
+            for status in sorted(self.events_completed):
+                lines.append('mfpipeline_events_completed_total{status="%s"} %d' %
+                             (status, self.events_completed[status]))
+
+            lines += ["# HELP mfpipeline_event_seconds Wall time of events.",
+                      "# TYPE mfpipeline_event_seconds histogram",
+                      ]
+            lines += render_histogram("mfpipeline_event_seconds", self.event_latency, "")
+
+            lines += ["# HELP mfpipeline_stage_seconds Wall time of the analysis stages.",
+                      "# TYPE mfpipeline_stage_seconds histogram",
+                      ]
+            for stage in sorted(self.stage_latency):
+                lines += render_histogram("mfpipeline_stage_seconds", self.stage_latency[stage],
+                                          'stage="%s"' % stage)
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, metrics_path):
+        '''
+        Writes the metrics to a file. The file is swapped in one step, so a scraper never reads half of it.
+
+        :param metrics_path: str, path to the file, e.g. `controller.prom` in the textfile collector folder
+        '''
+
+        directory = os.path.dirname(metrics_path)
+        if len(directory) > 0 and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        temporary_path = metrics_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(self.render())
+        os.replace(temporary_path, metrics_path)
+
+
+def render_histogram(name, histogram, labels):
+    '''
+    :param name: str, name of the metric
+    :param histogram: :class:`Histogram` to render
+    :param labels: str, labels of the series, e.g. `stage="fit_analyst"`, empty for none
+    :return: list of lines in the Prometheus text format
+    '''
+
+    separator = "," if len(labels) > 0 else ""
+    lines = []
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append('%s_bucket{%s%sle="%g"} %d' % (name, labels, separator, bound, count))
+    lines.append('%s_bucket{%s%sle="+Inf"} %d' % (name, labels, separator, histogram.count))
+    suffix = "{%s}" % labels if len(labels) > 0 else ""
+    lines.append("%s_sum%s %.6f" % (name, suffix, histogram.sum))
+    lines.append("%s_count%s %d" % (name, suffix, histogram.count))
+
+    return lines
+
+
+class MetricsServer:
+    '''
+    Small HTTP endpoint serving the metrics of a controller at `/metrics`, for Prometheus to scrape.
+    The server runs in a daemon thread next to the dispatch loop.
+
+    :param metrics: :class:`ControllerMetrics` to serve
+    :param port: int, port to listen on
+    :param host: str, optional, address to listen on, all interfaces by default, so the pod can be scraped
+    '''
+    def __init__(self, metrics, port, host=""):
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes would flood the controller output
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,163 @@
+import os
+import json
+import yaml
+import numpy as np
+
+from MFPipeline.controller import controller_tools
+from MFPipeline.controller import transport
+
+# Number of fits performed by the Fit Analyst for each path, see
+# :func:`MFPipeline.analyst.fit_analyst.FitAnalyst.perform_fit`:
+# ongoing check + PSPL blend + PSPL blend piE (+ PSPL no blend piE),
+# ongoing check + PSPL blend + grid of 8 PSPL blend piE fits with different signs.
+FITS_PER_PATH = {"ongoing": 4,
+                 "finished": 10,
+                 }
+
+# Cost of setting up one telescope in one fit, in units of data points.
+# Space based telescopes need their ephemerides to be downloaded for every fit.
+TELESCOPE_COST = 100
+SPACE_TELESCOPE_COST = 2000
+
+
+def count_points(path):
+    """
+    This function counts data points in a light curve file without parsing it.
+
+    :param path: str, path to the light curve file
+    :return: int, number of non-empty lines that are not comments
+    """
+
+    n_points = 0
+    try:
+        with open(path, "rb") as file:
+            for line in file:
+                stripped = line.strip()
+                if len(stripped) > 0 and not stripped.startswith(b"#"):
+                    n_points += 1
+    except OSError:
+        n_points = 0
+
+    return n_points
+
+def read_event_config(event, events_path, config_type, analyst_dicts=None):
+    """
+    This function reads the configuration of an Event Analyst the same way the analyst will receive it.
+
+    :param event: str, name of the event
+    :param events_path: str, path to the folder with event folders
+    :param config_type: str, format of the analyst config files, `yaml` or `json`
+    :param analyst_dicts: dict, optional, dictionary with analyst configurations passed to the controller
+    :return: dictionary with the configuration, empty if it could not be read
+    """
+
+    config = {}
+    try:
+        if analyst_dicts is not None:
+            config = transport.parse_analyst_dict(analyst_dicts[event])
+        else:
+            config_path = events_path + str(event) + "/config." + config_type
+            with open(config_path, "r") as file:
+                if config_type == "json":
+                    config = json.load(file)
+                else:
+                    config = yaml.safe_load(file)
+    except Exception:
+        config = {}
+
+    if not isinstance(config, dict):
+        config = {}
+
+    return config
+
+def previous_fit_path(analyst_path):
+    """
+    This function checks which fitting path was taken for an event during the previous run.
+
+    :param analyst_path: str, analyst path of the event
+    :return: str, `ongoing` or `finished`, None if there are no previous results
+    """
+
+    fit_path = None
+    results_path = controller_tools.output_dir(analyst_path) + "fit_results.json"
+    if os.path.isfile(results_path):
+        try:
+            with open(results_path, "r") as file:
+                results = json.load(file)
+            fit_path = "ongoing"
+            for model in results:
+                if model.startswith("PSPL_blend_piE_"):
+                    fit_path = "finished"
+        except Exception:
+            fit_path = None
+
+    return fit_path
+
+def estimate_event_cost(event_config, analyst_path):
+    """
+    This function estimates the cost of processing an event, based on the number of data points,
+    number of telescopes and the expected fitting path.
+
+    :param event_config: dict, configuration of the Event Analyst
+    :param analyst_path: str, analyst path of the event
+    :return: estimated cost in arbitrary units and the expected fitting path
+    """
+
+    n_points, telescope_cost = 0, 0
+    for entry in event_config.get("light_curves", []) or []:
+        if "path" in entry:
+            n_points += count_points(entry["path"])
+        elif "lc" in entry:
+            light_curve = entry["lc"]
+            if isinstance(light_curve, str):
+                light_curve = json.loads(light_curve)
+            n_points += len(light_curve)
+
+        if "Gaia" in entry.get("survey", ""):
+            telescope_cost += SPACE_TELESCOPE_COST
+        else:
+            telescope_cost += TELESCOPE_COST
+
+    # Unknown events are assumed to take the longer, finished event path.
+    fit_path = previous_fit_path(analyst_path)
+    if fit_path is None:
+        fit_path = "finished"
+
+    n_fits = FITS_PER_PATH[fit_path] if "fit_analyst" in event_config else 1
+    cost = n_fits * (n_points + telescope_cost)
+
+    return cost, fit_path
+
+def fill_unknown_costs(event_costs, unknown_events):
+    """
+    This function gives events whose configuration could not be read the median cost of the other events,
+    so they are neither dispatched first nor left for the end of the batch.
+
+    :param event_costs: dict, for each event name a list with estimated cost and expected fitting path
+    :param unknown_events: list, names of the events whose configuration could not be read
+    :return: dictionary with the updated costs
+    """
+
+    known_costs = [event_costs[event][0] for event in event_costs if event not in unknown_events]
+    median_cost = float(np.median(known_costs)) if len(known_costs) > 0 else 0.
+    for event in unknown_events:
+        event_costs[event] = [median_cost, "finished"]
+
+    return event_costs
+
+def order_events(event_costs, ongoing_first=False):
+    """
+    This function orders events so that the most expensive ones are dispatched first.
+
+    :param event_costs: dict, for each event name a list with estimated cost and expected fitting path
+    :param ongoing_first: boolean, optional, should ongoing events be dispatched before finished ones?
+    :return: list with ordered event names
+    """
+
+    def sort_key(event):
+        cost, fit_path = event_costs[event]
+        priority = 0 if (ongoing_first and fit_path == "ongoing") else 1
+        return priority, -cost
+
+    # sorted is stable, so events with equal cost keep their order from the event list
+    return sorted(event_costs, key=sort_key)
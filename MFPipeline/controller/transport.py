@@ -0,0 +1,102 @@
+import os
+import json
+import numpy as np
+
+from MFPipeline.analyst.analyst_tools import parse_config_string
+
+
+def light_curve_array(light_curve):
+    """
+    This function turns a light curve passed in an analyst dictionary into a numpy array.
+
+    :param light_curve: list, numpy array or a JSON string with the light curve
+    :return: numpy array of floats with the light curve
+    """
+
+    if isinstance(light_curve, str):
+        light_curve = json.loads(light_curve)
+
+    return np.asarray(light_curve, dtype=float)
+
+def parse_analyst_dict(analyst_dict):
+    """
+    This function returns the analyst configuration as a dictionary. The analyst dictionaries passed to
+    the controller can be either dictionaries or strings, see
+    :func:`MFPipeline.analyst.analyst_tools.parse_config_string`.
+
+    :param analyst_dict: dict or str, configuration of the Event Analyst
+    :return: dictionary with the configuration
+    """
+
+    if isinstance(analyst_dict, str):
+        analyst_dict = parse_config_string(analyst_dict)
+
+    return analyst_dict
+
+def pack_analyst_dict(analyst_dict):
+    """
+    This function prepares an analyst configuration to be sent to a worker process. Inline light curves are
+    turned into numpy arrays, which are pickled as raw buffers instead of lists of Python floats.
+
+    :param analyst_dict: dict or str, configuration of the Event Analyst
+    :return: dictionary with the configuration
+    """
+
+    config = dict(parse_analyst_dict(analyst_dict))
+    if config.get("light_curves") is not None:
+        light_curves = []
+        for entry in config["light_curves"]:
+            entry = dict(entry)
+            if "lc" in entry:
+                entry["lc"] = light_curve_array(entry["lc"])
+            light_curves.append(entry)
+        config["light_curves"] = light_curves
+
+    return config
+
+def spill_analyst_dict(event, analyst_dict, spill_path):
+    """
+    This function writes an analyst configuration to a spill folder, so that it does not have to be passed through
+    the command line. The configuration is saved as a JSON file and every inline light curve as a binary `.npy` file,
+    which the Event Analyst maps into memory without parsing or copying it.
+
+    :param event: str, name of the event
+    :param analyst_dict: dict or str, configuration of the Event Analyst
+    :param spill_path: str, path to the spill folder
+    :return: path to the JSON configuration file and a list of all written files
+    """
+
+    if not os.path.isdir(spill_path):
+        os.makedirs(spill_path)
+
+    config = dict(parse_analyst_dict(analyst_dict))
+    spilled_files = []
+    if config.get("light_curves") is not None:
+        light_curves = []
+        for i, entry in enumerate(config["light_curves"]):
+            entry = dict(entry)
+            if "lc" in entry:
+                npy_path = os.path.join(spill_path, "%s_lc_%d.npy" % (event, i))
+                np.save(npy_path, light_curve_array(entry.pop("lc")))
+                entry["npy_path"] = npy_path
+                spilled_files.append(npy_path)
+            light_curves.append(entry)
+        config["light_curves"] = light_curves
+
+    config_path = os.path.join(spill_path, "%s.json" % event)
+    with open(config_path, "w", encoding="utf-8") as file:
+        json.dump(config, file, ensure_ascii=False)
+    spilled_files.append(config_path)
+
+    return config_path, spilled_files
+
+def remove_spilled_files(spilled_files):
+    """
+    This function removes the spill files of an event after its analyst finished.
+
+    :param spilled_files: list of paths to the spill files
+    """
+
+    for path in spilled_files:
+        if os.path.isfile(path):
+            os.remove(path)
@@ -0,0 +1,202 @@
+import os
+import time
+
+from MFPipeline.controller import scheduler
+
+
+def file_signature(path):
+    """
+    This function returns a cheap signature of a file, which changes when points are appended to a light curve
+    or the file is rewritten.
+
+    :param path: str, path to the file
+    :return: list with the modification time in nanoseconds and the size of the file, None if it does not exist
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return [stat.st_mtime_ns, stat.st_size]
+
+def event_input_paths(event, events_path, config_type, analyst_dicts=None):
+    """
+    This function lists the files an Event Analyst reads: its configuration file and the light curve files
+    named in `light_curves[*].path`.
+
+    :param event: str, name of the event
+    :param events_path: str, path to the folder with event folders
+    :param config_type: str, format of the analyst config files, `yaml` or `json`
+    :param analyst_dicts: dict, optional, dictionary with analyst configurations passed to the controller
+    :return: list of paths to the input files
+    """
+
+    paths = []
+    if analyst_dicts is None:
+        paths.append(events_path + str(event) + "/config." + config_type)
+
+    event_config = scheduler.read_event_config(event, events_path, config_type, analyst_dicts=analyst_dicts)
+    for entry in event_config.get("light_curves", []) or []:
+        if "path" in entry:
+            paths.append(entry["path"])
+
+    return paths
+
+
+class InputWatcher:
+    '''
+    Watches the input files of events by polling their modification times and sizes.
+    Survey feeds write light curves in bursts, so an event is reported only after its inputs stopped
+    changing for `debounce` seconds, and is then fitted once for the whole burst.
+
+    :param events: list, names of the events to watch
+    :param events_path: str, path to the folder with event folders
+    :param config_type: str, format of the analyst config files, `yaml` or `json`
+    :param analyst_dicts: dict, optional, dictionary with analyst configurations passed to the controller
+    :param debounce: float, optional, time in seconds without changes after which a changed event is reported
+    :param watch_new_events: boolean, optional, should event folders that appear in `events_path` be watched?
+    '''
+    def __init__(self,
+                 events,
+                 events_path,
+                 config_type,
+                 analyst_dicts=None,
+                 debounce=2.,
+                 watch_new_events=False):
+
+        self.events = list(events)
+        self.events_path = events_path
+        self.config_type = config_type
+        self.analyst_dicts = analyst_dicts
+        self.debounce = debounce
+        self.watch_new_events = watch_new_events
+
+        # event name: {path: signature}
+        self.signatures = {}
+        # event name: time of the last seen change
+        self.changed = {}
+
+    def read_signatures(self, event):
+        '''
+        :param event: str, name of the event
+        :return: dictionary with signatures of the input files of the event
+        '''
+
+        paths = event_input_paths(event, self.events_path, self.config_type, analyst_dicts=self.analyst_dicts)
+        return {path: file_signature(path) for path in paths}
+
+    def find_new_events(self):
+        '''
+        :return: list, names of the event folders with a configuration file that are not watched yet
+        '''
+
+        new_events = []
+        if self.watch_new_events and os.path.isdir(self.events_path):
+            for event in sorted(os.listdir(self.events_path)):
+                if event not in self.events and \
+                        os.path.isfile(self.events_path + event + "/config." + self.config_type):
+                    new_events.append(event)
+
+        return new_events
+
+    def snapshot(self):
+        '''
+        Remembers the current state of the inputs, so that only later changes are reported.
+        '''
+
+        self.events += self.find_new_events()
+        for event in self.events:
+            self.signatures[event] = self.read_signatures(event)
+        self.changed = {}
+
+    def poll(self):
+        '''
+        Checks the inputs of all watched events.
+
+        :return: list, names of the events whose inputs changed and did not change for `debounce` seconds
+        '''
+
+        now = time.time()
+        for event in self.find_new_events():
+            self.events.append(event)
+            self.signatures[event] = {}
+
+        for event in self.events:
+            signatures = self.read_signatures(event)
+            if signatures != self.signatures.get(event):
+                self.signatures[event] = signatures
+                self.changed[event] = now
+
+        ready_events = [event for event in self.events
+                        if event in self.changed and now - self.changed[event] >= self.debounce]
+        for event in ready_events:
+            self.changed.pop(event)
+
+        return ready_events
+
+
+class WatchEventSource:
+    '''
+    Source of events for :func:`MFPipeline.controller.controller.Controller.dispatch` fed by an
+    :class:`InputWatcher`. An event that changes while it is being fitted is queued again and started after
+    its current run finishes. The inputs are polled at most once per `poll_interval`, in between queued events
+    are returned.
+
+    :param controller: :class:`MFPipeline.controller.controller.Controller` running the events
+    :param watcher: :class:`InputWatcher` watching the inputs of the events
+    :param stop_time: float, optional, time in seconds since epoch when watching stops, watch forever if None
+    :param poll_interval: float, optional, minimal time in seconds between two polls of the inputs
+    '''
+    def __init__(self, controller, watcher, stop_time=None, poll_interval=1.):
+        self.controller = controller
+        self.watcher = watcher
+        self.stop_time = stop_time
+        self.poll_interval = poll_interval
+        self.last_poll = None
+        self.pending = []
+        self.running = []
+        self.input_hashes = {}
+        self.records = []
+
+    def queue(self, events):
+        for event in events:
+            if event not in self.pending:
+                self.pending.append(event)
+
+    def next_event(self):
+        now = time.time()
+        if (self.stop_time is None or now < self.stop_time) and \
+                (self.last_poll is None or now - self.last_poll >= self.poll_interval):
+            self.last_poll = now
+            self.queue(self.watcher.poll())
+
+        for event in list(self.pending):
+            if event not in self.running:
+                self.pending.remove(event)
+                if self.controller.config.get("incremental", False):
+                    # the file was touched, but its content may be the same
+                    changed_events, _, input_hashes = self.controller.find_changed_events([event])
+                    if len(changed_events) == 0:
+                        continue
+                    self.input_hashes.update(input_hashes)
+                self.running.append(event)
+                return event
+
+        return None
+
+    def exhausted(self):
+        return self.stop_time is not None and time.time() >= self.stop_time and \
+            len([event for event in self.pending if event not in self.running]) == 0
+
+    def finished(self, event, record):
+        self.running.remove(event)
+        self.records.append(record)
+        if event in self.input_hashes:
+            self.controller.update_manifest({event: record}, {event: self.input_hashes.pop(event)})
+
+    def heartbeat(self, events):
+        pass
+
+    def depth(self):
+        return len(self.pending)
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import socket
+
+
+class SpoolQueue:
+    '''
+    Work queue of event jobs kept in a spool folder. Several controllers, on one host or on many hosts sharing
+    the folder (e.g. a volume mounted in all pods), take jobs from the same queue.
+
+    Every job is a small JSON file that moves between the `pending`, `leased`, `done` and `failed` folders.
+    Moves are done with :func:`os.rename`, which is atomic, so only one controller can claim a job.
+    A claimed job is leased: its controller has to renew the lease before it expires, otherwise the job is
+    considered abandoned by a dead worker and is put back to `pending` by any controller.
+
+    :param queue_path: str, path to the spool folder
+    :param lease_time: float, optional, time in seconds after which a job that was not renewed is retried
+    :param max_attempts: int, optional, how many times a job with an expired lease is started before it fails
+    :param worker_id: str, optional, name of this controller, host name and process id if not specified
+    '''
+    def __init__(self,
+                 queue_path,
+                 lease_time=300.,
+                 max_attempts=3,
+                 worker_id=None):
+
+        self.queue_path = queue_path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        if worker_id is None:
+            worker_id = "%s_%d" % (socket.gethostname(), os.getpid())
+        self.worker_id = worker_id
+        # time in nanoseconds used in the name of the last added job
+        self.last_enqueued = 0
+
+        for state in ["pending", "leased", "done", "failed"]:
+            os.makedirs(os.path.join(self.queue_path, state), exist_ok=True)
+
+    def job_path(self, state, job_name):
+        '''
+        :param state: str, `pending`, `leased`, `done` or `failed`
+        :param job_name: str, name of the job file
+        :return: path to the job file in the given state
+        '''
+
+        return os.path.join(self.queue_path, state, job_name)
+
+    def read_job(self, path):
+        '''
+        :param path: str, path to the job file
+        :return: dictionary with the job, None if the job was moved by another controller in the meantime
+        '''
+
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def write_job(self, path, job):
+        '''
+        Writes a job file next to its target and renames it, so that other controllers never see a partial job.
+
+        :param path: str, path to the job file
+        :param job: dict, job to save
+        '''
+
+        temporary_path = os.path.join(self.queue_path, ".%s.%s.tmp" % (os.path.basename(path), self.worker_id))
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(job, file)
+        os.rename(temporary_path, path)
+
+    def put(self, events, input_hashes=None):
+        '''
+        Adds events to the queue. Jobs are claimed in the order in which they were added.
+
+        :param events: list, names of the events
+        :param input_hashes: dict, optional, input hashes of the events, passed to the shards for the manifest
+        '''
+
+        for event in events:
+            # the time in nanoseconds keeps the order of jobs, the worker id makes the name unique between
+            # controllers adding jobs at the same time, so a pending job is never overwritten
+            self.last_enqueued = max(time.time_ns(), self.last_enqueued + 1)
+            job_name = "%020d_%s_%s.json" % (self.last_enqueued, self.worker_id, event)
+            job = {"event_name": event,
+                   "attempts": 0,
+                   "enqueued": time.time(),
+                   }
+            if input_hashes is not None and event in input_hashes:
+                job["input_hash"] = input_hashes[event]
+            self.write_job(self.job_path("pending", job_name), job)
+
+    def claim(self):
+        '''
+        Claims the oldest pending job.
+
+        :return: name of the job file and dictionary with the job, or None, None if there are no pending jobs
+        '''
+
+        for job_name in sorted(os.listdir(os.path.join(self.queue_path, "pending"))):
+            try:
+                os.rename(self.job_path("pending", job_name), self.job_path("leased", job_name))
+            except FileNotFoundError:
+                # another controller was faster
+                continue
+            # rename keeps the old modification time, which would make the new lease look expired
+            self.renew(job_name)
+
+            job = self.read_job(self.job_path("leased", job_name))
+            if job is None:
+                continue
+            job["attempts"] += 1
+            job["worker_id"] = self.worker_id
+            job["leased"] = time.time()
+            self.write_job(self.job_path("leased", job_name), job)
+
+            return job_name, job
+
+        return None, None
+
+    def renew(self, job_name):
+        '''
+        Renews the lease of a job. The lease is kept in the modification time of the job file.
+
+        :param job_name: str, name of the job file
+        '''
+
+        try:
+            os.utime(self.job_path("leased", job_name))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, job_name, job, record):
+        '''
+        Moves a job that was processed to `done` or `failed`, depending on the status of its record.
+
+        :param job_name: str, name of the job file
+        :param job: dict, job
+        :param record: dict, per-event record of the run
+        '''
+
+        state = "done" if record["status"] in ["finished", "skipped"] else "failed"
+        try:
+            os.rename(self.job_path("leased", job_name), self.job_path(state, job_name))
+        except FileNotFoundError:
+            # the lease expired and the job was already taken back by another controller
+            return
+
+        job["record"] = record
+        self.write_job(self.job_path(state, job_name), job)
+
+    def requeue_expired(self):
+        '''
+        Puts back to `pending` the leased jobs whose lease expired, which means their controller died.
+        Jobs that were already started `max_attempts` times are moved to `failed`.
+
+        :return: list, names of the events that were put back to the queue
+        '''
+
+        requeued = []
+        now = time.time()
+        for job_name in os.listdir(os.path.join(self.queue_path, "leased")):
+            path = self.job_path("leased", job_name)
+            try:
+                expired = os.path.getmtime(path) + self.lease_time < now
+            except FileNotFoundError:
+                continue
+
+            if expired:
+                job = self.read_job(path)
+                if job is None:
+                    continue
+                state = "pending" if job["attempts"] < self.max_attempts else "failed"
+                try:
+                    os.rename(path, self.job_path(state, job_name))
+                except FileNotFoundError:
+                    continue
+                if state == "pending":
+                    requeued.append(job["event_name"])
+
+        return requeued
+
+    def count(self, state):
+        '''
+        :param state: str, `pending`, `leased`, `done` or `failed`
+        :return: int, number of jobs in the given state
+        '''
+
+        return len([name for name in os.listdir(os.path.join(self.queue_path, state)) if name.endswith(".json")])
+
+    def is_drained(self):
+        '''
+        :return: boolean, True if there are no pending and no leased jobs left
+        '''
+
+        return self.count("pending") == 0 and self.count("leased") == 0
+
+
+class QueueEventSource:
+    '''
+    Source of events for :func:`MFPipeline.controller.controller.Controller.dispatch` that claims events from
+    a shared :class:`SpoolQueue` and keeps their leases alive while they are processed.
+    Jobs are kept by their job names, the same event can be queued more than once.
+
+    :param queue: :class:`SpoolQueue`, shared work queue
+    '''
+    def __init__(self, queue):
+        self.queue = queue
+        # job name: job
+        self.jobs = {}
+        # event name: names of its claimed jobs, oldest first
+        self.event_jobs = {}
+        self.input_hashes = {}
+
+    def next_event(self):
+        job_name, job = self.queue.claim()
+        if job_name is None:
+            return None
+
+        self.jobs[job_name] = job
+        self.event_jobs.setdefault(job["event_name"], []).append(job_name)
+        if "input_hash" in job:
+            self.input_hashes[job["event_name"]] = job["input_hash"]
+
+        return job["event_name"]
+
+    def exhausted(self):
+        self.queue.requeue_expired()
+        return self.queue.is_drained()
+
+    def finished(self, event, record):
+        job_name = self.event_jobs[event].pop(0)
+        if len(self.event_jobs[event]) == 0:
+            del self.event_jobs[event]
+        self.queue.finish(job_name, self.jobs.pop(job_name), record)
+
+    def heartbeat(self, events):
+        for event in events:
+            for job_name in self.event_jobs.get(event, []):
+                self.queue.renew(job_name)
+        self.queue.requeue_expired()
+
+    def depth(self):
+        return self.queue.count("pending")
@@ -1,3 +1,4 @@
+import os
 import logging
 
 import numpy as np
@@ -20,6 +21,7 @@ from pyLIMA.models import PSPL_model
 
 from MFPipeline.fitting_support.fitter import Fitter
 from MFPipeline.fitting_support.pyLIMA import plots_pyLIMA
+from MFPipeline import timings
 
 
 
@@ -51,7 +53,8 @@ class fitPyLIMA(Fitter):
         survey_to_align = ""
         max_n_points = 0
         for entry in light_curves:
-            lc = np.array(entry["lc"])
+            # one contiguous copy, handed over to pyLIMA
+            lc = np.ascontiguousarray(entry["lc"], dtype=float)
             survey = entry["survey"]
             band = entry["band"]
             if ((t_min > np.min(lc[:,0])) and
@@ -71,7 +74,7 @@ class fitPyLIMA(Fitter):
                 telescope = telescopes.Telescope(
                     name=survey+"_"+band,
                     camera_filter=band,
-                    lightcurve=lc.astype(float),
+                    lightcurve=lc,
                     lightcurve_names=["time", "mag", "err_mag"],
                     lightcurve_units=["JD", "mag", "mag"],
                     location = "Space",
@@ -82,7 +85,7 @@ class fitPyLIMA(Fitter):
                 telescope = telescopes.Telescope(
                     name=survey+"_"+band,
                     camera_filter=band,
-                    lightcurve=lc.astype(float),
+                    lightcurve=lc,
                     lightcurve_names=['time','mag','err_mag'],
                     lightcurve_units=['JD','mag','mag'],
                     location="Earth",
@@ -120,7 +123,8 @@ class fitPyLIMA(Fitter):
         # Setup event
         event_name = fit_name
         ra, dec = float(starting_params["ra"]), float(starting_params["dec"])
-        event = self.setup_event(event_name, ra, dec, light_curves)
+        with timings.stage_timer("setup_event"):
+            event = self.setup_event(event_name, ra, dec, light_curves)
 
         blend_param = ""
         if blend:
@@ -166,19 +170,23 @@ class fitPyLIMA(Fitter):
                 fit_event.fit_parameters["piEE"][1] = [use_boundaries["piEE_lower"], use_boundaries["piEE_upper"]]
 
         self.log.info("Staring fit.")
-        fit_event.fit()
+        with timings.stage_timer("fit"):
+            fit_event.fit()
         self.log.info("Fitting finished")
 
         # This will have to be modified to be compatible with MOP
         self.log.debug("Convert model parameters to dictionary.")
-        model_parameters = self.gather_parameters(event, fit_event)
+        with timings.stage_timer("gather_parameters"):
+            model_parameters = self.gather_parameters(event, fit_event)
 
         # Produce fit outputs here
-        plots_pyLIMA.plot_pyLIMA(event, fit_event, self.log)
+        with timings.stage_timer("plot_pyLIMA"):
+            plots_pyLIMA.plot_pyLIMA(event, fit_event, self.log)
         # fit_event.fit_outputs(bokeh_plot=True)
 
         if return_norm_lc:
-            norm_lc, residuals = self.get_aligned_data(pspl, fit_event.fit_results['best_model'])
+            with timings.stage_timer("aligned_data"):
+                norm_lc, residuals = self.get_aligned_data(pspl, fit_event.fit_results['best_model'])
             return model_parameters, norm_lc, residuals
 
         return model_parameters
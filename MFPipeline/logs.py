@@ -60,8 +60,10 @@ def close_log(log):
     :param log: logger instance to close
     '''
 
-    for handler in log.handlers:
-        log.info('Processing complete.\n')
+    log.info('Processing complete.\n')
+    # Loggers are shared by name, handlers have to be removed so that the next event in the same process
+    # does not write to this log.
+    for handler in list(log.handlers):
         if isinstance(handler, logging.FileHandler):
             handler.close()
-        log.removeFilter(handler)
+        log.removeHandler(handler)
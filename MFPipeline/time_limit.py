@@ -0,0 +1,64 @@
+import time
+import signal
+import threading
+from contextlib import contextmanager
+
+# Deadlines of the active time limits, [deadline, label], the innermost is the last one.
+_deadlines = []
+
+
+class TimeLimitExceeded(BaseException):
+    '''
+    Exception raised when the code running inside :func:`time_limit` exceeds its wall-clock limit.
+    Like :class:`KeyboardInterrupt`, it is not an :class:`Exception`, so it is not swallowed by the
+    `except Exception` blocks of the analysts.
+
+    :param label: str, label of the time limit that was exceeded
+    '''
+    def __init__(self, label):
+        super().__init__("Time limit exceeded: %s" % label)
+        self.label = label
+
+
+def _raise_time_limit(signum, frame):
+    if len(_deadlines) > 0:
+        raise TimeLimitExceeded(min(_deadlines)[1])
+
+def _arm_timer():
+    if len(_deadlines) > 0:
+        remaining = min(_deadlines)[0] - time.monotonic()
+        signal.setitimer(signal.ITIMER_REAL, max(remaining, 1e-3))
+    else:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+@contextmanager
+def time_limit(seconds, label):
+    '''
+    Context manager that interrupts the code running inside it with :class:`TimeLimitExceeded` after
+    the given wall-clock time. Limits can be nested, e.g. a limit for a stage inside a limit for the whole event;
+    the exception carries the label of the limit that expired.
+
+    The limit uses SIGALRM, so it only works in the main thread, and it fires when the interpreter gets control
+    back, not in the middle of a call to compiled code. Elsewhere, and when `seconds` is None, it does nothing.
+
+    :param seconds: float, time limit in seconds, None for no limit
+    :param label: str, label of the limit, e.g. name of the event or stage
+    '''
+
+    if seconds is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    entry = [time.monotonic() + float(seconds), label]
+    if len(_deadlines) == 0:
+        signal.signal(signal.SIGALRM, _raise_time_limit)
+    _deadlines.append(entry)
+    _arm_timer()
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        _deadlines.remove(entry)
+        _arm_timer()
+        if len(_deadlines) == 0:
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Spans of the event analysed by this process, in the order they finished.
+_timings = []
+# Spans open in the current thread, the last one is the parent of a new span.
+_open_spans = threading.local()
+
+
+def _span_stack():
+    if not hasattr(_open_spans, "stack"):
+        _open_spans.stack = []
+
+    return _open_spans.stack
+
+@contextmanager
+def stage_timer(stage):
+    '''
+    Context manager recording a span for one stage of the analysis, e.g. the light curve quality check, one fit
+    or a catalogue query. A span measures the wall-clock time, the CPU time of the process and, when tracemalloc
+    is tracing (see :func:`reset`), the peak memory allocated on top of what was allocated when the span started.
+    Spans can be nested, every span keeps the name of the span it was opened in. The span is recorded also
+    when the stage fails.
+
+    The CPU time and allocations are those of the whole process, so they include stages running at the same
+    time in other threads.
+
+    :param stage: str, name of the stage
+    '''
+
+    stack = _span_stack()
+    span = {"stage": stage,
+            "parent": stack[-1]["stage"] if len(stack) > 0 else None,
+            "start": time.perf_counter(),
+            "cpu": time.process_time(),
+            "memory": None,
+            "peak": None,
+            }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        for parent in stack:
+            parent["peak"] = max(parent["peak"] or 0, peak)
+        tracemalloc.reset_peak()
+        span["memory"], span["peak"] = current, current
+
+    stack.append(span)
+    try:
+        yield
+    finally:
+        stack.pop()
+        entry = {"stage": stage,
+                 "parent": span["parent"],
+                 "seconds": time.perf_counter() - span["start"],
+                 "cpu_seconds": time.process_time() - span["cpu"],
+                 }
+        if span["memory"] is not None and tracemalloc.is_tracing():
+            peak = max(span["peak"], tracemalloc.get_traced_memory()[1])
+            for parent in stack:
+                parent["peak"] = max(parent["peak"] or 0, peak)
+            entry["allocated_mb"] = (peak - span["memory"]) / 2. ** 20
+        _timings.append(entry)
+
+def reset(trace_allocations=False):
+    '''
+    Forgets the recorded spans, called when a new event is started in the same process.
+
+    :param trace_allocations: boolean, optional, should the spans record memory allocations? Starts tracemalloc,
+        which slows Python code down noticeably; :func:`save` stops it. Tracing left over from an event that
+        crashed is stopped.
+    '''
+
+    del _timings[:]
+    if trace_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not trace_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def collect():
+    '''
+    :return: list with the recorded spans, dictionaries with the stage name, the name of the parent span,
+        wall-clock and CPU time in seconds and, if traced, the allocated memory in MB
+    '''
+
+    spans = []
+    for entry in _timings:
+        span = {"stage": entry["stage"],
+                "seconds": round(entry["seconds"], 6),
+                "cpu_seconds": round(entry["cpu_seconds"], 6),
+                "parent": entry["parent"],
+                }
+        if "allocated_mb" in entry:
+            span["allocated_mb"] = round(entry["allocated_mb"], 3)
+        spans.append(span)
+
+    return spans
+
+def save(path):
+    '''
+    Saves the recorded spans to a JSON file and stops tracing allocations.
+
+    :param path: str, path to the file
+    '''
+
+    directory = os.path.dirname(path)
+    if len(directory) > 0 and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(collect(), file, ensure_ascii=False, indent=4)
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def load(path):
+    '''
+    :param path: str, path to the file saved by :func:`save`
+    :return: list with the recorded stages, empty if the file cannot be read
+    '''
+
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
+
+def aggregate(event_timings):
+    '''
+    Adds up the spans of many events, to show where the time of a batch goes.
+
+    :param event_timings: list, spans of every event, as returned by :func:`collect`
+    :return: dictionary with, for every stage, the number of spans, the total, mean and maximum wall-clock time,
+        the total CPU time and, if traced, the largest allocation in MB
+    '''
+
+    stages = {}
+    for spans in event_timings:
+        for span in spans:
+            stage = stages.setdefault(span["stage"], {"count": 0, "seconds": 0., "cpu_seconds": 0.,
+                                                      "max_seconds": 0.})
+            stage["count"] += 1
+            stage["seconds"] += span["seconds"]
+            stage["cpu_seconds"] += span.get("cpu_seconds", 0.)
+            stage["max_seconds"] = max(stage["max_seconds"], span["seconds"])
+            if "allocated_mb" in span:
+                stage["max_allocated_mb"] = max(stage.get("max_allocated_mb", 0.), span["allocated_mb"])
+
+    for stage in stages.values():
+        stage["mean_seconds"] = stage["seconds"] / stage["count"]
+        for key in stage:
+            if isinstance(stage[key], float):
+                stage[key] = round(stage[key], 6)
+
+    return stages
@@ -190,12 +190,101 @@ class testCmdAnalyst():
         assert type(source_data) ==  pd.DataFrame
         assert type(source_labels) ==  list
 
-def test_run():
+    def test_catalogue_cache(self, monkeypatch):
+        from MFPipeline.analyst import cmd_analyst
+        from MFPipeline.analyst.cmd_analyst import CmdAnalyst
+
+        config = {}
+        config["event_name"] = self.scenario.get("event_name")
+        config["ra"], config["dec"] = self.scenario.get("ra"), self.scenario.get("dec")
+        catalogue = self.scenario.get("catalogue_name")
+        path_outputs = self.scenario.get("path_outputs")
+        config["cmd_analyst"] = {"catalogues": [{"name": catalogue,
+                                                 "band": self.scenario.get("catalogue_bands"),
+                                                 "cmd_path": self.scenario.get("path_input"),
+                                                 }]}
+        log = logs.start_log(path_outputs, 'debug', event_name=config["event_name"])
+
+        cmd_analyst.clear_catalogue_cache()
+        calls = []
+        original = CmdAnalyst.query_catalogue_data
+
+        def counting_query(analyst):
+            calls.append(analyst.event_name)
+            return original(analyst)
+
+        monkeypatch.setattr(CmdAnalyst, "query_catalogue_data", counting_query)
+        loaded = []
+        # one CMD Analyst per solution, as in the Event Analyst
+        for solution in ["PSPL", "PSPL_blend", "PSPL_parallax"]:
+            analyst = CmdAnalyst(config["event_name"] + "_" + solution, path_outputs, catalogue,
+                                 self.scenario.get("light_curve_data"), log, config_dict=config)
+            loaded.append(analyst.load_catalogue_data())
+        cmd_analyst.clear_catalogue_cache()
+
+        logs.close_log(log)
+
+        assert len(calls) == 1
+        assert loaded[1][0] is loaded[0][0]
+        assert loaded[2][1] == loaded[0][1]
+
+    def test_concurrent_catalogue_cache(self, monkeypatch):
+        import time
+        import threading
+        from MFPipeline.analyst import cmd_analyst
+        from MFPipeline.analyst.cmd_analyst import CmdAnalyst
+
+        config = {}
+        config["event_name"] = self.scenario.get("event_name")
+        config["ra"], config["dec"] = self.scenario.get("ra"), self.scenario.get("dec")
+        catalogue = self.scenario.get("catalogue_name")
+        path_outputs = self.scenario.get("path_outputs")
+        config["cmd_analyst"] = {"catalogues": [{"name": catalogue,
+                                                 "band": self.scenario.get("catalogue_bands"),
+                                                 "cmd_path": self.scenario.get("path_input"),
+                                                 }]}
+        log = logs.start_log(path_outputs, 'debug', event_name=config["event_name"])
+
+        cmd_analyst.clear_catalogue_cache()
+        calls = []
+        original = CmdAnalyst.query_catalogue_data
+
+        def slow_query(analyst):
+            calls.append(analyst.event_name)
+            # a slow remote service, the other threads miss the cache in the meantime
+            time.sleep(0.2)
+            return original(analyst)
+
+        monkeypatch.setattr(CmdAnalyst, "query_catalogue_data", slow_query)
+        analysts = [CmdAnalyst(config["event_name"] + "_" + solution, path_outputs, catalogue,
+                               self.scenario.get("light_curve_data"), log, config_dict=config)
+                    for solution in ["PSPL", "PSPL_blend", "PSPL_parallax", "PSPL_blend_parallax"]]
+        loaded = [None] * len(analysts)
+
+        def load(i):
+            loaded[i] = analysts[i].load_catalogue_data()
+
+        threads = [threading.Thread(target=load, args=(i,)) for i in range(len(analysts))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cmd_analyst.clear_catalogue_cache()
+
+        logs.close_log(log)
+
+        assert len(calls) == 1
+        assert all(data is loaded[0][0] for data, _ in loaded)
+        assert cmd_analyst._catalogue_loading == {}
+
+def test_run(monkeypatch):
     case = scenario_file
     test = testCmdAnalyst(case)
     test.test_load_source_gaia()
     test.test_load_gaia()
     test.test_plot_gaia()
+    test.test_catalogue_cache(monkeypatch)
+    test.test_concurrent_catalogue_cache(monkeypatch)
 
     # for case in [scenario_file, scenario_gaia]:
     #     test = testCmdAnalyst(case)
@@ -6,6 +6,51 @@ import json
 import pytest
 
 
+def make_light_curve(n_points=20):
+    '''
+    :param n_points: int, optional, number of data points
+    :return: list with a slowly rising OGLE light curve
+    '''
+
+    return [[2457000. + i, 17. + 0.01 * i, 0.01] for i in range(n_points)]
+
+def make_analyst_dicts(events, light_curve=None):
+    '''
+    :param events: list, names of the events
+    :param light_curve: list, optional, light curve shared by all events, see :func:`make_light_curve`
+    :return: dictionary with a minimal analyst configuration of every event, running only the lc_analyst
+    '''
+
+    if light_curve is None:
+        light_curve = make_light_curve()
+
+    return {event: {"event_name": event, "ra": 1., "dec": 1., "lc_analyst": {},
+                    "light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve}]}
+            for event in events}
+
+def controller_config(path, **overrides):
+    '''
+    :param path: str, folder of the test, used for the events and the logs
+    :param overrides: keys of the controller configuration that differ from the defaults of the tests
+    :return: dictionary with the controller configuration running one event at a time in the main process
+    '''
+
+    config = {
+        "python_compiler": "python",
+        "group_processing_limit": 1,
+        "worker_mode": "in_process",
+        "events_path": path,
+        "software_dir": "MFPipeline/analyst/",
+        "log_stream": True,
+        "log_location": path,
+        "log_level": "debug",
+        "poll_interval": 0.1,
+        }
+    config.update(overrides)
+
+    return config
+
+
 class TestControllerPaths:
     '''
     Tests to check if controller works fine.
@@ -32,7 +77,686 @@ class TestControllerPaths:
             }
 
         controller = Controller(event_list, config_dict=config)
-        controller.launch_analysts()
+        records = controller.launch_analysts()
+
+        assert [record["event_name"] for record in records] == event_list
+        for record in records:
+            assert record["exit_code"] is not None
+            assert record["wall_time"] >= 0.
+            assert record["peak_rss"] > 0.
+
+        with open("tests/test_controller/run_summary.json") as file:
+            summary = json.load(file)
+        assert summary["n_events"] == len(event_list)
+        assert summary["n_finished"] + summary["n_failed"] == len(event_list)
+        assert summary["core_split"]["workers"] == 1
+
+class TestControllerInProcess:
+    '''
+    Tests to check if controller works fine with warm workers.
+    '''
+
+    def test_launch_analysts(self):
+        from MFPipeline.controller.controller import Controller
+
+        event_list = ["GaiaDR3-ULENS-025"]
+        config = {
+            "python_compiler": "python",
+            "group_processing_limit": 1,
+            "worker_mode": "in_process",
+            "events_path":
+                "tests/test_controller/",
+            "software_dir":
+                "MFPipeline/analyst/",
+            "config_type": "yaml",
+            "log_stream": False,
+            "log_location":
+                "tests/test_controller/",
+            "log_level": "debug"
+            }
+
+        controller = Controller(event_list, config_dict=config)
+        records = controller.launch_analysts()
+
+        assert records[0]["status"] == "finished"
+        assert "tests/test_controller/GaiaDR3_ULENS_025/GaiaDR3_ULENS_025_analyst.log" in records[0]["outputs"]
+
+        with open("tests/test_controller/GaiaDR3_ULENS_025/GaiaDR3_ULENS_025_analyst.log") as file:
+            log = file.read()
+        assert "Event Analyst: Processing finished." in log
+
+class TestControllerScheduling:
+    '''
+    Tests to check if controller dispatches expensive events first.
+    '''
+
+    def test_schedule_events(self):
+        from MFPipeline.controller.controller import Controller
+
+        event_list = ["small_event", "big_event", "space_event"]
+        light_curve = [[2457000. + i, 17., 0.01] for i in range(50)]
+        analyst_dicts = {
+            "small_event": {"light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve[:10]}],
+                            "fit_analyst": {"fitting_package": "pyLIMA"}},
+            "big_event": json.dumps({"light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve},
+                                                      {"survey": "KMTNet_A", "band": "I", "lc": light_curve}],
+                                     "fit_analyst": {"fitting_package": "pyLIMA"}}),
+            "space_event": {"light_curves": [{"survey": "Gaia", "band": "G", "lc": light_curve[:10]}],
+                            "fit_analyst": {"fitting_package": "pyLIMA"}},
+        }
+        config = controller_config("tests/test_controller/", scheduling="longest_first")
+
+        controller = Controller(event_list, config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.schedule_events() == ["space_event", "big_event", "small_event"]
+
+        controller.config["scheduling"] = "fifo"
+        assert controller.schedule_events() == event_list
+
+    def test_unknown_costs(self, tmp_path):
+        from MFPipeline.controller import scheduler
+
+        light_curve = [[2457000. + i, 17., 0.01] for i in range(50)]
+        config_path = str(tmp_path / "config.yaml")
+        with open(config_path, "w") as file:
+            file.write("light_curves:\n    - survey: OGLE\n      band: I\n      lc: %s\n" % light_curve)
+        repr_config = {"light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve}],
+                       "lc_analyst": {"incremental": True, "n_max": None}}
+        analyst_dicts = {
+            "small_event": {"light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve[:10]}]},
+            "big_event": {"light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve * 4}]},
+            "repr_event": str(repr_config),
+            "json_event": json.dumps(repr_config),
+            # a path is not a configuration the workers accept
+            "unknown_event": config_path,
+        }
+
+        event_costs, unknown_events = {}, []
+        for event in analyst_dicts:
+            event_config = scheduler.read_event_config(event, "", "yaml", analyst_dicts=analyst_dicts)
+            if len(event_config) == 0:
+                unknown_events.append(event)
+            event_costs[event] = scheduler.estimate_event_cost(event_config, str(tmp_path) + "/")
+        scheduler.fill_unknown_costs(event_costs, unknown_events)
+
+        assert unknown_events == ["unknown_event"]
+        assert event_costs["repr_event"][0] == event_costs["json_event"][0] > event_costs["small_event"][0]
+        # the event that could not be read is not treated as the cheapest one
+        assert event_costs["unknown_event"][0] == event_costs["repr_event"][0]
+        assert scheduler.order_events(event_costs)[-1] == "small_event"
+
+    def test_ongoing_first(self):
+        from MFPipeline.controller import scheduler
+
+        event_costs = {"a": [10, "finished"], "b": [5, "ongoing"], "c": [20, "finished"], "d": [7, "ongoing"]}
+        assert scheduler.order_events(event_costs) == ["c", "a", "d", "b"]
+        assert scheduler.order_events(event_costs, ongoing_first=True) == ["d", "b", "c", "a"]
+
+class TestControllerTransport:
+    '''
+    Tests to check if analyst dicts are passed to workers without the command line.
+    '''
+
+    def test_spill_analyst_dict(self):
+        from MFPipeline.controller import transport
+
+        light_curve = make_light_curve()
+        analyst_dict = json.dumps({"event_name": "spill_event",
+                                   "ra": 1., "dec": 1.,
+                                   "light_curves": [{"survey": "OGLE", "band": "I", "lc": json.dumps(light_curve)},
+                                                    {"survey": "ZTF", "band": "r", "path": "some_file.dat"}],
+                                   })
+
+        config_path, spilled_files = transport.spill_analyst_dict("spill_event", analyst_dict,
+                                                                  "tests/test_controller/spill/")
+        with open(config_path) as file:
+            config = json.load(file)
+
+        assert "lc" not in config["light_curves"][0]
+        assert config["light_curves"][1]["path"] == "some_file.dat"
+        spilled = np.load(config["light_curves"][0]["npy_path"], mmap_mode="r")
+        assert np.array_equal(spilled, np.array(light_curve))
+
+        transport.remove_spilled_files(spilled_files)
+        for path in spilled_files:
+            assert not os.path.isfile(path)
+
+    def test_pack_analyst_dict(self):
+        from MFPipeline.controller import transport
+
+        analyst_dict = {"light_curves": [{"survey": "OGLE", "band": "I", "lc": [[2457000., 17., 0.01]]}]}
+        config = transport.pack_analyst_dict(analyst_dict)
+
+        assert isinstance(config["light_curves"][0]["lc"], np.ndarray)
+        assert isinstance(analyst_dict["light_curves"][0]["lc"], list)
+
+    def test_repr_analyst_dict(self):
+        from MFPipeline.controller import transport
+        from MFPipeline.analyst.analyst_tools import parse_config_string
+
+        light_curve = make_light_curve()
+        analyst_dict = {"event_name": "repr_event", "ra": 1., "dec": 1.,
+                        "lc_analyst": {"incremental": True, "n_max": None},
+                        "light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve}]}
+        # str() of a python dictionary is not a valid JSON
+        analyst_string = str(analyst_dict)
+
+        assert parse_config_string(analyst_string) == analyst_dict
+        assert transport.parse_analyst_dict(analyst_string) == analyst_dict
+        config = transport.pack_analyst_dict(analyst_string)
+        assert config["lc_analyst"] == {"incremental": True, "n_max": None}
+
+        config_path, spilled_files = transport.spill_analyst_dict("repr_event", analyst_string,
+                                                                  "tests/test_controller/spill/")
+        with open(config_path) as file:
+            config = json.load(file)
+        assert config["lc_analyst"] == {"incremental": True, "n_max": None}
+        assert np.array_equal(np.load(config["light_curves"][0]["npy_path"]), np.array(light_curve))
+        transport.remove_spilled_files(spilled_files)
+
+class TestControllerIncremental:
+    '''
+    Tests to check if controller skips events with unchanged inputs.
+    '''
+
+    def test_skip_unchanged_events(self, monkeypatch):
+        from MFPipeline.controller.controller import Controller
+        from MFPipeline.controller import manifest
+
+        analyst_dicts = make_analyst_dicts(["incremental_event"])
+        config = controller_config("tests/test_controller/incremental/",
+                                   incremental=True,
+                                   manifest_path="tests/test_controller/incremental/manifest.json")
+
+        if os.path.isfile(config["manifest_path"]):
+            os.remove(config["manifest_path"])
+
+        controller = Controller(["incremental_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.launch_analysts()[0]["status"] == "finished"
+
+        controller = Controller(["incremental_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.launch_analysts()[0]["status"] == "skipped"
+
+        analyst_dicts["incremental_event"]["light_curves"][0]["lc"].append([2457020., 17.2, 0.01])
+        controller = Controller(["incremental_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.launch_analysts()[0]["status"] == "finished"
+
+        # a change in the code of the analysts makes the event be processed again
+        monkeypatch.setattr(manifest, "code_hash", lambda: "changed code")
+        controller = Controller(["incremental_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.launch_analysts()[0]["status"] == "finished"
+        controller = Controller(["incremental_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.launch_analysts()[0]["status"] == "skipped"
+
+class TestControllerSharded:
+    '''
+    Tests to check if controllers share events through a work queue.
+    '''
+
+    def test_spool_queue(self):
+        import shutil
+        from MFPipeline.controller.work_queue import SpoolQueue
+
+        queue_path = "tests/test_controller/queue/"
+        shutil.rmtree(queue_path, ignore_errors=True)
+        queue_a = SpoolQueue(queue_path, lease_time=60., worker_id="a")
+        queue_b = SpoolQueue(queue_path, lease_time=60., worker_id="b")
+
+        queue_a.put(["event_1", "event_2", "event_3"])
+        job_name_1, job_1 = queue_a.claim()
+        job_name_2, job_2 = queue_b.claim()
+        assert job_1["event_name"] == "event_1"
+        assert job_2["event_name"] == "event_2"
+        assert queue_a.count("pending") == 1
+
+        queue_a.finish(job_name_1, job_1, {"status": "finished"})
+        assert queue_a.count("done") == 1
+
+        # shard b dies, its lease expires and the event goes back to the queue
+        queue_a.lease_time = 0.
+        os.utime(queue_a.job_path("leased", job_name_2), (0., 0.))
+        assert queue_a.requeue_expired() == ["event_2"]
+        assert queue_a.count("pending") == 2
+        _, job = queue_a.claim()
+        assert job["event_name"] == "event_2"
+        assert job["attempts"] == 2
+        assert not queue_a.is_drained()
+
+    def test_queued_twice(self):
+        import shutil
+        from MFPipeline.controller.work_queue import SpoolQueue, QueueEventSource
+
+        queue_path = "tests/test_controller/queue/"
+        shutil.rmtree(queue_path, ignore_errors=True)
+        queue_a = SpoolQueue(queue_path, lease_time=60., worker_id="a")
+        queue_b = SpoolQueue(queue_path, lease_time=60., worker_id="b")
+
+        # jobs added by two controllers at the same time do not overwrite each other
+        queue_a.put(["event_1", "event_1"])
+        queue_b.put(["event_1"])
+        assert queue_a.count("pending") == 3
+
+        source = QueueEventSource(queue_a)
+        assert source.next_event() == "event_1"
+        assert source.next_event() == "event_1"
+        assert len(source.jobs) == 2
+        source.heartbeat(["event_1"])
+        source.finished("event_1", {"status": "finished"})
+        source.finished("event_1", {"status": "failed"})
+        assert queue_a.count("done") == 1
+        assert queue_a.count("failed") == 1
+        assert queue_a.count("leased") == 0
+        assert source.jobs == {}
+
+    def test_launch_shards(self):
+        import shutil
+        from MFPipeline.controller.controller import Controller
+
+        event_list = ["shard_event_1", "shard_event_2", "shard_event_3"]
+        analyst_dicts = make_analyst_dicts(event_list)
+        config = controller_config("tests/test_controller/shards/", queue_path="tests/test_controller/shards/queue/")
+        shutil.rmtree(config["events_path"], ignore_errors=True)
+
+        producer = Controller(event_list, config_dict=config, analyst_dicts=analyst_dicts)
+        assert producer.enqueue_events() == event_list
+
+        shard = Controller([], config_dict=dict(config, worker_id="shard_1"), analyst_dicts=analyst_dicts)
+        records = shard.launch_analysts()
+
+        assert [record["event_name"] for record in records] == event_list
+        assert os.path.isfile("tests/test_controller/shards/run_summary_shard_1.json")
+        assert len(os.listdir("tests/test_controller/shards/queue/done")) == 3
+
+class TestControllerCoreBudget:
+    '''
+    Tests to check if controller splits the cores between workers and BLAS threads.
+    '''
+
+    def test_split_core_budget(self):
+        from MFPipeline.controller import controller_tools
+
+        assert controller_tools.split_core_budget(16, 4) == {"core_budget": 16, "workers": 4,
+                                                             "threads_per_worker": 4}
+        assert controller_tools.split_core_budget(8, 16) == {"core_budget": 8, "workers": 8,
+                                                             "threads_per_worker": 1}
+        assert controller_tools.split_core_budget(8, 8, threads_per_worker=2) == {"core_budget": 8, "workers": 4,
+                                                                                  "threads_per_worker": 2}
+
+    def test_thread_environment(self):
+        from MFPipeline.controller import controller_tools
+
+        environment = controller_tools.thread_environment(3)
+        assert environment["OMP_NUM_THREADS"] == "3"
+        assert environment["OPENBLAS_NUM_THREADS"] == "3"
+
+class TestControllerRetries:
+    '''
+    Tests to check if controller limits the time of events, retries them and stops starting broken ones.
+    '''
+
+    def test_time_limit(self):
+        import time
+        from MFPipeline.time_limit import time_limit, TimeLimitExceeded
+
+        with pytest.raises(TimeLimitExceeded) as err:
+            with time_limit(10., "event"):
+                with time_limit(0.05, "fit_analyst"):
+                    time.sleep(1.)
+        assert err.value.label == "fit_analyst"
+
+        with time_limit(None, "event"):
+            time.sleep(0.01)
+
+    def test_retry_delay(self):
+        from MFPipeline.controller import controller_tools
+
+        assert [controller_tools.retry_delay(attempt, 30.) for attempt in [1, 2, 3]] == [30., 60., 120.]
+
+    def test_poison_list(self):
+        import shutil
+        from MFPipeline.controller.controller import Controller
+
+        analyst_dicts = make_analyst_dicts(["poison_event"])
+        config = controller_config("tests/test_controller/retries/",
+                                   event_timeout=1e-3,
+                                   max_retries=1,
+                                   retry_backoff=0.01,
+                                   poison_threshold=2)
+        shutil.rmtree(config["events_path"], ignore_errors=True)
+
+        for run in range(2):
+            controller = Controller(["poison_event"], config_dict=config, analyst_dicts=analyst_dicts)
+            record = controller.launch_analysts()[0]
+            assert record["status"] == "timeout"
+            assert record["attempts"] == 2
+
+        with open("tests/test_controller/retries/poison_list.json", "r") as file:
+            assert json.load(file) == {"poison_event": 2}
+
+        controller = Controller(["poison_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        assert controller.launch_analysts()[0]["status"] == "poisoned"
+        with open("tests/test_controller/retries/run_summary.json", "r") as file:
+            assert json.load(file)["n_poisoned"] == 1
+
+class TestControllerWatch:
+    '''
+    Tests to check if controller refits events when their light curves change.
+    '''
+
+    def test_input_watcher(self):
+        import time
+        import shutil
+        from MFPipeline.controller.watcher import InputWatcher
+
+        events_path = "tests/test_controller/watch/"
+        shutil.rmtree(events_path, ignore_errors=True)
+        os.makedirs(events_path + "watch_event/")
+        with open(events_path + "watch_event/config.yaml", "w") as file:
+            file.write("event_name: watch_event\nlight_curves:\n    - survey: OGLE\n      band: I\n"
+                       "      path: %swatch_event/lc.dat\n" % events_path)
+        with open(events_path + "watch_event/lc.dat", "w") as file:
+            file.write("2457000. 17. 0.01\n")
+
+        input_watcher = InputWatcher(["watch_event"], events_path, "yaml", debounce=0.2)
+        input_watcher.snapshot()
+        assert input_watcher.poll() == []
+
+        with open(events_path + "watch_event/lc.dat", "a") as file:
+            file.write("2457001. 17.1 0.01\n")
+        # the burst is not over yet
+        assert input_watcher.poll() == []
+        time.sleep(0.3)
+        assert input_watcher.poll() == ["watch_event"]
+        assert input_watcher.poll() == []
+
+    def test_watch_poll_interval(self):
+        import time
+        from MFPipeline.controller.watcher import WatchEventSource
+
+        class CountingWatcher:
+            polls = 0
+
+            def poll(self):
+                self.polls += 1
+                return ["event_%d" % self.polls]
+
+        class FakeController:
+            config = {}
+
+        counting_watcher = CountingWatcher()
+        source = WatchEventSource(FakeController(), counting_watcher, poll_interval=0.3)
+        assert source.next_event() == "event_1"
+        # queued events are returned between the polls, the inputs are not polled again
+        source.queue(["queued_event"])
+        for i in range(10):
+            source.next_event()
+        assert counting_watcher.polls == 1
+        assert "queued_event" in source.running
+
+        time.sleep(0.35)
+        assert source.next_event() == "event_2"
+        assert counting_watcher.polls == 2
+
+    def test_watch(self):
+        import shutil
+        import threading
+        from MFPipeline.controller.controller import Controller
+
+        events_path = "tests/test_controller/watch/"
+        shutil.rmtree(events_path, ignore_errors=True)
+        os.makedirs(events_path + "watch_event/")
+        with open(events_path + "watch_event/config.yaml", "w") as file:
+            file.write("event_name: watch_event\nra: 1.\ndec: 1.\nlc_analyst:\n    n_max: 10\n"
+                       "light_curves:\n    - survey: OGLE\n      band: I\n"
+                       "      path: %swatch_event/lc.dat\n" % events_path)
+        with open(events_path + "watch_event/lc.dat", "w") as file:
+            for time, mag, err in make_light_curve():
+                file.write("%f %f %f\n" % (time, mag, err))
+
+        def add_points():
+            with open(events_path + "watch_event/lc.dat", "a") as file:
+                file.write("2457030. 17.3 0.01\n")
+
+        config = controller_config(events_path, config_type="yaml", watch_debounce=0.2)
+
+        controller = Controller(["watch_event"], config_dict=config)
+        timer = threading.Timer(0.5, add_points)
+        timer.start()
+        records = controller.watch(duration=3.)
+        timer.join()
+
+        assert [record["event_name"] for record in records] == ["watch_event"]
+        assert os.path.isfile(events_path + "run_summary.json")
+
+class TestControllerBatches:
+    '''
+    Tests to check if controller sends chunks of events to one subprocess.
+    '''
+
+    def test_launch_batches(self, monkeypatch):
+        import shutil
+        from MFPipeline.controller.controller import Controller
+
+        event_list = ["batch_event_1", "batch_event_2", "batch_event_3"]
+        analyst_dicts = make_analyst_dicts(event_list)
+        config = controller_config("tests/test_controller/batches/", worker_mode="subprocess", batch_size=2)
+        shutil.rmtree(config["events_path"], ignore_errors=True)
+
+        # the subprocesses have to find the package even if it is not installed
+        monkeypatch.setenv("PYTHONPATH", os.getcwd())
+        controller = Controller(event_list, config_dict=config, analyst_dicts=analyst_dicts)
+        records = controller.launch_analysts()
+
+        assert [record["status"] for record in records] == ["finished", "finished", "finished"]
+        assert os.listdir("tests/test_controller/batches/spill/") == []
+
+    def test_crashed_batch(self):
+        import sys
+        import shutil
+        from MFPipeline.controller.controller import run_batch_analyst
+
+        spill_path = "tests/test_controller/batches/"
+        shutil.rmtree(spill_path, ignore_errors=True)
+        os.makedirs(spill_path)
+        results_path = spill_path + "results.jsonl"
+        # the chunk writes the record of its first event and dies on the second one
+        crash = "import json; file = open(%r, 'w'); " \
+                "file.write(json.dumps({'event_name': 'crash_1', 'status': 'finished'}) + '\\n'); " \
+                "file.close(); import os; os._exit(3)" % results_path
+        task = {"events": ["crash_1", "crash_2", "crash_3"],
+                "command": [sys.executable, "-c", crash],
+                "results_path": results_path,
+                "threads": 1,
+                }
+
+        records = run_batch_analyst(task)
+        assert [record["status"] for record in records] == ["finished", "failed", "failed"]
+        assert "code 3" in records[1]["error"]
+
+class TestControllerMemory:
+    '''
+    Tests to check if controller starts events only while they fit under the memory ceiling.
+    '''
+
+    def test_admits(self):
+        from MFPipeline.controller import memory
+
+        assert memory.tree_rss(os.getpid()) >= memory.process_rss(os.getpid()) > 0.
+        assert memory.estimate_event_memory({}, "event", 1024.) == 1024.
+        assert memory.estimate_event_memory({"a": 100., "b": 300., "c": 200.}, "event", 1024.) == 200.
+        assert memory.estimate_event_memory({"event": 50.}, "event", 1024.) == 50.
+
+        # running events have not reached their expected peaks yet
+        assert not memory.admits(1000., 300., 100., [400., 400.], 200.)
+        assert memory.admits(1000., 300., 100., [400.], 200.)
+        # the memory in use is larger than expected
+        assert not memory.admits(1000., 900., 100., [400.], 200.)
+
+    def test_in_process_estimates(self):
+        import time
+        from MFPipeline.controller import memory
+
+        with memory.RssSampler(interval=0.01) as sampler:
+            data = np.ones(50 * 2 ** 20 // 8)
+            time.sleep(0.1)
+        del data
+        assert 40. < sampler.memory < 500.
+
+        estimates_path = "tests/test_controller/memory/in_process_estimates.json"
+        os.makedirs(os.path.dirname(estimates_path), exist_ok=True)
+        if os.path.isfile(estimates_path):
+            os.remove(estimates_path)
+        # a warm worker keeps the high-water mark of its imports and earlier events
+        estimates = memory.update_estimates(estimates_path, [
+            {"event_name": "in_process", "status": "finished", "peak_rss": 3000., "event_memory": 120.},
+            {"event_name": "unmeasured", "status": "finished", "peak_rss": 3000., "event_memory": None},
+            {"event_name": "subprocess", "status": "finished", "peak_rss": 400.}])
+        assert estimates == {"in_process": 120., "subprocess": 400.}
+
+    def test_launch_with_memory_limit(self):
+        import shutil
+        from MFPipeline.controller.controller import Controller
+
+        event_list = ["memory_event_1", "memory_event_2"]
+        analyst_dicts = make_analyst_dicts(event_list)
+        # the memory limit is smaller than any event, the events have to run one by one
+        config = controller_config("tests/test_controller/memory/", group_processing_limit=2, memory_limit=1.)
+        shutil.rmtree(config["events_path"], ignore_errors=True)
+
+        controller = Controller(event_list, config_dict=config, analyst_dicts=analyst_dicts)
+        records = controller.launch_analysts()
+
+        assert [record["status"] for record in records] == ["finished", "finished"]
+        with open("tests/test_controller/memory/memory_estimates.json", "r") as file:
+            estimates = json.load(file)
+        assert sorted(estimates) == event_list
+
+class TestControllerJournal:
+    '''
+    Tests to check if an interrupted controller run can be resumed.
+    '''
+
+    def test_run_journal(self):
+        import shutil
+        from MFPipeline.controller.journal import RunJournal
+
+        shutil.rmtree("tests/test_controller/journal/", ignore_errors=True)
+        os.makedirs("tests/test_controller/journal/")
+        run_journal = RunJournal("tests/test_controller/journal/run_journal.jsonl")
+        run_journal.start_run(["event_1", "event_2", "event_3"])
+        run_journal.started(["event_1", "event_2", "event_3"])
+        run_journal.finished({"event_name": "event_1", "status": "finished"})
+        run_journal.finished({"event_name": "event_2", "status": "failed"})
+        # the controller was killed in the middle of a line
+        with open("tests/test_controller/journal/run_journal.jsonl", "a") as file:
+            file.write('{"entry": "finished", "event_name": "event_3", "rec')
+
+        assert list(run_journal.completed_records()) == ["event_1"]
+        assert run_journal.read()["event_3"]["entry"] == "started"
+
+    def test_resume(self):
+        import shutil
+        from MFPipeline.controller.controller import Controller
+        from MFPipeline.controller.journal import RunJournal
+
+        event_list = ["journal_event_1", "journal_event_2"]
+        analyst_dicts = make_analyst_dicts(event_list)
+        config = controller_config("tests/test_controller/journal/")
+        shutil.rmtree(config["events_path"], ignore_errors=True)
+        os.makedirs(config["events_path"])
+
+        # the previous run completed the first event and died while running the second one
+        run_journal = RunJournal("tests/test_controller/journal/run_journal.jsonl")
+        run_journal.start_run(event_list)
+        run_journal.started(event_list)
+        run_journal.finished({"event_name": "journal_event_1", "status": "finished", "exit_code": 0,
+                              "wall_time": 1., "cpu_time": 1., "peak_rss": 1., "outputs": []})
+
+        controller = Controller(event_list, config_dict=dict(config, resume=True), analyst_dicts=analyst_dicts)
+        records = controller.launch_analysts()
+
+        assert records[0]["resumed"]
+        assert "resumed" not in records[1]
+        assert records[1]["status"] == "finished"
+        assert sorted(run_journal.completed_records()) == event_list
+
+class TestControllerMetrics:
+    '''
+    Tests to check if controller exposes live metrics.
+    '''
+
+    def test_render_metrics(self):
+        import urllib.request
+        from MFPipeline.controller.metrics import ControllerMetrics, MetricsServer
+
+        controller_metrics = ControllerMetrics()
+        controller_metrics.set_state(5, 2)
+        controller_metrics.event_started(2)
+        controller_metrics.event_completed({"event_name": "event_1", "status": "finished", "wall_time": 3.,
+                                            "timings": [{"stage": "fit_PSPL_blend_piE", "seconds": 2.}]})
+        controller_metrics.event_completed({"event_name": "event_2", "status": "timeout", "wall_time": None})
+
+        text = controller_metrics.render()
+        assert "mfpipeline_queue_depth 5\n" in text
+        assert 'mfpipeline_events_completed_total{status="timeout"} 1\n' in text
+        assert 'mfpipeline_stage_seconds_bucket{stage="fit_PSPL_blend_piE",le="1"} 0\n' in text
+        assert 'mfpipeline_stage_seconds_bucket{stage="fit_PSPL_blend_piE",le="2.5"} 1\n' in text
+        assert 'mfpipeline_event_seconds_count 1\n' in text
+
+        server = MetricsServer(controller_metrics, 0, host="127.0.0.1")
+        server.start()
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % server.port) as response:
+                assert "mfpipeline_events_running 2" in response.read().decode("utf-8")
+        finally:
+            server.stop()
+
+    def test_metrics_file(self):
+        import shutil
+        from MFPipeline.controller.controller import Controller
+
+        analyst_dicts = make_analyst_dicts(["metrics_event"])
+        config = controller_config("tests/test_controller/metrics/",
+                                   metrics_path="tests/test_controller/metrics/controller.prom")
+        shutil.rmtree(config["events_path"], ignore_errors=True)
+
+        controller = Controller(["metrics_event"], config_dict=config, analyst_dicts=analyst_dicts)
+        record = controller.launch_analysts()[0]
+        assert [timing["stage"] for timing in record["timings"]] == ["lc_analyst"]
+
+        with open(config["metrics_path"], "r") as file:
+            text = file.read()
+        assert 'mfpipeline_events_completed_total{status="finished"} 1\n' in text
+        assert 'mfpipeline_stage_seconds_count{stage="lc_analyst"} 1\n' in text
+        assert "mfpipeline_queue_depth 0\n" in text
+
+class TestControllerPreClean:
+    '''
+    Tests to check if controller cleans the light curves of all events before dispatching.
+    '''
+
+    def test_pre_clean_light_curves(self):
+        from MFPipeline.controller.controller import Controller
+
+        light_curve = make_light_curve()
+        bad_light_curve = light_curve + [[2457000., 17., 0.01], [2457030., -99., 0.01], [2457031., 17., np.nan]]
+        analyst_dicts = {"clean_event": {"event_name": "clean_event", "ra": 1., "dec": 1.,
+                                         "light_curves": [{"survey": "OGLE", "band": "I", "lc": light_curve}]},
+                         "dirty_event": json.dumps({"event_name": "dirty_event", "ra": 1., "dec": 1.,
+                                                    "light_curves": [{"survey": "OGLE", "band": "I",
+                                                                      "lc": bad_light_curve},
+                                                                     {"survey": "ZTF", "band": "r",
+                                                                      "lc": light_curve}]})}
+        config = controller_config("tests/test_controller/pre_clean/", pre_clean={})
+
+        controller = Controller(list(analyst_dicts), config_dict=config, analyst_dicts=analyst_dicts)
+        controller.pre_clean_light_curves(list(analyst_dicts))
+
+        clean, dirty = controller.analyst_dicts["clean_event"], controller.analyst_dicts["dirty_event"]
+        assert np.array_equal(clean["light_curves"][0]["lc"], np.array(light_curve))
+        assert np.array_equal(dirty["light_curves"][0]["lc"], np.array(light_curve))
+        assert np.array_equal(dirty["light_curves"][1]["lc"], np.array(light_curve))
+        assert dirty["light_curves"][1]["survey"] == "ZTF"
+        assert isinstance(analyst_dicts["dirty_event"], str)
 
 # class TestControllerDicts:
 #     '''
@@ -167,3 +167,56 @@ def test_run():
     #     test.test_load_source_gaia()
     #     test.test_load_gaia()
     #     test.test_plot_gaia()
+
+def test_lc_analyst_time_limit(monkeypatch):
+    import time
+    from MFPipeline import timings
+    from MFPipeline.analyst.event_analyst import EventAnalyst
+    from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+    def slow_quality_check(self):
+        time.sleep(5.)
+
+    monkeypatch.setattr(LightCurveAnalyst, "perform_quality_check", slow_quality_check)
+    config = {"event_name": "Test_time_limit", "ra": 1., "dec": 1.,
+              "lc_analyst": {},
+              "light_curves": [{"survey": "OGLE", "band": "I",
+                                "lc": [[2457000. + i, 17., 0.01] for i in range(20)]}],
+              }
+    # the default number of stage workers
+    event_analyst = EventAnalyst(config["event_name"], "tests/test_event_analyst/time_limit/", "debug",
+                                 config_dict=config, stream=True, stage_timeouts={"lc_analyst": 0.2})
+    start = time.perf_counter()
+    status = event_analyst.run_single_analyst()
+
+    assert status is False
+    assert time.perf_counter() - start < 2.
+    assert [span["stage"] for span in timings.collect()] == ["lc_analyst"]
+
+# Cold-start budget of the Event Analyst, in units of the import time of numpy measured in the same interpreter,
+# so that a loaded machine slows down both; pyLIMA, astroquery, plotly or pandas alone take much longer.
+IMPORT_TIME_RATIO = 2.
+
+def test_import_time():
+    import os
+    import sys
+    import json
+    import subprocess
+
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            "import numpy\n"
+            "baseline = time.perf_counter() - start\n"
+            "start = time.perf_counter()\n"
+            "import MFPipeline.analyst.event_analyst\n"
+            "elapsed = time.perf_counter() - start\n"
+            "heavy = [name for name in ['pyLIMA', 'astroquery', 'plotly', 'matplotlib', 'pandas']\n"
+            "         if name in sys.modules]\n"
+            "print(json.dumps({'baseline': baseline, 'elapsed': elapsed, 'heavy': heavy}))\n")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.getcwd()
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+
+    assert result["heavy"] == []
+    assert result["elapsed"] < IMPORT_TIME_RATIO * result["baseline"]
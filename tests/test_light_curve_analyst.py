@@ -1,3 +1,6 @@
+import os
+import time
+import shutil
 import pytest
 import numpy as np
 
@@ -210,6 +213,377 @@ class testBadLightCurves():
         logs.close_log(log)
 
 
+class testDuplicateEntries():
+    def create_analyst(self, duplicates):
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+        config = {"event_name": "Test_duplicates", "ra": 1., "dec": 1.,
+                  "lc_analyst": {"duplicates": duplicates}}
+        log = logs.start_log("tests/test_lc_analyst/", "debug", event_name=config["event_name"])
+
+        return LightCurveAnalyst(config["event_name"], "tests/test_lc_analyst/", [], log, config_dict=config), log
+
+    def test_modes(self):
+        lc = np.array([[2457003., 17.3, 0.02],
+                       [2457000., 17.0, 0.05],
+                       [2457001., 17.1, 0.02],
+                       [2457000., 17.0, 0.01],
+                       [2457001.0001, 17.1, 0.01],
+                       [2457002., 17.2, 0.02],
+                       [2457000., 17.0, 0.03],
+                       ])
+
+        analyst, log = self.create_analyst({})
+        assert analyst.flag_duplicate_entries(lc).tolist() == [True, True, True, False, True, True, False]
+        logs.close_log(log)
+
+        analyst, log = self.create_analyst({"mode": "tolerance", "tolerance": 0.001})
+        assert analyst.flag_duplicate_entries(lc).tolist() == [True, True, True, False, False, True, False]
+        logs.close_log(log)
+
+        analyst, log = self.create_analyst({"mode": "best_error", "tolerance": 0.001})
+        assert analyst.flag_duplicate_entries(lc).tolist() == [True, False, False, True, True, True, False]
+        logs.close_log(log)
+
+    def test_large_light_curve(self):
+        import time
+
+        rng = np.random.default_rng(1)
+        times = np.round(2457000. + rng.uniform(0., 1000., 100000), 2)
+        lc = np.column_stack([times, np.full(len(times), 17.), rng.uniform(0.01, 0.1, len(times))])
+
+        analyst, log = self.create_analyst({})
+        start = time.perf_counter()
+        mask = analyst.flag_duplicate_entries(lc)
+        elapsed = time.perf_counter() - start
+        logs.close_log(log)
+
+        _, first_index = np.unique(times, return_index=True)
+        assert np.array_equal(np.flatnonzero(mask), np.sort(first_index))
+        assert elapsed < 1.
+
+
+class testQualityMask():
+    def test_quality_mask(self, checks=None):
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+        config = {"event_name": "Test_quality_mask", "ra": 1., "dec": 1., "lc_analyst": {}}
+        if checks is not None:
+            config["lc_analyst"]["checks"] = checks
+        light_curves = [{"survey": "Gaia", "band": "G",
+                         "lc": [[2457001., 17.0, 0.02], [2457001., 17.0, 0.02], [2457002., 99., 0.02],
+                                [2457003., 17.0, -0.02], [2457004., np.nan, 0.02]]},
+                        # same time as the first Gaia entry, but another telescope
+                        {"survey": "OGLE", "band": "I",
+                         "lc": [[2457001., 16.0, 0.01], [2457002., 16.0, np.inf]]},
+                        ]
+        log = logs.start_log("tests/test_lc_analyst/", "debug", event_name=config["event_name"])
+        analyst = LightCurveAnalyst(config["event_name"], "tests/test_lc_analyst/", light_curves, log,
+                                    config_dict=config)
+        status = analyst.perform_quality_check()
+        logs.close_log(log)
+
+        return status, analyst
+
+    def test_all_checks(self):
+        status, analyst = self.test_quality_mask()
+
+        assert status
+        assert analyst.rejections == {"finite": 2, "duplicates": 1, "magnitude_range": 2, "negative_errors": 1}
+        assert list(analyst.light_curves.offsets) == [0, 1, 2]
+        assert analyst.light_curves[0]["lc"].tolist() == [[2457001., 17.0, 0.02]]
+        assert analyst.light_curves[1]["lc"].tolist() == [[2457001., 16.0, 0.01]]
+
+    def test_selected_checks(self):
+        status, analyst = self.test_quality_mask(checks=["negative_errors", "duplicates"])
+
+        assert analyst.rejections == {"duplicates": 1, "negative_errors": 1}
+        assert list(analyst.light_curves.offsets) == [0, 3, 5]
+
+
+class testRobustChecks():
+    def create_light_curve(self, n_points):
+        rng = np.random.default_rng(2)
+        times = np.sort(rng.uniform(2457000., 2458000., n_points))
+        # microlensing-like bump on top of the baseline
+        mags = 17. - 1.5 * np.exp(-0.5 * ((times - 2457500.) / 20.) ** 2) + rng.normal(0., 0.01, n_points)
+        errors = np.full(n_points, 0.01)
+
+        return np.column_stack([times, mags, errors])
+
+    def test_robust_checks(self):
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+        lc = self.create_light_curve(2000)
+        lc[100, 1] -= 2.
+        lc[1500, 2] = 0.5
+        # -99 must not distort the statistics, it is rejected by the magnitude range check
+        lc[700, 1] = -99.
+
+        config = {"event_name": "Test_robust_checks", "ra": 1., "dec": 1.,
+                  "lc_analyst": {"checks": ["magnitude_range", "errorbars", "outliers"],
+                                 "outliers": {"window": 21, "sigma": 5.}}}
+        log = logs.start_log("tests/test_lc_analyst/", "debug", event_name=config["event_name"])
+        analyst = LightCurveAnalyst(config["event_name"], "tests/test_lc_analyst/",
+                                    [{"survey": "ZTF", "band": "r", "lc": lc}], log, config_dict=config)
+        mask = analyst.quality_mask()
+        logs.close_log(log)
+
+        assert np.flatnonzero(~mask).tolist() == [100, 700, 1500]
+        assert analyst.rejections == {"magnitude_range": 1, "errorbars": 1, "outliers": 1}
+
+    def test_large_light_curve(self):
+        import time
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+        lc = self.create_light_curve(100000)
+        config = {"event_name": "Test_robust_checks", "ra": 1., "dec": 1.,
+                  "lc_analyst": {"checks": ["errorbars", "outliers"]}}
+        log = logs.start_log("tests/test_lc_analyst/", "debug", event_name=config["event_name"])
+        analyst = LightCurveAnalyst(config["event_name"], "tests/test_lc_analyst/",
+                                    [{"survey": "ZTF", "band": "r", "lc": lc}], log, config_dict=config)
+        start = time.perf_counter()
+        mask = analyst.quality_mask()
+        elapsed = time.perf_counter() - start
+        logs.close_log(log)
+
+        assert np.count_nonzero(~mask) < 10
+        assert elapsed < 2.
+
+
+class testAdaptiveBinning():
+    def bin(self, lc, binning):
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+        config = {"event_name": "Test_binning", "ra": 1., "dec": 1.,
+                  "lc_analyst": {"binning": binning}}
+        log = logs.start_log("tests/test_lc_analyst/", "debug", event_name=config["event_name"])
+        analyst = LightCurveAnalyst(config["event_name"], "tests/test_lc_analyst/",
+                                    [{"survey": "ZTF", "band": "r", "lc": lc}], log, config_dict=config)
+        analyst.bin_light_curves()
+        logs.close_log(log)
+
+        return analyst
+
+    def test_peak_kept(self):
+        lc = testRobustChecks().create_light_curve(20000)
+        analyst = self.bin(lc, {"bin_size": 1., "threshold": 3., "margin": 5.})
+        binned = analyst.light_curves.light_curve(0)
+
+        # the peak keeps its full cadence, the baseline has at most one entry per day
+        peak = np.abs(lc[:, 0] - 2457500.) < 40.
+        assert np.all(np.isin(lc[peak, 0], binned[:, 0]))
+        assert len(binned) < np.count_nonzero(np.abs(lc[:, 0] - 2457500.) < 70.) + 1000
+        assert analyst.binning_report["n_points"] == 20000
+        assert analyst.binning_report["n_binned"] == len(binned)
+        assert analyst.binning_report["telescopes"][0]["n_binned"] == len(binned)
+        assert analyst.unbinned_light_curves.light_curve(0).shape == (20000, 3)
+
+    def test_weighted_mean(self):
+        lc = np.array([[2457000.1, 17., 0.02],
+                       [2457000.2, 17., 0.02],
+                       [2457001.5, 16., 0.01]])
+        analyst = self.bin(lc, {"bin_size": 1., "threshold": 1000.})
+        binned = analyst.light_curves.light_curve(0)
+
+        assert binned.shape == (2, 3)
+        assert np.allclose(binned[0], [2457000.15, 17., 0.02 / np.sqrt(2.)], rtol=1e-3)
+        assert np.allclose(binned[1], lc[2])
+
+
+class testBatchQualityCheck():
+    def test_batch_quality_check(self):
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst, batch_quality_check
+
+        rng = np.random.default_rng(4)
+        events = []
+        for i in range(20):
+            light_curves = []
+            for band in ["g", "r"]:
+                lc = testRobustChecks().create_light_curve(500)
+                lc[rng.integers(0, 500, 5), 1] = -99.
+                lc[rng.integers(0, 500, 5), 2] = np.nan
+                lc[rng.integers(0, 500, 5), 2] = -0.1
+                # the same time in both bands is not a duplicate
+                lc[1:10, 0] = lc[0, 0]
+                light_curves.append({"survey": "ZTF", "band": band, "lc": lc})
+            events.append(light_curves)
+
+        config = {"event_name": "Test_batch", "ra": 1., "dec": 1.,
+                  "lc_analyst": {"checks": ["finite", "duplicates", "magnitude_range", "negative_errors",
+                                            "errorbars", "outliers"]}}
+        log = logs.start_log("tests/test_lc_analyst/", "debug", event_name=config["event_name"])
+        cleaned, rejections = batch_quality_check(events, log, lc_config=config["lc_analyst"])
+
+        total = {}
+        for light_curves, batch_light_curves in zip(events, cleaned):
+            analyst = LightCurveAnalyst(config["event_name"], "tests/test_lc_analyst/", light_curves, log,
+                                        config_dict=config)
+            analyst.perform_quality_check()
+            assert np.array_equal(analyst.light_curves.data, batch_light_curves.data)
+            assert np.array_equal(analyst.light_curves.offsets, batch_light_curves.offsets)
+            for check in analyst.rejections:
+                total[check] = total.get(check, 0) + analyst.rejections[check]
+        logs.close_log(log)
+
+        assert rejections == total
+        assert rejections["duplicates"] == 20 * 2 * 9
+
+    def test_grouped_statistics(self):
+        import pandas as pd
+        from MFPipeline.analyst.light_curve_analyst import grouped_median, rolling_median
+
+        rng = np.random.default_rng(5)
+        counts = np.array([0, 1, 2, 5, 12, 100, 0, 37])
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        values = rng.normal(0., 1., offsets[-1])
+
+        medians = grouped_median(values, offsets)
+        for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+            if stop > start:
+                assert np.isclose(medians[i], np.median(values[start:stop]))
+            else:
+                assert np.isnan(medians[i])
+
+        for window in [4, 11]:
+            medians = rolling_median(values, offsets, window)
+            for start, stop in zip(offsets[:-1], offsets[1:]):
+                expected = pd.Series(values[start:stop]).rolling(window, center=True, min_periods=1).median()
+                assert np.allclose(medians[start:stop], expected.to_numpy())
+
+
+    def test_rolling_median_window(self):
+        import time
+        import pandas as pd
+        from MFPipeline.analyst.light_curve_analyst import rolling_median
+
+        rng = np.random.default_rng(6)
+        counts = np.array([100000, 3, 0, 100000])
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        values = rng.normal(0., 1., offsets[-1])
+
+        durations = {}
+        for window in [11, 501]:
+            durations[window] = []
+            for repeat in range(3):
+                start_time = time.perf_counter()
+                medians = rolling_median(values, offsets, window)
+                durations[window].append(time.perf_counter() - start_time)
+            for start, stop in zip(offsets[:-1], offsets[1:]):
+                expected = pd.Series(values[start:stop]).rolling(window, center=True, min_periods=1).median()
+                assert np.allclose(medians[start:stop], expected.to_numpy())
+
+        # O(n log w): a window 45 times longer costs only a few times more, sorting every window would cost ~50x
+        assert min(durations[501]) < 5. * min(durations[11]) + 0.05
+
+class testIncrementalQualityCheck():
+    config = {"event_name": "Test_incremental", "ra": 1., "dec": 1.,
+              "lc_analyst": {"checks": ["finite", "duplicates", "magnitude_range", "negative_errors",
+                                        "errorbars", "outliers"],
+                             "duplicates": {"mode": "tolerance", "tolerance": 1e-4}}}
+
+    def check(self, lc, analyst_path, incremental=True):
+        from MFPipeline.analyst.light_curve_analyst import LightCurveAnalyst
+
+        config = dict(self.config, lc_analyst=dict(self.config["lc_analyst"], incremental=incremental))
+        log = logs.start_log(analyst_path, "debug", event_name=config["event_name"])
+        analyst = LightCurveAnalyst(config["event_name"], analyst_path,
+                                    [{"survey": "ZTF", "band": "r", "lc": lc}], log, config_dict=config)
+        full_checks = []
+        full_quality_mask = analyst.quality_mask
+        analyst.quality_mask = lambda **kwargs: full_checks.append(True) or full_quality_mask(**kwargs)
+        analyst.perform_quality_check()
+        logs.close_log(log)
+
+        return analyst, len(full_checks) > 0
+
+    def create_analyst_path(self, name):
+        analyst_path = "tests/test_lc_analyst/%s/" % name
+        shutil.rmtree(analyst_path, ignore_errors=True)
+        os.makedirs(analyst_path)
+
+        return analyst_path
+
+    def test_appended_entries(self):
+        analyst_path = self.create_analyst_path("incremental")
+        lc = testRobustChecks().create_light_curve(5000)
+        lc[100, 1] = -99.
+        lc[200, 1] -= 2.
+        # outliers right before and after the first appended block
+        lc[4898, 1] -= 0.5
+        lc[4901, 1] += 0.5
+        lc[4950, 1] = np.nan
+        lc[4960, 0] = lc[4959, 0] + 1e-5
+        lc[4970, 1] -= 2.
+        lc[4980, 2] = 0.5
+
+        analyst, full_check = self.check(lc[:4900], analyst_path)
+        assert full_check
+        for stop in [4903, 4950, 5000]:
+            analyst, full_check = self.check(lc[:stop], analyst_path)
+            assert not full_check
+            full_analyst, _ = self.check(lc[:stop], self.create_analyst_path("incremental_full"),
+                                         incremental=False)
+            assert np.array_equal(analyst.light_curves.data, full_analyst.light_curves.data)
+            assert analyst.rejections == full_analyst.rejections
+        assert analyst.rejections["duplicates"] == 1
+        assert os.path.getsize(analyst_path + "quality_state/mask_0.bin") == 5000
+
+        # a light curve that does not start with the checked entries is checked again
+        analyst, full_check = self.check(lc[:4990], analyst_path)
+        assert full_check
+        lc[4989, 1] += 0.1
+        analyst, full_check = self.check(lc, analyst_path)
+        assert full_check
+
+    def test_tail_re_evaluated(self):
+        analyst_path = self.create_analyst_path("incremental_tail")
+        lc = testRobustChecks().create_light_curve(400)[:310]
+        # a step at the end of the history looks like outliers until the new entries continue it
+        lc[298:, 1] += 0.3
+
+        analyst, _ = self.check(lc[:300], analyst_path)
+        rejected = analyst.rejections["outliers"]
+        analyst, full_check = self.check(lc, analyst_path)
+        full_analyst, _ = self.check(lc, self.create_analyst_path("incremental_tail_full"), incremental=False)
+
+        assert not full_check
+        assert analyst.rejections == full_analyst.rejections
+        assert analyst.rejections["outliers"] == rejected - 2
+        assert np.array_equal(analyst.light_curves.data, full_analyst.light_curves.data)
+        assert np.fromfile(analyst_path + "quality_state/mask_0.bin", dtype=np.uint8)[298:].all()
+
+    def test_work(self):
+        window = 11
+        work, state_sizes = [], []
+        for n_points in [10000, 200000]:
+            analyst_path = self.create_analyst_path("incremental_%d" % n_points)
+            lc = testRobustChecks().create_light_curve(n_points)
+            self.check(lc[:-10], analyst_path)
+            analyst, full_check = self.check(lc, analyst_path)
+            assert not full_check
+            work.append(analyst.incremental_entries)
+            state_sizes.append(os.path.getsize(analyst_path + "quality_state/state.json"))
+
+        # the new entries and the tail entries next to them, whatever the length of the history
+        assert work == [10 + window, 10 + window]
+        assert max(state_sizes) < 2 * min(state_sizes)
+
+    def test_stats_refresh(self):
+        from MFPipeline.analyst.light_curve_analyst import STATS_REFRESH_FRACTION
+
+        analyst_path = self.create_analyst_path("incremental_refresh")
+        lc = testRobustChecks().create_light_curve(2000)
+        n_history = 1000
+        n_new = int(STATS_REFRESH_FRACTION * n_history)
+        self.check(lc[:n_history], analyst_path)
+        analyst, full_check = self.check(lc[:n_history + n_new // 2], analyst_path)
+        assert not full_check
+        # the error statistics are computed again after enough new entries
+        analyst, full_check = self.check(lc[:n_history + 2 * n_new], analyst_path)
+        assert full_check
+
+
 def test_run():
     case = scenario_gaia
     test = testLCAnalyst(case)
@@ -221,4 +595,31 @@ def test_run():
     test.test_run_analyst()
 
     test = testBadLightCurves()
-    test.test_bad_lc()
\ No newline at end of file
+    test.test_bad_lc()
+
+    test = testDuplicateEntries()
+    test.test_modes()
+    test.test_large_light_curve()
+
+    test = testQualityMask()
+    test.test_all_checks()
+    test.test_selected_checks()
+
+    test = testRobustChecks()
+    test.test_robust_checks()
+    test.test_large_light_curve()
+
+    test = testAdaptiveBinning()
+    test.test_peak_kept()
+    test.test_weighted_mean()
+
+    test = testBatchQualityCheck()
+    test.test_batch_quality_check()
+    test.test_grouped_statistics()
+    test.test_rolling_median_window()
+
+    test = testIncrementalQualityCheck()
+    test.test_appended_entries()
+    test.test_tail_re_evaluated()
+    test.test_work()
+    test.test_stats_refresh()
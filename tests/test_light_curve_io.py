@@ -0,0 +1,49 @@
+import os
+import numpy as np
+
+from MFPipeline.analyst import light_curve_io
+
+
+class TestLightCurveIO:
+    '''
+    Class with tests of reading light curves from text files
+    '''
+    def write_light_curve(self, path, n_points):
+        times = 2457000. + np.arange(n_points) * 0.5
+        light_curve = np.column_stack([times, 16. + 0.01 * np.sin(times), np.full(n_points, 0.02)])
+        with open(path, "w") as file:
+            file.write("# time mag err flag\n")
+            for row in light_curve:
+                file.write("%.6f %.6f\t%.6f 0\n" % tuple(row))
+
+        return light_curve
+
+    def test_read_text(self, tmp_path):
+        path = str(tmp_path / "lc.dat")
+        expected = self.write_light_curve(path, 50)
+
+        light_curve = light_curve_io.load_light_curve(path, cache_path=False)
+
+        assert light_curve.shape == (50, 3)
+        assert np.allclose(light_curve, expected)
+        assert not os.path.isdir(str(tmp_path / light_curve_io.CACHE_FOLDER))
+
+    def test_binary_cache(self, tmp_path):
+        path = str(tmp_path / "lc.dat")
+        expected = self.write_light_curve(path, 50)
+
+        parsed = light_curve_io.load_light_curve(path)
+        cached = light_curve_io.load_light_curve(path)
+
+        assert isinstance(cached, np.memmap)
+        assert np.array_equal(parsed, cached)
+        assert np.allclose(cached, expected)
+
+        # a new version of the file replaces the old copy
+        expected = self.write_light_curve(path, 70)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+        updated = light_curve_io.load_light_curve(path)
+
+        assert updated.shape == (70, 3)
+        assert np.allclose(updated, expected)
+        assert len(os.listdir(str(tmp_path / light_curve_io.CACHE_FOLDER))) == 1
@@ -0,0 +1,73 @@
+import numpy as np
+
+from MFPipeline.analyst.light_curve_set import LightCurveSet
+
+light_curves = [
+    {"survey": "Gaia", "band": "G",
+     "lc": [[2457000., 16.1, 0.02], [2457001., 16.2, 0.02], [2457002., 16.3, 0.03]]},
+    {"survey": "OGLE", "band": "I", "lc": np.empty((0, 3))},
+    {"survey": "ZTF", "band": "r", "lc": np.array([[2457000.5, 17.1, 0.05], [2457001.5, 17.2, -0.05]])},
+]
+
+
+class TestLightCurveSet:
+    '''
+    Class with tests of the columnar light curve container
+    '''
+    def test_views(self):
+        light_curve_set = LightCurveSet.from_entries(light_curves)
+
+        assert light_curve_set.data.shape == (3, 5)
+        assert list(light_curve_set.offsets) == [0, 3, 3, 5]
+        assert list(light_curve_set.telescope) == [0, 0, 0, 2, 2]
+        assert LightCurveSet.from_entries(light_curve_set) is light_curve_set
+
+        for entry, original in zip(light_curve_set, light_curves):
+            assert entry["survey"] == original["survey"]
+            assert entry["band"] == original["band"]
+            assert np.array_equal(entry["lc"], np.asarray(original["lc"]).reshape(-1, 3))
+            assert entry["lc"].size == 0 or np.shares_memory(entry["lc"], light_curve_set.data)
+
+    def test_select(self):
+        light_curve_set = LightCurveSet.from_entries(light_curves)
+        selected = light_curve_set.select(light_curve_set.err > 0)
+
+        assert list(selected.offsets) == [0, 3, 3, 4]
+        assert selected[2]["lc"].tolist() == [[2457000.5, 17.1, 0.05]]
+        assert len(selected) == 3
+
+    def test_save_load(self, tmp_path):
+        light_curve_set = LightCurveSet.from_entries(light_curves)
+        path = str(tmp_path / "light_curves.npz")
+        light_curve_set.save(path)
+        loaded = LightCurveSet.load(path)
+
+        assert np.array_equal(loaded.data, light_curve_set.data)
+        assert np.array_equal(loaded.offsets, light_curve_set.offsets)
+        assert loaded.surveys == ["Gaia", "OGLE", "ZTF"]
+        assert loaded.bands == ["G", "I", "r"]
+
+    def test_memory_mapped(self, tmp_path):
+        path = str(tmp_path / "light_curve.npy")
+        np.save(path, np.asarray(light_curves[0]["lc"]))
+        light_curve = np.load(path, mmap_mode="r")
+        light_curve_set = LightCurveSet.from_entries([{"survey": "Gaia", "band": "G", "lc": light_curve}])
+
+        # a single spilled light curve is not copied
+        assert np.shares_memory(light_curve_set.data, light_curve)
+        assert list(light_curve_set.offsets) == [0, 3]
+        assert np.array_equal(light_curve_set[0]["lc"], light_curve)
+        selected = light_curve_set.select(light_curve_set.mag > 16.15)
+        assert selected[0]["lc"].tolist() == light_curves[0]["lc"][1:]
+
+    def test_wrong_shape(self):
+        import pytest
+
+        # times, magnitudes and errors in rows instead of columns
+        transposed = np.array([[1., 2., 3., 4.], [16.1, 16.2, 16.3, 16.4], [0.02, 0.02, 0.03, 0.03]])
+        with pytest.raises(ValueError, match="Gaia G"):
+            LightCurveSet.from_entries([{"survey": "Gaia", "band": "G", "lc": transposed}])
+        with pytest.raises(ValueError, match="OGLE I"):
+            LightCurveSet.from_entries([light_curves[0], {"survey": "OGLE", "band": "I", "lc": [1., 2., 3.]}])
+
+        assert len(LightCurveSet.from_entries([{"survey": "OGLE", "band": "I", "lc": []}]).time) == 0
@@ -0,0 +1,66 @@
+import time
+import logging
+import threading
+
+from MFPipeline.analyst.stage_graph import StageGraph
+
+
+class TestStageGraph:
+    '''
+    Class with tests of the dependency graph of the Event Analyst stages
+    '''
+    def test_background_stages_overlap(self):
+        log = logging.getLogger("test_stage_graph")
+        started = threading.Event()
+        events = []
+
+        def background():
+            started.set()
+            time.sleep(0.2)
+            events.append("background")
+
+        def foreground():
+            # the background stage is already running while the main thread works
+            assert started.wait(5)
+            events.append("foreground")
+
+        graph = StageGraph(log, max_workers=2)
+        graph.add_stage("background", background)
+        graph.add_stage("foreground", foreground, main_thread=True)
+        graph.add_stage("last", lambda: events.append("last"), after=["background", "foreground"],
+                        main_thread=True)
+        statuses = graph.run()
+
+        assert statuses == {"background": True, "foreground": True, "last": True}
+        assert events == ["foreground", "background", "last"]
+
+    def test_failed_requirement_skips_stage(self):
+        log = logging.getLogger("test_stage_graph")
+        events = []
+
+        def failing():
+            raise ValueError("no light curves")
+
+        graph = StageGraph(log, max_workers=2)
+        graph.add_stage("fit", failing, main_thread=True)
+        graph.add_stage("catalogues", lambda: False)
+        graph.add_stage("cmd", lambda: events.append("cmd"), requires=["fit"], after=["catalogues"])
+        graph.add_stage("report", lambda: events.append("report"), after=["cmd"])
+        statuses = graph.run()
+
+        assert statuses == {"fit": False, "catalogues": False, "cmd": False, "report": True}
+        assert graph.skipped == ["cmd"]
+        assert events == ["report"]
+
+    def test_sequential(self):
+        log = logging.getLogger("test_stage_graph")
+        threads = []
+
+        graph = StageGraph(log, max_workers=0)
+        for name in ["lc", "catalogues", "fit"]:
+            graph.add_stage(name, lambda: threads.append(threading.current_thread()))
+        graph.add_stage("missing", lambda: True, requires=["not_in_graph"])
+        statuses = graph.run()
+
+        assert threads == [threading.current_thread()] * 3
+        assert statuses["missing"] is False
@@ -0,0 +1,56 @@
+import numpy as np
+
+from MFPipeline import timings
+
+
+class TestTimings:
+    '''
+    Class with tests of the spans recorded for the stages of an event
+    '''
+    def test_nested_spans(self, tmp_path):
+        timings.reset()
+        with timings.stage_timer("fit_analyst"):
+            with timings.stage_timer("fit_PSPL_no_blend_no_piE"):
+                with timings.stage_timer("fit"):
+                    np.linalg.inv(np.eye(50) * 2.)
+            with timings.stage_timer("ongoing_check"):
+                pass
+
+        spans = timings.collect()
+        assert [span["stage"] for span in spans] == ["fit", "fit_PSPL_no_blend_no_piE", "ongoing_check",
+                                                     "fit_analyst"]
+        assert [span["parent"] for span in spans] == ["fit_PSPL_no_blend_no_piE", "fit_analyst", "fit_analyst",
+                                                      None]
+        assert all(span["seconds"] >= 0. and span["cpu_seconds"] >= 0. for span in spans)
+        assert all("allocated_mb" not in span for span in spans)
+
+        path = str(tmp_path / "timings.json")
+        timings.save(path)
+        assert timings.load(path) == spans
+
+    def test_allocations(self, tmp_path):
+        timings.reset(trace_allocations=True)
+        with timings.stage_timer("cmd_analyst"):
+            with timings.stage_timer("cmd_query"):
+                data = [float(i) for i in range(200000)]
+            del data
+        timings.save(str(tmp_path / "timings.json"))
+
+        spans = {span["stage"]: span for span in timings.collect()}
+        # 200000 floats and the list take several MB
+        assert spans["cmd_query"]["allocated_mb"] > 3.
+        assert spans["cmd_analyst"]["allocated_mb"] >= spans["cmd_query"]["allocated_mb"]
+        timings.reset()
+
+    def test_aggregate(self):
+        event_timings = [[{"stage": "fit", "seconds": 2., "cpu_seconds": 1.5, "parent": "fit_PSPL"},
+                          {"stage": "cmd_query", "seconds": 4., "cpu_seconds": 0.1, "parent": "cmd_catalogues"}],
+                         [{"stage": "fit", "seconds": 6., "cpu_seconds": 5.5, "parent": "fit_PSPL"}],
+                         # timings saved before CPU time was recorded
+                         [{"stage": "fit", "seconds": 1.}],
+                         ]
+        stages = timings.aggregate(event_timings)
+
+        assert stages["fit"] == {"count": 3, "seconds": 9., "cpu_seconds": 7., "max_seconds": 6.,
+                                 "mean_seconds": 3.}
+        assert stages["cmd_query"]["count"] == 1